@@ -1,4 +1,5 @@
-from flask import Flask
+from flask import Flask, Response
+from metrics import METRICS_FILE
 app = Flask(__name__)
 
 @app.route('/')
@@ -6,5 +7,16 @@ def hello_world():
     return 'https://t.me/roxybasicneedbot1'
 
 
+@app.route('/metrics')
+def prometheus_metrics():
+    # written periodically by the bot process (main.py -> metrics.exporter)
+    try:
+        with open(METRICS_FILE) as f:
+            body = f.read()
+    except OSError:
+        body = "# bot has not exported metrics yet\n"
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == "__main__":
     app.run()
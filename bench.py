@@ -0,0 +1,672 @@
+# Offline benchmarks for the download/upload path.
+#
+# Everything runs against local stand-ins, so no network or Telegram account
+# is needed: SyntheticServer is an aiohttp server that serves deterministic
+# files (optionally throttled per connection, with or without Range support,
+# failing or cutting off a share of requests) and HLS playlists, and
+# FakeClient takes the place of the Pyrogram client with a configurable
+# upload latency/bandwidth and occasional FloodWait. Each scenario runs one
+# real code path (core.direct_download_video, core.download_with_requests,
+# tgupload's part uploader, the batch pipeline, ...) and records throughput,
+# per-item latency, peak RSS and event-loop lag. Results are written as JSON;
+# --compare prints the change against an earlier run and exits non-zero on a
+# regression beyond --tolerance.
+#
+#   python bench.py                       # all scenarios, JSON to stdout
+#   python bench.py -s direct_segmented -s pipeline --out now.json --compare base.json
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import contextlib
+import tempfile
+import subprocess
+from typing import Dict, List, Optional
+
+from aiohttp import web
+from pyrogram import raw
+from pyrogram.enums import ParseMode
+from pyrogram.parser import Parser
+from pyrogram.errors import FloodWait
+
+import core
+import tgupload
+import httpclient
+from pipeline import BatchPipeline
+
+MIB = 1024 * 1024
+CHUNK = 64 * 1024
+# byte i of every synthetic file is i % 251, so any range can be produced and checked
+_PERIOD = 251
+_PATTERN = bytes(i % _PERIOD for i in range(CHUNK + _PERIOD))
+
+
+def synthetic(offset: int, length: int) -> bytes:
+    out = bytearray()
+    while length > 0:
+        n = min(length, CHUNK)
+        start = offset % _PERIOD
+        out += _PATTERN[start:start + n]
+        offset += n
+        length -= n
+    return bytes(out)
+
+
+def verify(path: Optional[str], size: int) -> bool:
+    """The file is exactly the synthetic content of ``size`` bytes."""
+    if not path or not os.path.exists(path) or os.path.getsize(path) != size:
+        return False
+    with open(path, "rb") as f:
+        offset = 0
+        while True:
+            block = f.read(MIB)
+            if not block:
+                return offset == size
+            if block != synthetic(offset, len(block)):
+                return False
+            offset += len(block)
+
+
+# -------------------------
+# local HTTP server
+# -------------------------
+class SyntheticServer:
+    """
+    Serves /files/<size>/<name>.mp4 and /hls/<segments>/... on 127.0.0.1.
+
+    Query parameters shape each response, so one server covers all scenarios:
+    ``rate`` (bytes/s per connection), ``ranges=0`` (ignore Range headers),
+    ``fail`` (share of GETs answered with 503), ``cut`` (share of GETs closed
+    halfway through the body), ``seg`` (HLS segment size in bytes).
+    """
+
+    def __init__(self, seed: int = 1):
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.bytes_sent = 0
+        self.url = None
+        self._runner = None
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_get("/files/{size}/{name}", self._file)
+        app.router.add_get("/hls/{segments}/master.m3u8", self._master)
+        app.router.add_get("/hls/{segments}/{height}/index.m3u8", self._media)
+        app.router.add_get("/hls/{segments}/{height}/{index}.ts", self._segment)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def _roll(self, request, name: str) -> bool:
+        share = float(request.query.get(name, 0) or 0)
+        return share > 0 and self.rng.random() < share
+
+    async def _send(self, request, total: int, content_type: str, offset_of=None) -> web.StreamResponse:
+        """Body of ``total`` synthetic bytes, honouring Range/rate/fail/cut."""
+        self.requests += 1
+        ranges = request.query.get("ranges", "1") != "0"
+        start, end, status = 0, total - 1, 200
+        header = request.headers.get("Range", "")
+        if ranges and header.startswith("bytes="):
+            first, _, last = header[6:].partition("-")
+            start = int(first or 0)
+            end = min(int(last), total - 1) if last else total - 1
+            if start > end:
+                return web.Response(status=416, headers={"Content-Range": f"bytes */{total}"})
+            status = 206
+        headers = {"Content-Type": content_type, "Content-Length": str(end - start + 1),
+                   "ETag": f'"{total}"', "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}
+        if ranges:
+            headers["Accept-Ranges"] = "bytes"
+        if status == 206:
+            headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+        if request.method == "HEAD":
+            return web.Response(status=status, headers=headers)
+        if self._roll(request, "fail"):
+            return web.Response(status=503, text="synthetic failure")
+        resp = web.StreamResponse(status=status, headers=headers)
+        await resp.prepare(request)
+        rate = float(request.query.get("rate", 0) or 0)
+        cut_at = end + 1 if not self._roll(request, "cut") else start + (end - start + 1) // 2
+        base = offset_of or 0
+        pos = start
+        while pos <= end:
+            n = min(CHUNK, end + 1 - pos)
+            if pos + n > cut_at:
+                # drop the connection mid-body, like a flaky CDN
+                request.transport.close()
+                return resp
+            await resp.write(synthetic(base + pos, n))
+            self.bytes_sent += n
+            pos += n
+            if rate:
+                await asyncio.sleep(n / rate)
+        await resp.write_eof()
+        return resp
+
+    async def _file(self, request):
+        return await self._send(request, int(request.match_info["size"]), "video/mp4")
+
+    async def _master(self, request):
+        segments = request.match_info["segments"]
+        query = f"?{request.query_string}" if request.query_string else ""
+        lines = ["#EXTM3U"]
+        for height, bandwidth in ((360, 800_000), (720, 2_800_000)):
+            lines += [f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={height * 16 // 9}x{height}",
+                      f"/hls/{segments}/{height}/index.m3u8{query}"]
+        return web.Response(text="\n".join(lines) + "\n", content_type="application/vnd.apple.mpegurl")
+
+    async def _media(self, request):
+        segments, height = int(request.match_info["segments"]), request.match_info["height"]
+        query = f"?{request.query_string}" if request.query_string else ""
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for i in range(segments):
+            lines += ["#EXTINF:4.0,", f"/hls/{segments}/{height}/{i}.ts{query}"]
+        lines.append("#EXT-X-ENDLIST")
+        return web.Response(text="\n".join(lines) + "\n", content_type="application/vnd.apple.mpegurl")
+
+    async def _segment(self, request):
+        size = int(request.query.get("seg", 256 * 1024) or 256 * 1024)
+        # segments continue one synthetic stream, so the joined file verifies like a plain one
+        offset = int(request.match_info["index"]) * size
+        return await self._send(request, size, "video/mp2t", offset_of=offset)
+
+    def file_url(self, size: int, name: str = "video.mp4", **query) -> str:
+        qs = "&".join(f"{k}={v}" for k, v in query.items() if v not in (None, ""))
+        return f"{self.url}/files/{size}/{name}" + (f"?{qs}" if qs else "")
+
+    def hls_url(self, segments: int, **query) -> str:
+        qs = "&".join(f"{k}={v}" for k, v in query.items() if v not in (None, ""))
+        return f"{self.url}/hls/{segments}/master.m3u8" + (f"?{qs}" if qs else "")
+
+
+# -------------------------
+# fake Telegram client
+# -------------------------
+class FakeMessage:
+    _ids = 0
+
+    def __init__(self, chat_id, text=""):
+        FakeMessage._ids += 1
+        self.id = FakeMessage._ids
+        self.chat = type("Chat", (), {"id": chat_id})()
+        self.text = text
+        self.video = self.document = self.photo = None
+
+    async def edit(self, text, *args, **kwargs):
+        self.text = text
+        return self
+
+    async def delete(self, *args, **kwargs):
+        return True
+
+
+class FakeSession:
+    """Media session stand-in: every saveFilePart costs latency + size/bandwidth."""
+
+    def __init__(self, client: "FakeClient"):
+        self.client = client
+
+    async def invoke(self, rpc):
+        data = getattr(rpc, "bytes", b"") or b""
+        await self.client.transfer(len(data))
+        return True
+
+    async def stop(self):
+        pass
+
+
+class FakeClient:
+    """
+    Enough of pyrogram.Client for the upload paths: each call waits
+    ``latency`` plus size/``bandwidth`` and raises FloodWait(``flood_wait``)
+    with probability ``flood_rate``.
+    """
+
+    def __init__(self, latency: float = 0.05, bandwidth: float = 20 * MIB, flood_rate: float = 0.0,
+                 flood_wait: int = 1, seed: int = 2):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.flood_rate = flood_rate
+        self.flood_wait = flood_wait
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.floods = 0
+        self.uploaded = 0
+        # send_uploaded parses captions through the client's parser
+        self.parse_mode = ParseMode.DISABLED
+        self.parser = Parser(self)
+
+    async def transfer(self, nbytes: int = 0):
+        self.calls += 1
+        if self.flood_rate and self.rng.random() < self.flood_rate:
+            self.floods += 1
+            raise FloodWait(value=self.flood_wait)
+        await asyncio.sleep(self.latency + (nbytes / self.bandwidth if self.bandwidth else 0))
+        self.uploaded += nbytes
+
+    def rnd_id(self) -> int:
+        return self.rng.getrandbits(63)
+
+    async def resolve_peer(self, chat_id):
+        return raw.types.InputPeerSelf()
+
+    async def invoke(self, query, *args, **kwargs):
+        await self.transfer()
+        return raw.types.Updates(updates=[], users=[], chats=[], date=0, seq=0)
+
+    async def save_file(self, path, *args, **kwargs):
+        await self.transfer(os.path.getsize(path))
+        return None
+
+    async def send_message(self, chat_id, text, *args, **kwargs):
+        await self.transfer()
+        return FakeMessage(chat_id, text)
+
+    async def _send_file(self, chat_id, path, progress=None, progress_args=(), **kwargs):
+        size = os.path.getsize(path) if isinstance(path, str) and os.path.exists(path) else 0
+        await self.transfer(size)
+        if progress:
+            await progress(size, size, *progress_args)
+        return FakeMessage(chat_id)
+
+    async def send_video(self, chat_id, video, *args, **kwargs):
+        return await self._send_file(chat_id, video, **kwargs)
+
+    async def send_document(self, chat_id, document, *args, **kwargs):
+        return await self._send_file(chat_id, document, **kwargs)
+
+    async def send_cached_media(self, chat_id, file_id, *args, **kwargs):
+        await self.transfer()
+        return FakeMessage(chat_id)
+
+
+class fake_media_sessions:
+    """Route tgupload's media sessions to the fake client for the duration of a block."""
+
+    def __init__(self):
+        self._saved = None
+
+    def __enter__(self):
+        self._saved = tgupload._media_session
+
+        async def _session(client):
+            return FakeSession(client)
+        tgupload._media_session = _session
+        return self
+
+    def __exit__(self, *exc):
+        tgupload._media_session = self._saved
+
+
+# -------------------------
+# measurement
+# -------------------------
+def _rss() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class Monitor:
+    """Samples event-loop lag and RSS while a scenario runs."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: List[float] = []
+        self.peak_rss = 0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - expected))
+            self.peak_rss = max(self.peak_rss, _rss())
+
+    async def __aenter__(self):
+        self.peak_rss = _rss()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def result(self) -> dict:
+        return {
+            "peak_rss_mib": round(self.peak_rss / MIB, 1),
+            "loop_lag_ms_p99": round((_percentile(self.lags, 0.99) or 0) * 1000, 2),
+            "loop_lag_ms_max": round(max(self.lags, default=0) * 1000, 2),
+        }
+
+
+def _report(seconds: float, nbytes: int, latencies: List[float], ok: int, items: int, monitor: Monitor, **extra) -> dict:
+    return {
+        "items": items,
+        "ok": ok,
+        "bytes": nbytes,
+        "seconds": round(seconds, 3),
+        "throughput_mib_s": round(nbytes / seconds / MIB, 2) if seconds else None,
+        "latency_s_p50": round(_percentile(latencies, 0.5) or 0, 3),
+        "latency_s_p95": round(_percentile(latencies, 0.95) or 0, 3),
+        "latency_s_max": round(max(latencies, default=0), 3),
+        **monitor.result(),
+        **extra,
+    }
+
+
+async def _run_items(fetch, items: int, concurrency: int):
+    """Run fetch(i) for every item with bounded concurrency; returns (seconds, [(latency, result)])."""
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            started = time.perf_counter()
+            try:
+                result = await fetch(i)
+            except Exception as e:
+                result = e
+            return time.perf_counter() - started, result
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(items)))
+    return time.perf_counter() - started, results
+
+
+# -------------------------
+# scenarios
+# -------------------------
+class Bench:
+    def __init__(self, server: SyntheticServer, workdir: str, items: int, size: int, concurrency: int):
+        self.server = server
+        self.workdir = workdir
+        self.items = items
+        self.size = size
+        self.concurrency = concurrency
+
+    def _dir(self, name: str) -> str:
+        path = os.path.join(self.workdir, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    async def _downloads(self, name: str, fetch, **query) -> dict:
+        folder = self._dir(name)
+        sent_before = self.server.requests
+
+        async def one(i):
+            return await fetch(self.server.file_url(self.size, f"{name}_{i}.mp4", **query), os.path.join(folder, f"{i}"))
+
+        async with Monitor() as mon:
+            seconds, results = await _run_items(one, self.items, self.concurrency)
+        paths = [r for _, r in results if isinstance(r, str)]
+        ok = sum(verify(p, self.size) for p in paths)
+        return _report(seconds, ok * self.size, [lat for lat, _ in results], ok, self.items, mon,
+                       requests=self.server.requests - sent_before)
+
+    async def direct_segmented(self):
+        """core.direct_download_video on a Range-capable server (parallel segments)."""
+        return await self._downloads("direct_segmented", core.direct_download_video)
+
+    async def direct_single(self):
+        """core.direct_download_video when the server ignores Range (one stream)."""
+        return await self._downloads("direct_single", core.direct_download_video, ranges=0)
+
+    async def direct_throttled(self):
+        """Per-connection rate limit of 4 MiB/s: shows what segmenting buys on a slow CDN."""
+        return await self._downloads("direct_throttled", core.direct_download_video, rate=4 * MIB)
+
+    async def direct_flaky(self):
+        """5% of requests fail and 5% are cut off halfway; retries and resume must cope."""
+        return await self._downloads("direct_flaky", core.direct_download_video, fail=0.05, cut=0.05)
+
+    async def plain_fallback(self):
+        """core.download_with_requests, the last-resort single stream."""
+        async def fetch(url, stem):
+            return await core.download_with_requests(url, f"{stem}.mp4")
+        return await self._downloads("plain_fallback", fetch)
+
+    def _hls_source(self):
+        seg = 256 * 1024
+        segments = max(1, self.size // seg)
+        return self.server.hls_url(segments, seg=seg), seg * segments
+
+    async def hls_native(self):
+        """hls.download on the synthetic master playlist, joined into one .ts (no ffmpeg remux)."""
+        import hls
+        url, size = self._hls_source()
+        folder = self._dir("hls_native")
+
+        async def one(i):
+            return await hls.download(url, os.path.join(folder, str(i)), 720, remux=False)
+
+        async with Monitor() as mon:
+            seconds, results = await _run_items(one, self.items, self.concurrency)
+        ok = sum(verify(r, size) for _, r in results if isinstance(r, str))
+        return _report(seconds, ok * size, [lat for lat, _ in results], ok, self.items, mon)
+
+    async def hls_ytdlp(self):
+        """yt-dlp on the same playlist (skipped when yt-dlp is not installed)."""
+        import ytpool
+        if not (ytpool.HAVE_YTDLP or _have_cli("yt-dlp")):
+            return {"skipped": "yt-dlp not installed"}
+        url, size = self._hls_source()
+        folder = self._dir("hls_ytdlp")
+
+        async def one(i):
+            argv = ["-f", "best", "--no-warnings", "--hls-prefer-native", "--fixup", "never",
+                    "-o", os.path.join(folder, f"{i}.%(ext)s"), url]
+            rc, path, err = await ytpool.download(argv, timeout=600)
+            return path
+
+        async with Monitor() as mon:
+            seconds, results = await _run_items(one, self.items, self.concurrency)
+        ok = sum(verify(r, size) for _, r in results if isinstance(r, str))
+        return _report(seconds, ok * size, [lat for lat, _ in results], ok, self.items, mon)
+
+    async def upload_parallel(self):
+        """tgupload.upload_file over fake media sessions (50 ms per part, 1% FloodWait)."""
+        path = os.path.join(self._dir("upload_parallel"), "upload.mp4")
+        with open(path, "wb") as f:
+            for offset in range(0, self.size, MIB):
+                f.write(synthetic(offset, min(MIB, self.size - offset)))
+        client = FakeClient(latency=0.05, bandwidth=8 * MIB, flood_rate=0.01)
+
+        async def one(i):
+            return await tgupload.upload_file(client, path)
+
+        with fake_media_sessions():
+            async with Monitor() as mon:
+                seconds, results = await _run_items(one, self.items, self.concurrency)
+        ok = sum(not isinstance(r, Exception) for _, r in results)
+        return _report(seconds, ok * self.size, [lat for lat, _ in results], ok, self.items, mon,
+                       floodwaits=client.floods, calls=client.calls)
+
+    async def stream_upload(self):
+        """tgupload.stream_url_to_chat: HTTP body forwarded to the fake client, no disk."""
+        client = FakeClient(latency=0.05, bandwidth=8 * MIB)
+
+        async def one(i):
+            return await tgupload.stream_url_to_chat(client, 1, self.server.file_url(self.size, f"stream_{i}.mp4"),
+                                                     f"stream_{i}.mp4")
+
+        with fake_media_sessions():
+            async with Monitor() as mon:
+                seconds, results = await _run_items(one, self.items, self.concurrency)
+        ok = sum(not isinstance(r, Exception) for _, r in results)
+        return _report(seconds, ok * self.size, [lat for lat, _ in results], ok, self.items, mon,
+                       calls=client.calls)
+
+    async def pipeline(self):
+        """
+        The batch loop: BatchPipeline with direct downloads and uploads to the
+        fake client (2% FloodWait, waited out and retried like run_batch).
+        Latency is from batch start to the item being sent.
+        """
+        folder = self._dir("pipeline")
+        client = FakeClient(latency=0.1, bandwidth=16 * MIB, flood_rate=0.02)
+        done_at: Dict[int, float] = {}
+        sent_bytes = 0
+
+        async def download(i):
+            return await core.direct_download_video(self.server.file_url(self.size, f"batch_{i}.mp4"),
+                                                    os.path.join(folder, str(i)))
+
+        async def upload(i, path):
+            nonlocal sent_bytes
+            if not verify(path, self.size):
+                return False
+            while True:
+                try:
+                    await client.send_document(1, path)
+                    break
+                except FloodWait as e:
+                    await asyncio.sleep(e.value)
+            sent_bytes += self.size
+            done_at[i] = time.perf_counter()
+            os.remove(path)
+            return True
+
+        async def failed(i, exc):
+            pass
+
+        engine = BatchPipeline(download, upload, failed, download_workers=self.concurrency,
+                               upload_workers=1, prefetch=2)
+        async with Monitor() as mon:
+            started = time.perf_counter()
+            await engine.run(range(self.items))
+            seconds = time.perf_counter() - started
+        latencies = [t - started for t in done_at.values()]
+        return _report(seconds, sent_bytes, latencies, engine.success, self.items, mon,
+                       floodwaits=client.floods)
+
+
+SCENARIOS = ("direct_segmented", "direct_single", "direct_throttled", "direct_flaky", "plain_fallback",
+             "hls_native", "hls_ytdlp", "upload_parallel", "stream_upload", "pipeline")
+# numbers compared by --compare: (key, True if higher is better)
+_COMPARED = (("throughput_mib_s", True), ("latency_s_p95", False), ("peak_rss_mib", False),
+             ("loop_lag_ms_p99", False))
+
+
+def _have_cli(name: str) -> bool:
+    from shutil import which
+    return which(name) is not None
+
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+async def run(scenarios=SCENARIOS, items: int = 6, size: int = 16 * MIB, concurrency: int = 3) -> dict:
+    server = SyntheticServer()
+    await server.start()
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory(prefix="txtbot-bench-") as workdir:
+            bench = Bench(server, workdir, items, size, concurrency)
+            for name in scenarios:
+                fn = getattr(bench, name)
+                try:
+                    results[name] = await fn()
+                except Exception as e:
+                    results[name] = {"error": f"{type(e).__name__}: {e}"}
+                print(f"{name}: {json.dumps(results[name])}", file=sys.stderr)
+    finally:
+        await httpclient.close()
+        await server.stop()
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "items": items,
+            "size_bytes": size,
+            "concurrency": concurrency,
+        },
+        "scenarios": results,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.1) -> List[str]:
+    """Lines describing the change per scenario; a line starting with "REGRESSION" fails the run."""
+    lines = []
+    for name, now in current.get("scenarios", {}).items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before or "error" in now or "skipped" in now or "error" in before or "skipped" in before:
+            continue
+        for key, higher_better in _COMPARED:
+            a, b = before.get(key), now.get(key)
+            if not a or b is None:
+                continue
+            change = (b - a) / a
+            worse = -change if higher_better else change
+            tag = "REGRESSION" if worse > tolerance else "ok"
+            lines.append(f"{tag:<10} {name:<18} {key:<18} {a:>10} -> {b:<10} ({change * 100:+.1f}%)")
+    return lines
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Offline download/upload benchmarks")
+    parser.add_argument("-s", "--scenario", action="append", choices=SCENARIOS,
+                        help="scenario to run (repeatable, default: all)")
+    parser.add_argument("--items", type=int, default=6, help="files per scenario")
+    parser.add_argument("--size-mb", type=float, default=16, help="size of each file in MiB")
+    parser.add_argument("--concurrency", type=int, default=3, help="items in flight at once")
+    parser.add_argument("--out", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative regression")
+    args = parser.parse_args(argv)
+
+    # the code under test prints progress to stdout; keep stdout for the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        results = asyncio.run(run(args.scenario or SCENARIOS, args.items, int(args.size_mb * MIB), args.concurrency))
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            lines = compare(results, json.load(f), args.tolerance)
+        print("\n".join(lines), file=sys.stderr)
+        if any(line.startswith("REGRESSION") for line in lines):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,53 +1,236 @@
 import os
+import json
 import time
 import datetime
 import aiohttp
 import aiofiles
 import asyncio
+import shlex
+import signal
 import logging
-import requests
 import tgcrypto
 import subprocess
 import concurrent.futures
 
+import metrics
+import httpclient
+import ytpool
+import formats
 from utils import progress_bar
+from downloader import Journal, segmented_download
+from tgupload import send_file_parallel, PARALLEL_UPLOAD_MIN
 
 from pyrogram import Client, filters
 from pyrogram.types import Message
 
-def duration(filename):
+# Max long external processes (yt-dlp, ffmpeg remuxes) running at once across all users
+PROCESS_LIMIT = int(os.getenv("PROCESS_LIMIT", "6") or 6)
+# short ffprobe/thumbnail calls have their own slots, so uploads of finished
+# files never wait behind long downloads
+TOOL_PROCESS_LIMIT = int(os.getenv("TOOL_PROCESS_LIMIT", "4") or 4)
+_process_slots = {}
+
+
+def _slots(tool=False):
+    # created lazily so the semaphores belong to the running loop
+    sem = _process_slots.get(tool)
+    if sem is None:
+        sem = _process_slots[tool] = asyncio.Semaphore(TOOL_PROCESS_LIMIT if tool else PROCESS_LIMIT)
+    return sem
+
+
+async def _pump(stream, chunks, on_line):
+    """Collect a process stream, handing each \\r or \\n terminated line to on_line."""
+    pending = b""
+    while True:
+        data = await stream.read(65536)
+        if not data:
+            break
+        chunks.append(data)
+        if on_line is None:
+            continue
+        pending += data
+        parts = pending.replace(b"\r", b"\n").split(b"\n")
+        pending = parts.pop()
+        for part in parts:
+            if part:
+                try:
+                    await on_line(part.decode(errors="ignore"))
+                except Exception:
+                    pass
+    if on_line is not None and pending:
+        try:
+            await on_line(pending.decode(errors="ignore"))
+        except Exception:
+            pass
+
+
+async def run_process(args, timeout=None, on_stdout=None, on_stderr=None, tool=False):
+    """
+    Run an external program without blocking the event loop.
+
+    args is an argv list (a string is split with shlex). on_stdout / on_stderr
+    are optional async callbacks receiving each output line as it arrives.
+    tool=True marks a short helper (ffprobe, a thumbnail) that takes a tool
+    slot instead of a download slot.
+    Returns (returncode, stdout, stderr); returncode is -1 on timeout or spawn
+    failure. Cancelling the caller kills the process and everything it started.
+    """
+    if isinstance(args, str):
+        args = shlex.split(args)
+    async with _slots(tool):
+        try:
+            # own session, so a kill also reaches the ffmpeg a yt-dlp run started
+            proc = await asyncio.create_subprocess_exec(
+                *args,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True)
+        except Exception as e:
+            return -1, "", str(e)
+        out, err = [], []
+        readers = asyncio.gather(_pump(proc.stdout, out, on_stdout),
+                                 _pump(proc.stderr, err, on_stderr))
+        try:
+            await asyncio.wait_for(asyncio.shield(readers), timeout)
+            rc = await proc.wait()
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if proc.returncode is None:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            await proc.wait()
+            await asyncio.gather(readers, return_exceptions=True)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            err.append(f"\nTimeout after {timeout}s".encode())
+            rc = -1
+        return rc, b"".join(out).decode(errors="ignore"), b"".join(err).decode(errors="ignore")
+
+
+# ffprobe results per (path, size, mtime), so repeated lookups cost nothing
+MEDIA_INFO_CACHE_SIZE = 256
+_media_info_cache = {}
+
+
+def _media_info_key(filename):
+    st = os.stat(filename)
+    return (os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+
+
+async def probe_media(filename):
+    """
+    Inspect a media file with a single ffprobe JSON call.
+
+    Returns a dict with duration (seconds, float), width, height, vcodec,
+    acodec and bitrate; zeros/empty strings when unknown or on failure.
+    """
+    info = {'duration': 0.0, 'width': 0, 'height': 0, 'vcodec': '', 'acodec': '', 'bitrate': 0}
     try:
         if not os.path.exists(filename):
-            return 0
-        result = subprocess.run(["ffprobe", "-v", "error", "-show_entries",
-                                 "format=duration", "-of",
-                                 "default=noprint_wrappers=1:nokey=1", filename],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT)
-        if result.returncode == 0:
-            return float(result.stdout.decode().strip())
-        return 0
+            return info
+        key = _media_info_key(filename)
+        if key in _media_info_cache:
+            return dict(_media_info_cache[key])
+        async with metrics.stage("media_probe"):
+            rc, out, err = await run_process(["ffprobe", "-v", "error", "-print_format", "json",
+                                              "-show_format", "-show_streams", filename], timeout=60, tool=True)
+        if rc != 0:
+            return info
+        data = json.loads(out or "{}")
+        fmt = data.get('format', {})
+        info['duration'] = float(fmt.get('duration') or 0)
+        info['bitrate'] = int(fmt.get('bit_rate') or 0)
+        for stream in data.get('streams', []):
+            if stream.get('codec_type') == 'video' and not info['vcodec']:
+                # attached pictures (cover art) are not the video track
+                if stream.get('disposition', {}).get('attached_pic'):
+                    continue
+                info['vcodec'] = stream.get('codec_name', '')
+                info['width'] = int(stream.get('width') or 0)
+                info['height'] = int(stream.get('height') or 0)
+                if not info['duration']:
+                    info['duration'] = float(stream.get('duration') or 0)
+            elif stream.get('codec_type') == 'audio' and not info['acodec']:
+                info['acodec'] = stream.get('codec_name', '')
+        if len(_media_info_cache) >= MEDIA_INFO_CACHE_SIZE:
+            _media_info_cache.pop(next(iter(_media_info_cache)))
+        _media_info_cache[key] = dict(info)
+        return info
     except Exception as e:
-        print(f"Error getting duration: {e}")
-        return 0
+        print(f"Error probing media: {e}")
+        return info
+
+
+async def make_thumbnail(filename, info=None, at=12.0):
+    """
+    Grab one frame as <filename>.jpg using an input-side seek (no decoding up
+    to the timestamp), clamped inside the real duration. Returns the path or None.
+    """
+    info = info or await probe_media(filename)
+    if not info.get('vcodec'):
+        return None
+    dur = info.get('duration') or 0
+    seek = min(at, dur / 2) if dur else 0
+    out = f"{filename}.jpg"
+    async with metrics.stage("thumbnail"):
+        rc, _, _ = await run_process(["ffmpeg", "-v", "error", "-ss", f"{seek:.2f}", "-i", filename,
+                                      "-frames:v", "1", "-vf", "scale='min(320,iw)':-2", "-y", out], timeout=120,
+                                     tool=True)
+    if rc == 0 and os.path.exists(out):
+        return out
+    return None
+
+
+async def duration(filename):
+    info = await probe_media(filename)
+    return info['duration']
+
+
+async def _stream_resumable(url, filename, headers=None, chunk_size=65536, progress_callback=None):
+    """Stream url into filename over the shared session, continuing a journaled partial file."""
+    journal = Journal.load(filename)
+    if not journal or journal.url != url:
+        journal = Journal(filename, url)
+    offset, extra = journal.range_headers()
+    session = await httpclient.get_session()
+    async with session.get(url, headers={**(headers or {}), **extra}, allow_redirects=True) as response:
+        if response.status not in (200, 206):
+            print(f"HTTP Error {response.status} for {url}")
+            return None
+        pos = journal.start_stream(response.status, offset, response.headers)
+        total_size = pos + int(response.headers.get('content-length', 0))
+        if pos:
+            print(f"Resuming {filename} at {pos} bytes")
+        async with aiofiles.open(filename, 'r+b' if pos else 'wb') as f:
+            await f.seek(pos)
+            async for chunk in response.content.iter_chunked(chunk_size):
+                await f.write(chunk)
+                journal.record(pos, len(chunk))
+                pos += len(chunk)
+                # Progress callback if provided
+                if progress_callback and total_size > 0:
+                    try:
+                        await progress_callback(pos, total_size)
+                    except Exception:
+                        pass
+            await f.truncate()
+    if journal.size and pos < total_size:
+        journal.save()
+        print(f"Download incomplete: {pos}/{total_size}")
+        return None
+    journal.remove()
+    return filename
 
 
 async def download_with_requests(url, filename):
-    """Fallback download using requests library"""
+    """Fallback download with plain headers (kept under its old name; no longer uses requests)"""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, stream=True, allow_redirects=True)
-        if response.status_code == 200:
-            with open(filename, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-            
-            if os.path.exists(filename) and os.path.getsize(filename) > 0:
-                return filename
+        result = await _stream_resumable(url, filename, chunk_size=8192)
+        if result and os.path.getsize(result) > 0:
+            return result
         return None
     except Exception as e:
         print(f"Error in requests download: {e}")
@@ -62,12 +245,16 @@ async def download_video(url, cmd, name, progress_callback=None):
     logging.info(download_cmd)
     
     try:
-        # First attempt with yt-dlp (without aria2)
-        k = subprocess.run(download_cmd, shell=True, capture_output=True, text=True)
+        # First attempt with yt-dlp (without aria2), in a warm worker when available
+        returncode, path, stderr = await ytpool.download(download_cmd, progress_callback, timeout=1800)
+        metrics.YTDLP_EXIT.inc(code=returncode)
+        if returncode == 0 and path and os.path.getsize(path) > 0:
+            failed_counter = 0
+            return path
         
-        if k.returncode != 0:
-            print(f"yt-dlp failed with return code {k.returncode}")
-            print(f"Error output: {k.stderr}")
+        if returncode != 0:
+            print(f"yt-dlp failed with return code {returncode}")
+            print(f"Error output: {stderr}")
             
             # Check if it's a known yt-dlp error that suggests direct download might work
             error_indicators = [
@@ -80,14 +267,16 @@ async def download_video(url, cmd, name, progress_callback=None):
                 "Bad Request"
             ]
             
-            if any(indicator in k.stderr for indicator in error_indicators):
+            if any(indicator in stderr for indicator in error_indicators):
                 print("yt-dlp failed, attempting direct download...")
+                metrics.DOWNLOAD_PATH.inc(path="ytdlp_to_direct")
                 result = await direct_download_video(url, name.split('.')[0], progress_callback)
                 if result:
                     return result
                 
-                # If aiohttp fails, try requests as final fallback
-                print("Aiohttp failed, trying requests...")
+                # If that fails, retry once with plain headers
+                print("Direct download failed, retrying with plain headers...")
+                metrics.DOWNLOAD_PATH.inc(path="plain_retry")
                 return await download_with_requests(url, f"{name.split('.')[0]}.mp4")
             
             # For visionias, retry logic
@@ -113,6 +302,7 @@ async def download_video(url, cmd, name, progress_callback=None):
         
         # If no file found with yt-dlp, try direct download
         print("No file found after yt-dlp, attempting direct download...")
+        metrics.DOWNLOAD_PATH.inc(path="ytdlp_nofile_to_direct")
         return await direct_download_video(url, name.split('.')[0], progress_callback)
                 
     except Exception as e:
@@ -127,15 +317,11 @@ async def download_video(url, cmd, name, progress_callback=None):
 async def send_doc(bot: Client, m: Message,cc,ka,cc1,prog,count,name):
     try:
         reply = await m.reply_text(f"Uploading » `{name}`")
-        time.sleep(1)
-        start_time = time.time()
         await m.reply_document(ka,caption=cc1)
         count+=1
         await reply.delete (True)
-        time.sleep(1)
         if os.path.exists(ka):
             os.remove(ka)
-        time.sleep(1)
     except Exception as e:
         print(f"Error in send_doc: {e}")
 
@@ -147,29 +333,28 @@ async def send_vid(bot: Client, m: Message,cc,filename,thumb,name,prog):
             await m.reply_text(f"**Error: File not found** - `{filename}`")
             return
             
-        # Generate thumbnail - Railway compatible ffmpeg command
-        thumbnail_cmd = f'ffmpeg -i "{filename}" -ss 00:00:12 -vframes 1 -y "{filename}.jpg"'
-        subprocess.run(thumbnail_cmd, shell=True, stderr=subprocess.DEVNULL)
+        # One ffprobe for duration/size; thumbnail only when we need our own
+        info = await probe_media(filename)
+        if thumb == "no":
+            thumbnail = await make_thumbnail(filename, info)
+        else:
+            thumbnail = thumb
         
         if prog:
             await prog.delete (True)
         reply = await m.reply_text(f"**Uploading ...** - `{name}`")
-        
-        try:
-            if thumb == "no":
-                thumbnail = f"{filename}.jpg"
-            else:
-                thumbnail = thumb
-        except Exception as e:
-            thumbnail = f"{filename}.jpg"
-            await m.reply_text(str(e))
 
-        dur = int(duration(filename))
+        dur = int(info['duration'])
+        width, height = info['width'] or 1280, info['height'] or 720
 
         start_time = time.time()
 
         try:
-            await m.reply_video(filename,caption=cc, supports_streaming=True,height=720,width=1280,thumb=thumbnail,duration=dur, progress=progress_bar,progress_args=(reply,start_time))
+            if os.path.getsize(filename) >= PARALLEL_UPLOAD_MIN:
+                # big files go over several upload connections
+                await send_file_parallel(bot, m.chat.id, filename, cc, thumb=thumbnail, duration=dur, width=width, height=height, progress=progress_bar, progress_args=(reply,start_time))
+            else:
+                await m.reply_video(filename,caption=cc, supports_streaming=True,height=height,width=width,thumb=thumbnail,duration=dur, progress=progress_bar,progress_args=(reply,start_time))
         except Exception:
             await m.reply_document(filename,caption=cc, progress=progress_bar,progress_args=(reply,start_time))
 
@@ -197,38 +382,90 @@ def pull_run(work, cmds):
         print("Waiting for tasks to complete")
         fut = executor.map(exec,cmds)
         
-async def aio(url,name):
+async def fetch_to_file(url, path, progress_callback=None, chunk_size=256 * 1024):
+    """
+    Stream url to path in fixed-size chunks, so memory use does not grow with
+    the file. Data goes to path + '.part' and is renamed into place only after
+    a 200 response whose body matches Content-Length; otherwise nothing is
+    left behind and None is returned.
+    """
+    tmp = f"{path}.part"
+    session = await httpclient.get_session()
+    try:
+        async with session.get(url, allow_redirects=True) as resp:
+            if resp.status != 200:
+                print(f"HTTP Error {resp.status} for {url}")
+                return None
+            expected = int(resp.headers.get('content-length') or 0)
+            if resp.headers.get('content-encoding'):
+                expected = 0  # length is of the compressed body
+            written = 0
+            async with aiofiles.open(tmp, mode='wb') as f:
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    await f.write(chunk)
+                    written += len(chunk)
+                    if progress_callback:
+                        try:
+                            await progress_callback(written, expected or written)
+                        except Exception:
+                            pass
+        if written == 0 or (expected and written != expected):
+            print(f"Incomplete download for {url}: {written}/{expected} bytes")
+            os.remove(tmp)
+            return None
+        os.replace(tmp, path)
+        return path
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+async def aio(url,name,progress_callback=None):
     k = f'{name}.pdf'
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    f = await aiofiles.open(k, mode='wb')
-                    await f.write(await resp.read())
-                    await f.close()
-        return k
+        return await fetch_to_file(url, k, progress_callback)
     except Exception as e:
         print(f"Error in aio download: {e}")
         return None
 
 
-async def test_url_accessibility(url):
-    """Test if URL is accessible and return useful info"""
+@metrics.timed("probe")
+async def test_url_accessibility(url, probe_range=False):
+    """Test if URL is accessible and return useful info
+
+    With probe_range=True a 1-byte Range GET is made when HEAD does not
+    advertise range support, so callers know whether the file can be fetched
+    in segments and its real size.
+    """
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
         timeout = aiohttp.ClientTimeout(total=30)
-        async with aiohttp.ClientSession(timeout=timeout, headers=headers) as session:
-            async with session.head(url, allow_redirects=True) as response:
-                return {
-                    'accessible': response.status == 200,
-                    'status': response.status,
-                    'content_type': response.headers.get('content-type', ''),
-                    'content_length': response.headers.get('content-length', '0'),
-                    'is_video': 'video' in response.headers.get('content-type', '').lower()
-                }
+        session = await httpclient.get_session()
+        async with session.head(url, allow_redirects=True, timeout=timeout) as response:
+            info = {
+                'accessible': response.status == 200,
+                'status': response.status,
+                'content_type': response.headers.get('content-type', ''),
+                'content_length': response.headers.get('content-length', '0'),
+                'is_video': 'video' in response.headers.get('content-type', '').lower(),
+                'accept_ranges': response.headers.get('accept-ranges', '').lower() == 'bytes',
+                'etag': response.headers.get('etag', ''),
+                'last_modified': response.headers.get('last-modified', ''),
+                'final_url': str(response.url)
+            }
+        if probe_range and not info['accept_ranges']:
+            async with session.get(info['final_url'], headers={'Range': 'bytes=0-0'}, allow_redirects=True, timeout=timeout) as response:
+                content_range = response.headers.get('content-range', '')
+                if response.status == 206 and '/' in content_range:
+                    total = content_range.rsplit('/', 1)[1]
+                    info['accept_ranges'] = True
+                    info['accessible'] = True
+                    if total.isdigit():
+                        info['content_length'] = total
+                    info['content_type'] = info['content_type'] or response.headers.get('content-type', '')
+                    info['etag'] = info['etag'] or response.headers.get('etag', '')
+                    info['last_modified'] = info['last_modified'] or response.headers.get('last-modified', '')
+        return info
     except Exception as e:
         print(f"URL test failed: {e}")
         return {
@@ -237,6 +474,10 @@ async def test_url_accessibility(url):
             'content_type': '',
             'content_length': '0',
             'is_video': False,
+            'accept_ranges': False,
+            'etag': '',
+            'last_modified': '',
+            'final_url': url,
             'error': str(e)
         }
 
@@ -263,90 +504,53 @@ def get_video_download_strategy(url):
     return 'ytdlp_fallback_direct'
 
 
-async def download(url,name):
+async def download(url,name,progress_callback=None):
     ka = f'{name}.pdf'
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    f = await aiofiles.open(ka, mode='wb')
-                    await f.write(await resp.read())
-                    await f.close()
-        return ka
+        return await fetch_to_file(url, ka, progress_callback)
     except Exception as e:
         print(f"Error in download: {e}")
         return None
 
 
+def _load_info(info):
+    # accepts the dict from ytpool.extract / formats.get_info or raw `yt-dlp -J` output
+    if isinstance(info, (str, bytes)):
+        try:
+            info = json.loads(info)
+        except ValueError:
+            return {}
+    return info or {}
+
+
 def parse_vid_info(info):
-    info = info.strip()
-    info = info.split("\n")
-    new_info = []
-    temp = []
-    for i in info:
-        i = str(i)
-        if "[" not in i and '---' not in i:
-            while "  " in i:
-                i = i.replace("  ", " ")
-            i.strip()
-            i = i.split("|")[0].split(" ",2)
-            try:
-                if "RESOLUTION" not in i[2] and i[2] not in temp and "audio" not in i[2]:
-                    temp.append(i[2])
-                    new_info.append((i[0], i[2]))
-            except:
-                pass
-    return new_info
+    """[(format_id, resolution), ...] from yt-dlp JSON, one entry per resolution, low to high."""
+    return [(fid, res) for res, fid in formats.resolutions(_load_info(info)).items()]
 
 
 def vid_info(info):
-    info = info.strip()
-    info = info.split("\n")
-    new_info = dict()
-    temp = []
-    for i in info:
-        i = str(i)
-        if "[" not in i and '---' not in i:
-            while "  " in i:
-                i = i.replace("  ", " ")
-            i.strip()
-            i = i.split("|")[0].split(" ",3)
-            try:
-                if "RESOLUTION" not in i[2] and i[2] not in temp and "audio" not in i[2]:
-                    temp.append(i[2])
-                    new_info.update({f'{i[2]}':f'{i[0]}'})
-            except:
-                pass
-    return new_info
+    """{resolution: format_id} from yt-dlp JSON, one entry per resolution."""
+    return dict(formats.resolutions(_load_info(info)))
 
 
 async def run(cmd):
-    proc = await asyncio.create_subprocess_shell(
-        cmd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE)
+    returncode, stdout, stderr = await run_process(cmd)
 
-    stdout, stderr = await proc.communicate()
-
-    print(f'[{cmd!r} exited with {proc.returncode}]')
-    if proc.returncode == 1:
+    print(f'[{cmd!r} exited with {returncode}]')
+    if returncode == 1:
         return False
     if stdout:
-        return f'[stdout]\n{stdout.decode()}'
+        return f'[stdout]\n{stdout}'
     if stderr:
-        return f'[stderr]\n{stderr.decode()}'
+        return f'[stderr]\n{stderr}'
 
     
-def old_download(url, file_name, chunk_size = 1024 * 10):
+async def old_download(url, file_name, chunk_size = 1024 * 10):
     try:
-        if os.path.exists(file_name):
+        # an existing file is only kept if its journal lets us resume it
+        if os.path.exists(file_name) and not os.path.exists(f"{file_name}.journal"):
             os.remove(file_name)
-        r = requests.get(url, allow_redirects=True, stream=True)
-        with open(file_name, 'wb') as fd:
-            for chunk in r.iter_content(chunk_size=chunk_size):
-                if chunk:
-                    fd.write(chunk)
-        return file_name
+        return await _stream_resumable(url, file_name, chunk_size=chunk_size)
     except Exception as e:
         print(f"Error in old_download: {e}")
         return None
@@ -392,48 +596,26 @@ async def direct_download_video(url, name, progress_callback=None):
             'Upgrade-Insecure-Requests': '1',
         }
         
-        # Increased timeout for Railway's environment
-        timeout = aiohttp.ClientTimeout(total=3600)  # 2 hours for large files
-        
-        connector = aiohttp.TCPConnector(
-            limit=100,
-            limit_per_host=30,
-            keepalive_timeout=30,
-            enable_cleanup_closed=True
-        )
-        
-        async with aiohttp.ClientSession(
-            timeout=timeout, 
-            headers=headers, 
-            connector=connector
-        ) as session:
-            async with session.get(url, allow_redirects=True) as response:
-                if response.status == 200:
-                    total_size = int(response.headers.get('content-length', 0))
-                    downloaded = 0
-                    
-                    async with aiofiles.open(filename, 'wb') as file:
-                        async for chunk in response.content.iter_chunked(65536):  # 16KB chunks
-                            await file.write(chunk)
-                            downloaded += len(chunk)
-                            
-                            # Progress callback if provided
-                            if progress_callback and total_size > 0:
-                                try:
-                                    await progress_callback(downloaded, total_size)
-                                except:
-                                    pass
-                    
-                    if os.path.exists(filename) and os.path.getsize(filename) > 0:
-                        print(f"Direct download successful: {filename}")
-                        return filename
-                else:
-                    print(f"HTTP Error {response.status} for direct download")
-                    return None
-                    
+        # Parallel range requests first; falls through to one stream if unsupported
+        info = await test_url_accessibility(url, probe_range=True)
+        if info.get('accept_ranges'):
+            result = await segmented_download(url, filename, info, headers=headers, progress_callback=progress_callback)
+            if result:
+                metrics.DOWNLOAD_PATH.inc(path="segmented")
+                return result
+        metrics.DOWNLOAD_PATH.inc(path="single_stream")
+
+        # One stream over the shared session, resuming any journaled partial file
+        result = await _stream_resumable(url, filename, headers, 65536, progress_callback)
+        if result and os.path.getsize(result) > 0:
+            print(f"Direct download successful: {filename}")
+            return result
+        return None
+
     except Exception as e:
         print(f"Error in direct_download_video: {e}")
-        # Try with requests as final fallback
+        # Retry once with plain headers as final fallback
+        metrics.DOWNLOAD_PATH.inc(path="plain_retry")
         try:
             return await download_with_requests(url, f"{name}.mp4")
         except:
@@ -0,0 +1,302 @@
+# Multi-connection (segmented) HTTP downloader for direct video URLs.
+#
+# The file is split into byte ranges that are fetched in parallel over the
+# shared pooled aiohttp session (httpclient) and written in place with positional writes, so a
+# CDN that throttles each connection no longer caps the whole download.
+#
+# Progress is recorded in a sidecar journal (<file>.journal) so a download cut
+# short by a timeout, FloodWait restart or /stop resumes where it left off.
+
+import os
+import json
+import time
+import asyncio
+import logging
+
+import aiohttp
+
+import httpclient
+
+log = logging.getLogger(__name__)
+
+SEGMENT_CONNECTIONS = int(os.getenv("SEGMENT_CONNECTIONS", "4") or 4)
+# below this size a single stream is as fast and cheaper
+SEGMENT_MIN_SIZE = int(os.getenv("SEGMENT_MIN_SIZE", str(8 * 1024 * 1024)))
+SEGMENT_RETRIES = int(os.getenv("SEGMENT_RETRIES", "5") or 5)
+CHUNK_SIZE = 1024 * 1024
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+class Journal:
+    """
+    On-disk record of which byte ranges of a partial download are complete.
+
+    Stores the URL, ETag/Last-Modified and expected size alongside merged
+    inclusive (start, end) ranges, so a later attempt can check the remote
+    object is unchanged and request only what is missing.
+    """
+
+    def __init__(self, filename, url, size=0, etag="", last_modified=""):
+        self.filename = filename
+        self.path = f"{filename}.journal"
+        self.url = url
+        self.size = int(size or 0)
+        self.etag = etag or ""
+        self.last_modified = last_modified or ""
+        self.ranges = []
+        self._saved_at = 0.0
+
+    @classmethod
+    def load(cls, filename):
+        try:
+            with open(f"{filename}.journal", "r") as f:
+                data = json.load(f)
+            j = cls(filename, data["url"], data.get("size", 0), data.get("etag", ""), data.get("last_modified", ""))
+            j.ranges = [tuple(r) for r in data.get("ranges", [])]
+            return j
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    @classmethod
+    def resume(cls, filename, url, size=0, etag="", last_modified=""):
+        """
+        Return the existing journal if it describes the same remote object and
+        the partial file is still there; otherwise discard stale state and
+        return a fresh journal.
+        """
+        j = cls.load(filename)
+        if j and os.path.exists(filename) and j.matches(url, size, etag, last_modified):
+            return j
+        if j:
+            log.info(f"remote object changed or partial file missing, restarting {filename}")
+            j.remove()
+            _discard(filename)
+        return cls(filename, url, size, etag, last_modified)
+
+    def range_headers(self):
+        """
+        Headers for a single-stream GET continuing after the complete prefix.
+        If-Range makes the server send the whole object (200) if it changed.
+        """
+        offset = self.prefix()
+        if offset and self.validator() and os.path.exists(self.filename):
+            return offset, {"Range": f"bytes={offset}-", "If-Range": self.validator(), "Accept-Encoding": "identity"}
+        return 0, {}
+
+    def start_stream(self, status, offset, headers):
+        """Adopt the response to a (possibly ranged) GET; returns the offset writing starts at."""
+        if status == 206 and offset:
+            return offset
+        self.ranges = []
+        self.size = int(headers.get("content-length") or 0)
+        self.etag = headers.get("etag", "")
+        self.last_modified = headers.get("last-modified", "")
+        return 0
+
+    def matches(self, url, size=0, etag="", last_modified=""):
+        if url != self.url:
+            return False
+        if size and self.size and int(size) != self.size:
+            return False
+        if etag and self.etag:
+            return etag == self.etag
+        if last_modified and self.last_modified:
+            return last_modified == self.last_modified
+        return True
+
+    def validator(self):
+        """Value for an If-Range header, or '' when nothing can vouch for the partial file."""
+        if self.etag and not self.etag.startswith("W/"):
+            return self.etag
+        return self.last_modified
+
+    def record(self, start, length):
+        """Mark ``length`` bytes written at ``start`` and checkpoint every couple of seconds."""
+        if length:
+            self.add(start, start + length - 1)
+            self.save(every=2)
+
+    def add(self, start, end):
+        merged = []
+        for s, e in sorted(self.ranges + [(start, end)]):
+            if merged and s <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+            else:
+                merged.append((s, e))
+        self.ranges = merged
+
+    def done_bytes(self):
+        return sum(e - s + 1 for s, e in self.ranges)
+
+    def prefix(self):
+        """Number of contiguous bytes complete from offset 0."""
+        if self.ranges and self.ranges[0][0] == 0:
+            return self.ranges[0][1] + 1
+        return 0
+
+    def missing(self):
+        gaps = []
+        pos = 0
+        for s, e in self.ranges:
+            if s > pos:
+                gaps.append((pos, s - 1))
+            pos = max(pos, e + 1)
+        if pos < self.size:
+            gaps.append((pos, self.size - 1))
+        return gaps
+
+    def save(self, every=0):
+        """Write atomically; with every > 0 skip if the last save was more recent."""
+        now = time.time()
+        if every and now - self._saved_at < every:
+            return
+        self._saved_at = now
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"url": self.url, "size": self.size, "etag": self.etag,
+                           "last_modified": self.last_modified, "ranges": self.ranges}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning(f"could not save journal {self.path}: {e}")
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def split_ranges(size, parts):
+    """Split [0, size) into ``parts`` contiguous inclusive (start, end) ranges."""
+    parts = max(1, min(parts, size))
+    step = size // parts
+    ranges = []
+    start = 0
+    for i in range(parts):
+        end = size - 1 if i == parts - 1 else start + step - 1
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+
+async def _pwrite(fd, data, offset):
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, os.pwrite, fd, data, offset)
+
+
+async def _fetch_range(session, url, fd, start, end, on_bytes, journal=None, headers=None):
+    """Fetch bytes [start, end] into fd, retrying from the last written offset."""
+    pos = start
+    attempt = 0
+    while pos <= end:
+        try:
+            # identity encoding so byte offsets match what lands on disk
+            async with session.get(url, headers={**(headers or {}), "Range": f"bytes={pos}-{end}",
+                                                 "Accept-Encoding": "identity"}) as resp:
+                if resp.status != 206:
+                    raise RangeNotSupported(f"HTTP {resp.status} for range {pos}-{end}")
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    chunk = chunk[:end - pos + 1]
+                    if not chunk:
+                        break
+                    await _pwrite(fd, chunk, pos)
+                    if journal is not None:
+                        journal.record(pos, len(chunk))
+                    pos += len(chunk)
+                    on_bytes(len(chunk))
+            if pos <= end:
+                raise aiohttp.ClientPayloadError(f"short read at {pos}/{end}")
+        except RangeNotSupported:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            attempt += 1
+            if attempt > SEGMENT_RETRIES:
+                raise
+            log.warning(f"segment {start}-{end} retry {attempt}/{SEGMENT_RETRIES} at {pos}: {e}")
+            await asyncio.sleep(min(2 ** attempt, 30))
+
+
+async def segmented_download(url, filename, info, connections=None, headers=None, progress_callback=None):
+    """
+    Download ``url`` into ``filename`` over several parallel range requests.
+
+    ``info`` is the probe result from core.test_url_accessibility(url, probe_range=True).
+    Returns filename on success, or None when the server does not honour ranges,
+    the size is unknown/too small, or a segment keeps failing; the caller then
+    falls back to a single stream. Completed ranges survive in the journal, so
+    a repeated call fetches only what is still missing.
+    """
+    size = int(info.get("content_length") or 0)
+    if not info.get("accept_ranges") or size < SEGMENT_MIN_SIZE:
+        return None
+    connections = connections or SEGMENT_CONNECTIONS
+    target = info.get("final_url") or url
+    journal = Journal.resume(filename, url, size, info.get("etag"), info.get("last_modified"))
+    journal.size = size
+    ranges = []
+    for s, e in journal.missing():
+        # keep every connection busy even when only one big gap is left
+        parts = max(1, min(connections, (e - s + 1) // max(1, size // connections)))
+        ranges.extend((s + a, s + b) for a, b in split_ranges(e - s + 1, parts))
+    done = journal.done_bytes()
+    if done:
+        log.info(f"resuming {filename}: {done}/{size} bytes already on disk")
+
+    def on_bytes(n):
+        nonlocal done
+        done += n
+
+    async def report():
+        while True:
+            await asyncio.sleep(2)
+            try:
+                await progress_callback(done, size)
+            except Exception:
+                pass
+
+    session = await httpclient.get_session()
+    fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+    reporter = asyncio.create_task(report()) if progress_callback else None
+    try:
+        os.ftruncate(fd, size)
+        tasks = [asyncio.create_task(_fetch_range(session, target, fd, s, e, on_bytes, journal, headers))
+                 for s, e in ranges]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        if journal.done_bytes() != size:
+            raise IOError(f"segmented download incomplete: {journal.done_bytes()}/{size}")
+        journal.remove()
+        log.info(f"segmented download ok: {filename} ({size} bytes, {len(ranges)} segments)")
+        return filename
+    except RangeNotSupported as e:
+        log.info(f"ranges not honoured, falling back to single stream: {e}")
+        journal.remove()
+        _discard(filename)
+    except asyncio.CancelledError:
+        journal.save()
+        raise
+    except Exception as e:
+        # keep the partial file and journal for the next attempt
+        log.warning(f"segmented download failed for {url}: {e}")
+        journal.save()
+    finally:
+        if reporter:
+            reporter.cancel()
+        os.close(fd)
+    return None
+
+
+def _discard(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
@@ -0,0 +1,195 @@
+# Format selection from yt-dlp's JSON metadata.
+#
+# The format list of a URL is fetched once as JSON (yt-dlp -J, through the
+# warm worker pool) and cached for a while, then the format to download is
+# picked in Python: the tallest video not above the requested height, with
+# codec/container/bitrate preferences, merged with the best audio when the
+# video stream has none. Sources that publish no height at all fall back to
+# bitrate, and failing that to yt-dlp's own "best", so a quality request
+# never fails just because the metadata is thin.
+
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import ytpool
+
+log = logging.getLogger(__name__)
+
+FORMAT_CACHE_TTL = int(os.getenv("FORMAT_CACHE_TTL", "600") or 600)
+FORMAT_CACHE_MAX = int(os.getenv("FORMAT_CACHE_MAX", "512") or 512)
+# codec prefix preferred at equal height (avc1 plays inline on every Telegram client)
+FORMAT_PREFER_CODEC = os.getenv("FORMAT_PREFER_CODEC", "avc1")
+
+# rough video bitrate (kbit/s) of a stream at a given height, used when heights are missing
+_TBR_FOR_HEIGHT = ((144, 150), (240, 350), (360, 700), (480, 1200), (720, 2800), (1080, 5500), (1440, 10000))
+
+_cache: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+async def get_info(url: str, args: Tuple[str, ...] = ()) -> Optional[dict]:
+    """yt-dlp JSON for ``url``, from cache when fresh; concurrent callers share one extraction."""
+    key = "\0".join((url, *args))
+    hit = _cache.get(key)
+    if hit and time.monotonic() - hit[0] < FORMAT_CACHE_TTL:
+        _cache.move_to_end(key)
+        return hit[1]
+    if key in _inflight:
+        return await asyncio.shield(_inflight[key])
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[key] = fut
+    try:
+        rc, info, err = await ytpool.extract([*args, "--no-warnings", url])
+        if rc != 0 or not info:
+            log.warning(f"format list failed for {url}: {err[:200]}")
+            info = None
+        else:
+            _cache[key] = (time.monotonic(), info)
+            while len(_cache) > FORMAT_CACHE_MAX:
+                _cache.popitem(last=False)
+        fut.set_result(info)
+        return info
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+    except Exception as e:
+        fut.set_exception(e)
+        fut.exception()  # mark retrieved even if nobody else was waiting
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+
+def _is_audio_only(f: dict) -> bool:
+    return f.get("vcodec") == "none" and f.get("acodec") not in (None, "none")
+
+
+def _is_video(f: dict) -> bool:
+    # unknown codecs (None) are usually progressive files that do carry video
+    return f.get("vcodec") != "none" and not (f.get("format_note") or "").lower().startswith("storyboard") \
+        and f.get("ext") != "mhtml"
+
+
+def _has_audio(f: dict) -> bool:
+    return f.get("acodec") != "none"
+
+
+def video_formats(info: dict) -> List[dict]:
+    return [f for f in info.get("formats") or [] if f.get("format_id") and _is_video(f)]
+
+
+def audio_formats(info: dict) -> List[dict]:
+    return [f for f in info.get("formats") or [] if f.get("format_id") and _is_audio_only(f)]
+
+
+def _tbr(f: dict) -> float:
+    return float(f.get("tbr") or f.get("vbr") or 0)
+
+
+def _rank(f: dict, vcodec: Optional[str]):
+    codec = (f.get("vcodec") or "").lower()
+    return (
+        bool(vcodec) and codec.startswith(vcodec.lower()),
+        f.get("ext") == "mp4",
+        _has_audio(f),
+        _tbr(f),
+    )
+
+
+def tbr_budget(height: int) -> float:
+    """Highest plausible video bitrate (kbit/s) for a stream of ``height``."""
+    for h, tbr in _TBR_FOR_HEIGHT:
+        if height <= h:
+            return tbr * 1.5
+    return float("inf")
+
+
+def choose(info: dict, height: Optional[int] = None, max_tbr: Optional[float] = None,
+           vcodec: Optional[str] = FORMAT_PREFER_CODEC) -> Optional[str]:
+    """
+    Pick a concrete format spec ("137+140", "22", ...) from yt-dlp JSON.
+
+    ``height`` caps the video height: the tallest format at or below it wins,
+    or the shortest one above it when nothing is small enough. Without height
+    metadata the bitrate stands in for it. ``max_tbr`` (kbit/s) additionally
+    caps the bitrate where it is known. Returns None if the info lists no
+    formats (single-file extractors), leaving the choice to yt-dlp.
+    """
+    videos = video_formats(info)
+    if max_tbr:
+        capped = [f for f in videos if not _tbr(f) or _tbr(f) <= max_tbr]
+        videos = capped or videos
+    if not videos:
+        return None
+    pick = None
+    if height:
+        with_height = [f for f in videos if f.get("height")]
+        if with_height:
+            fits = [f for f in with_height if f["height"] <= height]
+            if fits:
+                top = max(f["height"] for f in fits)
+                pick = max((f for f in fits if f["height"] == top), key=lambda f: _rank(f, vcodec))
+            else:
+                low = min(f["height"] for f in with_height)
+                pick = max((f for f in with_height if f["height"] == low), key=lambda f: _rank(f, vcodec))
+        else:
+            budget = tbr_budget(height)
+            known = [f for f in videos if _tbr(f)]
+            fits = [f for f in known if _tbr(f) <= budget]
+            if fits:
+                pick = max(fits, key=lambda f: _rank(f, vcodec))
+            elif known:
+                pick = min(known, key=_tbr)
+    if pick is None:
+        # no usable metadata: yt-dlp lists formats worst to best
+        pick = videos[-1]
+    if _has_audio(pick) or pick.get("acodec") is None:
+        return pick["format_id"]
+    audios = audio_formats(info)
+    if not audios:
+        return pick["format_id"]
+    # m4a merges into mp4 without re-encoding
+    same_family = [a for a in audios if (a.get("ext") == "m4a") == (pick.get("ext") == "mp4")]
+    audio = max(same_family or audios, key=lambda a: float(a.get("abr") or a.get("tbr") or 0))
+    return f"{pick['format_id']}+{audio['format_id']}"
+
+
+def height_filter(height) -> str:
+    """The plain yt-dlp selector for a quality, with a fallback so it cannot match nothing."""
+    return f"best[height<={height}]/bv*[height<={height}]+ba/best" if height else "best"
+
+
+async def select(url: str, height=None, args: Tuple[str, ...] = ()) -> Tuple[str, Optional[dict]]:
+    """
+    Format spec to download ``url`` at ``height`` and the JSON it was chosen
+    from (pass it to ytpool.download to skip a second extraction). Falls back
+    to height_filter() when the metadata cannot be fetched, and without the
+    warm pool, where a separate -J run would cost a whole extra yt-dlp start.
+    """
+    height = int(height) if height and str(height).isdigit() else None
+    if not ytpool.enabled():
+        return height_filter(height), None
+    info = await get_info(url, tuple(args))
+    if info:
+        spec = choose(info, height)
+        if spec:
+            log.info(f"format {spec} chosen for {url} (height<={height})")
+            return spec, info
+    return height_filter(height), info
+
+
+def resolutions(info: dict) -> "OrderedDict[str, str]":
+    """Resolution label ("1280x720") -> format_id, one per resolution, best bitrate kept, low to high."""
+    best: Dict[str, dict] = {}
+    for f in video_formats(info):
+        label = f.get("resolution") or (f"{f['width']}x{f['height']}" if f.get("width") and f.get("height") else None)
+        if not label or label == "audio only":
+            continue
+        if label not in best or _tbr(f) > _tbr(best[label]):
+            best[label] = f
+    ordered = sorted(best.items(), key=lambda kv: (kv[1].get("height") or 0, _tbr(kv[1])))
+    return OrderedDict((label, f["format_id"]) for label, f in ordered)
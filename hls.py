@@ -0,0 +1,392 @@
+# Native HLS (m3u8) downloader.
+#
+# Lecture playlists are often thousands of short .ts segments, so a download
+# is bound by per-request latency, not bandwidth. This module reads the
+# master playlist, picks the variant for the requested height, then fetches
+# segments concurrently over the shared pooled session (httpclient) with
+# per-segment retries. Segments are handed on strictly in playlist order,
+# straight into an ffmpeg "-c copy" remux to MP4 (or into one .ts file when
+# ffmpeg is missing), so nothing is written per segment. At most
+# connections * HLS_READ_AHEAD segments are held in memory.
+#
+# AES-128 encryption, byte ranges and fMP4 init sections are handled.
+# Live playlists, SAMPLE-AES and separate audio renditions are not: download()
+# returns None for them and the caller falls back to yt-dlp.
+
+import os
+import re
+import shutil
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, List, Optional
+from urllib.parse import urljoin
+
+import aiohttp
+
+import httpclient
+import formats
+
+try:
+    from Crypto.Cipher import AES
+except ImportError:  # without pycryptodome encrypted playlists go to yt-dlp
+    AES = None
+
+log = logging.getLogger(__name__)
+
+HLS_NATIVE = os.getenv("HLS_NATIVE", "1") != "0"
+HLS_CONNECTIONS = int(os.getenv("HLS_CONNECTIONS", "8") or 8)
+HLS_RETRIES = int(os.getenv("HLS_RETRIES", "5") or 5)
+# remux to MP4 through ffmpeg when it is installed; 0 keeps the joined .ts
+HLS_REMUX = os.getenv("HLS_REMUX", "1") != "0"
+# segments fetched ahead of the writer, per connection
+HLS_READ_AHEAD = 4
+
+_ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+class Unsupported(Exception):
+    """The playlist needs something only yt-dlp does (live, SAMPLE-AES, separate audio)."""
+
+
+class SegmentFailed(Exception):
+    """A segment could not be fetched (permanent HTTP error or out of retries)."""
+
+
+class Segment:
+    __slots__ = ("url", "seq", "byterange", "key", "iv")
+
+    def __init__(self, url: str, seq: int, byterange=None, key: Optional[str] = None, iv: Optional[bytes] = None):
+        self.url = url
+        self.seq = seq
+        # (offset, length) inside url, or None for the whole resource
+        self.byterange = byterange
+        # AES-128 key URI, or None when the segment is not encrypted
+        self.key = key
+        self.iv = iv
+
+
+def attributes(line: str) -> Dict[str, str]:
+    """Attribute list of a tag line (``#EXT-X-KEY:METHOD=AES-128,URI="..."``)."""
+    _, _, rest = line.partition(":")
+    return {k: v.strip('"') for k, v in _ATTR_RE.findall(rest)}
+
+
+def _lines(text: str):
+    return [ln.strip() for ln in text.lstrip("\ufeff").splitlines() if ln.strip()]
+
+
+def is_master(text: str) -> bool:
+    return "#EXT-X-STREAM-INF" in text
+
+
+def parse_master(text: str, base: str) -> List[dict]:
+    """Variants of a master playlist: dicts with url, bandwidth, height, codecs, audio group."""
+    variants, audio_uris = [], {}
+    pending = None
+    for line in _lines(text):
+        if line.startswith("#EXT-X-STREAM-INF:"):
+            attrs = attributes(line)
+            width, _, height = attrs.get("RESOLUTION", "").partition("x")
+            pending = {
+                "bandwidth": int(attrs.get("AVERAGE-BANDWIDTH") or attrs.get("BANDWIDTH") or 0),
+                "height": int(height) if height.isdigit() else None,
+                "codecs": attrs.get("CODECS", ""),
+                "audio": attrs.get("AUDIO"),
+            }
+        elif line.startswith("#EXT-X-MEDIA:"):
+            attrs = attributes(line)
+            if attrs.get("TYPE") == "AUDIO" and attrs.get("URI"):
+                audio_uris[attrs.get("GROUP-ID")] = attrs["URI"]
+        elif pending is not None and not line.startswith("#"):
+            pending["url"] = urljoin(base, line)
+            variants.append(pending)
+            pending = None
+    for v in variants:
+        # the audio track lives in its own playlist: needs a second input to mux
+        v["separate_audio"] = v["audio"] in audio_uris
+    return variants
+
+
+def pick_variant(variants: List[dict], height: Optional[int] = None) -> dict:
+    """The tallest variant not above ``height`` (bandwidth breaks ties); the best one without a height."""
+    def bandwidth(v):
+        return v["bandwidth"]
+
+    if not height:
+        return max(variants, key=bandwidth)
+    sized = [v for v in variants if v["height"]]
+    if sized:
+        fits = [v for v in sized if v["height"] <= height]
+        if fits:
+            top = max(v["height"] for v in fits)
+            return max((v for v in fits if v["height"] == top), key=bandwidth)
+        return min(sized, key=lambda v: (v["height"], v["bandwidth"]))
+    # no RESOLUTION attributes: judge by bitrate like formats.choose does
+    budget = formats.tbr_budget(height) * 1000
+    fits = [v for v in variants if v["bandwidth"] <= budget]
+    return max(fits, key=bandwidth) if fits else min(variants, key=bandwidth)
+
+
+def parse_media(text: str, base: str) -> dict:
+    """Segments of a media playlist plus its init section (fMP4) and whether it is complete."""
+    segments: List[Segment] = []
+    init = None
+    seq = 0
+    key = iv = None
+    byterange = None
+    next_offset: Dict[str, int] = {}
+    endlist = False
+    for line in _lines(text):
+        if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            seq = int(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-KEY:"):
+            attrs = attributes(line)
+            method = attrs.get("METHOD", "NONE")
+            if method == "NONE":
+                key = iv = None
+            elif method == "AES-128":
+                key = urljoin(base, attrs["URI"])
+                iv = bytes.fromhex(attrs["IV"][2:]) if attrs.get("IV", "").lower().startswith("0x") else None
+            else:
+                raise Unsupported(f"{method} encryption")
+        elif line.startswith("#EXT-X-MAP:"):
+            attrs = attributes(line)
+            section = {"url": urljoin(base, attrs["URI"]), "byterange": _byterange(attrs.get("BYTERANGE"), None)}
+            if init and init != section:
+                raise Unsupported("more than one init section")
+            init = section
+        elif line.startswith("#EXT-X-BYTERANGE:"):
+            byterange = line.split(":", 1)[1]
+        elif line.startswith("#EXT-X-ENDLIST"):
+            endlist = True
+        elif not line.startswith("#"):
+            url = urljoin(base, line)
+            rng = None
+            if byterange:
+                rng = _byterange(byterange, next_offset.get(url, 0))
+                next_offset[url] = rng[0] + rng[1]
+            segments.append(Segment(url, seq, rng, key, iv or (seq.to_bytes(16, "big") if key else None)))
+            seq += 1
+            byterange = None
+    return {"segments": segments, "init": init, "endlist": endlist}
+
+
+def _byterange(value: Optional[str], default_offset: Optional[int]):
+    if not value:
+        return None
+    length, _, offset = value.partition("@")
+    return int(offset) if offset else (default_offset or 0), int(length)
+
+
+async def _get_text(session, url: str, headers=None):
+    async with session.get(url, headers=headers, allow_redirects=True) as resp:
+        if resp.status != 200:
+            raise SegmentFailed(f"HTTP {resp.status} for playlist {url}")
+        return await resp.text(errors="ignore"), str(resp.url)
+
+
+async def load(url: str, height: Optional[int] = None, headers=None) -> dict:
+    """Resolve ``url`` (master or media playlist) to the media playlist to download."""
+    session = await httpclient.get_session()
+    text, base = await _get_text(session, url, headers)
+    variant = None
+    if is_master(text):
+        variants = parse_master(text, base)
+        if not variants:
+            raise Unsupported("master playlist without variants")
+        variant = pick_variant(variants, height)
+        if variant["separate_audio"]:
+            raise Unsupported("audio in a separate rendition")
+        text, base = await _get_text(session, variant["url"], headers)
+    playlist = parse_media(text, base)
+    if not playlist["endlist"]:
+        raise Unsupported("live playlist")
+    if not playlist["segments"]:
+        raise Unsupported("no segments")
+    if AES is None and any(s.key for s in playlist["segments"]):
+        raise Unsupported("AES-128 without pycryptodome")
+    playlist["variant"] = variant
+    return playlist
+
+
+async def _fetch(session, url: str, byterange=None, headers=None) -> bytes:
+    """One segment (or key/init section), retried with backoff on network and 5xx errors."""
+    h = {**(headers or {}), "Accept-Encoding": "identity"}
+    if byterange:
+        h["Range"] = f"bytes={byterange[0]}-{byterange[0] + byterange[1] - 1}"
+    attempt = 0
+    while True:
+        try:
+            async with session.get(url, headers=h, allow_redirects=True) as resp:
+                if resp.status in (200, 206):
+                    data = await resp.read()
+                    if byterange and resp.status == 200:
+                        data = data[byterange[0]:byterange[0] + byterange[1]]
+                    return data
+                if resp.status < 500 and resp.status not in (408, 429):
+                    raise SegmentFailed(f"HTTP {resp.status} for {url}")
+                raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError) as e:
+            attempt += 1
+            if attempt > HLS_RETRIES:
+                raise SegmentFailed(f"{url}: {e}")
+            log.warning(f"hls segment retry {attempt}/{HLS_RETRIES} for {url}: {e}")
+            await asyncio.sleep(min(2 ** attempt, 30))
+
+
+def _decrypt(key: bytes, iv: bytes, data: bytes) -> bytes:
+    data = AES.new(key, AES.MODE_CBC, iv).decrypt(data)
+    pad = data[-1] if data else 0
+    return data[:-pad] if 0 < pad <= 16 else data
+
+
+class _FileSink:
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, "wb")
+
+    async def write(self, data: bytes):
+        await asyncio.get_running_loop().run_in_executor(None, self._f.write, data)
+
+    async def close(self) -> bool:
+        self._f.close()
+        return True
+
+    async def abort(self):
+        self._f.close()
+        _remove(self.path)
+
+
+class _FfmpegSink:
+    """Joined MPEG-TS piped into ``ffmpeg -c copy``; the MP4 is the only file written."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.proc = None
+        self._stderr = None
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", "mpegts", "-i", "pipe:0",
+            "-map", "0:v?", "-map", "0:a?", "-c", "copy", "-movflags", "+faststart", self.path,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+        self._stderr = asyncio.ensure_future(self.proc.stderr.read())
+        return self
+
+    async def write(self, data: bytes):
+        self.proc.stdin.write(data)
+        await self.proc.stdin.drain()
+
+    async def close(self) -> bool:
+        self.proc.stdin.close()
+        rc = await self.proc.wait()
+        err = (await self._stderr).decode(errors="ignore")
+        if rc != 0:
+            log.warning(f"ffmpeg remux failed (rc={rc}): {err[-300:]}")
+            _remove(self.path)
+            return False
+        return True
+
+    async def abort(self):
+        if self.proc.returncode is None:
+            try:
+                self.proc.kill()
+            except ProcessLookupError:
+                pass
+        await self.proc.wait()
+        self._stderr.cancel()
+        _remove(self.path)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+async def download(url: str, output: str, height=None, progress=None, headers=None,
+                   connections: Optional[int] = None, remux: Optional[bool] = None) -> Optional[str]:
+    """
+    Download the HLS stream at ``url`` to ``output`` (a path without
+    extension) and return the file: .mp4 when remuxed (or for fMP4 streams),
+    else .ts. ``height`` picks the variant; ``progress`` is awaited as
+    progress(done_bytes, estimated_total). Returns None when the playlist is
+    unsupported or the download failed, so the caller can try yt-dlp.
+    """
+    height = int(height) if height and str(height).isdigit() else None
+    try:
+        playlist = await load(url, height, headers)
+    except Unsupported as e:
+        log.info(f"hls: leaving {url} to yt-dlp: {e}")
+        return None
+    except (SegmentFailed, aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e:
+        log.warning(f"hls: cannot read playlist {url}: {e}")
+        return None
+    segments, init = playlist["segments"], playlist["init"]
+    if remux is None:
+        remux = HLS_REMUX and shutil.which("ffmpeg") is not None
+    if init:
+        # fragmented MP4: init section + fragments already is an MP4 file
+        sink = _FileSink(f"{output}.mp4")
+    elif remux:
+        sink = await _FfmpegSink(f"{output}.mp4").start()
+    else:
+        sink = _FileSink(f"{output}.ts")
+
+    session = await httpclient.get_session()
+    connections = max(1, connections or HLS_CONNECTIONS)
+    slots = asyncio.Semaphore(connections)
+    keys: Dict[str, asyncio.Task] = {}
+
+    async def fetch(seg: Segment) -> bytes:
+        async with slots:
+            data = await _fetch(session, seg.url, seg.byterange, headers)
+        if seg.key:
+            if seg.key not in keys:
+                keys[seg.key] = asyncio.ensure_future(_fetch(session, seg.key, None, headers))
+            key = await keys[seg.key]
+            data = await asyncio.get_running_loop().run_in_executor(None, _decrypt, key, seg.iv, data)
+        return data
+
+    pending = deque()
+    queued = iter(segments)
+
+    def fill():
+        while len(pending) < connections * HLS_READ_AHEAD:
+            seg = next(queued, None)
+            if seg is None:
+                return
+            pending.append(asyncio.ensure_future(fetch(seg)))
+
+    done_bytes = written = 0
+    try:
+        if init:
+            await sink.write(await _fetch(session, init["url"], init["byterange"], headers))
+        fill()
+        while pending:
+            data = await pending.popleft()
+            fill()
+            await sink.write(data)
+            written += 1
+            done_bytes += len(data)
+            if progress:
+                try:
+                    await progress(done_bytes, done_bytes * len(segments) // written)
+                except Exception:
+                    pass
+        if not await sink.close():
+            return None
+    except BaseException as e:
+        for task in list(pending) + list(keys.values()):
+            task.cancel()
+        await asyncio.gather(*pending, *keys.values(), return_exceptions=True)
+        await sink.abort()
+        if not isinstance(e, Exception):
+            raise
+        log.warning(f"hls download failed for {url}: {e}")
+        return None
+    log.info(f"hls: {url} -> {sink.path} ({len(segments)} segments, {done_bytes} bytes, "
+             f"variant {(playlist['variant'] or {}).get('height')})")
+    return sink.path
@@ -0,0 +1,63 @@
+# One long-lived aiohttp client shared by every HTTP call in the bot.
+#
+# Reusing a single pooled session means keep-alive connections, cached DNS
+# and TLS sessions carry over from one link to the next instead of every
+# download paying for a fresh handshake.
+
+import os
+import asyncio
+import logging
+
+import aiohttp
+
+log = logging.getLogger(__name__)
+
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100") or 100)
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "16") or 16)
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", "300") or 300)
+HTTP_KEEPALIVE = int(os.getenv("HTTP_KEEPALIVE", "60") or 60)
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+DEFAULT_HEADERS = {'User-Agent': USER_AGENT}
+# no overall deadline: big files take as long as they take, but a stalled socket does not
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120)
+
+_session = None
+_lock = None
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """Return the shared session, creating it on first use inside the running loop."""
+    global _session, _lock
+    if _session is not None and not _session.closed:
+        return _session
+    if _lock is None:
+        _lock = asyncio.Lock()
+    async with _lock:
+        if _session is None or _session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_PER_HOST_LIMIT,
+                ttl_dns_cache=HTTP_DNS_TTL,
+                keepalive_timeout=HTTP_KEEPALIVE,
+                enable_cleanup_closed=True
+            )
+            _session = aiohttp.ClientSession(connector=connector, headers=DEFAULT_HEADERS, timeout=DEFAULT_TIMEOUT)
+            log.info("shared HTTP session created")
+    return _session
+
+
+async def get_json(url, timeout=15, **kwargs):
+    """GET url and decode JSON; returns (status, data) with data None on non-200."""
+    session = await get_session()
+    async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout), **kwargs) as resp:
+        if resp.status != 200:
+            return resp.status, None
+        return resp.status, await resp.json(content_type=None)
+
+
+async def close():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
@@ -0,0 +1,130 @@
+# Durable batch job store.
+#
+# Every /upload, /drm or single-link request becomes a batch row plus one row
+# per link, and each item's status is updated as it moves through the
+# pipeline (pending -> downloading -> uploading -> done/failed). After a crash
+# or /stop the bot reloads unfinished batches and carries on from there.
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import List, Optional
+
+JOBS_DB = os.getenv("JOBS_DB", "jobs.sqlite3")
+
+PENDING = "pending"
+DOWNLOADING = "downloading"
+UPLOADING = "uploading"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER,
+    kind TEXT NOT NULL,
+    options TEXT NOT NULL DEFAULT '{}',
+    total INTEGER NOT NULL DEFAULT 0,
+    finished INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    batch_id INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    url TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (batch_id, idx)
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (batch_id, status);
+"""
+
+# columns added after the first release; created on open when missing
+_ITEM_COLUMNS = {
+    "size_hint": "INTEGER NOT NULL DEFAULT 0",
+    "content_type": "TEXT",
+    "strategy": "TEXT",
+}
+
+
+class JobStore:
+    """SQLite-backed store for batches and their per-link status."""
+
+    def __init__(self, path: str = JOBS_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        have = {r["name"] for r in self._conn.execute("PRAGMA table_info(items)")}
+        for name, decl in _ITEM_COLUMNS.items():
+            if name not in have:
+                self._conn.execute(f"ALTER TABLE items ADD COLUMN {name} {decl}")
+
+    def _exec(self, sql, args=()):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def create_batch(self, chat_id, user_id, kind, options, links, start=0) -> int:
+        """Persist a batch of (title, url) links, skipping the first ``start``; returns its id."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN")
+            cur.execute(
+                "INSERT INTO batches (chat_id, user_id, kind, options, total, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (chat_id, user_id, kind, json.dumps(options), len(links), now))
+            batch_id = cur.lastrowid
+            cur.executemany(
+                "INSERT INTO items (batch_id, idx, title, url, status, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(batch_id, idx, title, url, PENDING, now)
+                 for idx, (title, url) in enumerate(links) if idx >= start])
+            cur.execute("COMMIT")
+        return batch_id
+
+    def get_batch(self, batch_id) -> Optional[dict]:
+        rows = self._exec("SELECT * FROM batches WHERE id = ?", (batch_id,))
+        if not rows:
+            return None
+        batch = dict(rows[0])
+        batch["options"] = json.loads(batch["options"] or "{}")
+        return batch
+
+    def unfinished_batches(self) -> List[dict]:
+        rows = self._exec("SELECT id FROM batches WHERE finished = 0 ORDER BY id")
+        return [self.get_batch(r["id"]) for r in rows]
+
+    def pending_items(self, batch_id) -> List[dict]:
+        """Items still to process; ones caught mid-flight by a restart count as pending."""
+        rows = self._exec(
+            "SELECT * FROM items WHERE batch_id = ? AND status IN (?, ?, ?) ORDER BY idx",
+            (batch_id, PENDING, DOWNLOADING, UPLOADING))
+        return [dict(r) for r in rows]
+
+    def set_item_status(self, batch_id, idx, status, error=None):
+        self._exec("UPDATE items SET status = ?, error = ?, updated_at = ? WHERE batch_id = ? AND idx = ?",
+                   (status, error, time.time(), batch_id, idx))
+
+    def record_probes(self, batch_id, probes):
+        """Store pre-flight results: an iterable of (idx, size_hint, content_type, strategy)."""
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN")
+            cur.executemany(
+                "UPDATE items SET size_hint = ?, content_type = ?, strategy = ? WHERE batch_id = ? AND idx = ?",
+                [(int(size or 0), ctype, strategy, batch_id, idx) for idx, size, ctype, strategy in probes])
+            cur.execute("COMMIT")
+
+    def counts(self, batch_id) -> dict:
+        rows = self._exec("SELECT status, COUNT(*) AS n FROM items WHERE batch_id = ? GROUP BY status", (batch_id,))
+        return {r["status"]: r["n"] for r in rows}
+
+    def finish_batch(self, batch_id):
+        self._exec("UPDATE batches SET finished = 1 WHERE id = ?", (batch_id,))
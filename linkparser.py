@@ -0,0 +1,235 @@
+# Streaming parser for the .txt link lists sent to /upload and /drm.
+#
+# Link dumps can be several MB with 100k+ lines, so the text is parsed as it
+# arrives, one block of complete lines at a time, in a plain loop kept
+# cheap per line: a substring test drops lines that cannot hold a link, and
+# a regex splits the rest into (before, url, after) in one call. It
+# understands the usual "Title:URL", "Title : URL", "Title | URL",
+# "Title URL" and bare-URL lines, drops duplicate URLs, and names untitled
+# links from a digest of the URL so names stay the same across restarts.
+
+import gc
+import re
+import sys
+import json
+import time
+import codecs
+import hashlib
+from typing import AsyncIterator, List, Optional, Tuple
+
+# the first URL of a line is the link; text around it on the same line is its title
+# (split(line, 1) on it gives [before, url, after]); a literal lower-case
+# scheme lets the regex engine skip ahead, re.IGNORECASE is much slower
+_URL = r"(https?://[^\s]+)"
+_URL_RE = re.compile(_URL)
+_URL_ANYCASE_RE = re.compile(_URL, re.IGNORECASE)
+# a line that is just a host (and path) without a scheme, e.g. "example.com/v.mp4"
+_BARE_RE = re.compile(r"[ \t]*((?:[a-z0-9-]+\.)+[a-z]{2,}(?::\d+)?(?:/[^\s]*)?)[ \t]*$", re.IGNORECASE)
+
+_TITLE_STRIP = " \t:|-–—\ufeff"
+_URL_TRAIL = ".,;:)]}>\"'"
+# closing characters a link only loses when they close something outside it
+_OPENERS = {")": "(", "]": "[", "}": "{", ">": "<", '"': '"', "'": "'"}
+
+Link = Tuple[str, str]
+
+
+def _trim_url(before: str, url: str) -> Tuple[str, str]:
+    """
+    Drop sentence punctuation after a link and a bracket or quote wrapped
+    around it (taking its opening half off the title too), but keep closers
+    that belong to the URL, like the ")" of ".../a_(b)".
+    """
+    while url[-1] in _URL_TRAIL:
+        c = url[-1]
+        o = _OPENERS.get(c)
+        if o is not None:
+            head = before.rstrip()
+            if o == c:
+                if not head.endswith(c):
+                    break  # a quote only wraps the link when one opens it
+            elif url.count(o) >= url.count(c):
+                break  # balanced inside the URL
+            if head.endswith(o):
+                before = head[:-1]
+        url = url[:-1]
+    return before, url
+
+
+def stable_name(url: str, prefix: str = "File") -> str:
+    """Deterministic fallback title for a link (unlike hash(), not salted per process)."""
+    return f"{prefix}_{hashlib.blake2s(url.encode('utf-8', 'ignore'), digest_size=4).hexdigest()}"
+
+
+class LinkParser:
+    """
+    Incremental parser: ``feed()`` text as it arrives and get back the links
+    from every complete line so far; ``close()`` flushes the last line.
+
+    ``bare_domains`` also accepts scheme-less "host/path" lines (as https),
+    ``dedupe`` keeps only the first occurrence of each URL (ignoring #fragments).
+    """
+
+    def __init__(self, bare_domains: bool = True, dedupe: bool = True):
+        self.bare_domains = bare_domains
+        self.dedupe = dedupe
+        self.lines = 0
+        self.links = 0
+        self.duplicates = 0
+        self._seen = set()
+        self._tail = ""
+
+    def _parse_block(self, block: str) -> List[Link]:
+        self.lines += block.count("\n") + (0 if block.endswith("\n") else 1)
+        out: List[Link] = []
+        append = out.append
+        seen = self._seen if self.dedupe else None
+        strip_chars, url_trail = _TITLE_STRIP, _URL_TRAIL
+        has_fragments = "#" in block
+        split_url = _URL_RE.split
+        match_bare = _BARE_RE.match if self.bare_domains else None
+        # only lines that can hold a link reach the loop
+        if match_bare:
+            lines = [ln for ln in block.split("\n") if "://" in ln or "." in ln]
+        else:
+            lines = [ln for ln in block.split("\n") if "://" in ln]
+        for line in lines:
+            parts = None
+            if "://" in line:
+                parts = split_url(line, 1)
+                # an upper-case scheme is only found by the (slower) case-insensitive pattern
+                if len(parts) != 3 or "://" in parts[0]:
+                    parts = _URL_ANYCASE_RE.split(line, 1)
+            if parts is not None and len(parts) == 3:
+                before, url, after = parts
+            elif match_bare and "." in line:
+                m = match_bare(line)
+                if m is None:
+                    continue
+                before, url, after = "", "https://" + m.group(1), ""
+            else:
+                continue
+            if url[-1] in url_trail:
+                before, url = _trim_url(before, url)
+                if url.endswith("://"):
+                    continue
+            if seen is not None:
+                key = url.partition("#")[0] if has_fragments else url
+                if key in seen:
+                    self.duplicates += 1
+                    continue
+                seen.add(key)
+            title = before.strip(strip_chars)
+            if after:
+                title = f"{title} {after}".strip(strip_chars)
+            # tabs and other whitespace than " " are not printable
+            if "  " in title or not title.isprintable():
+                title = " ".join(title.split()).strip(strip_chars)
+            append((title or stable_name(url), url))
+        self.links += len(out)
+        return out
+
+    def feed(self, text: str) -> List[Link]:
+        text = self._tail + text.replace("\r\n", "\n").replace("\r", "\n")
+        cut = text.rfind("\n")
+        if cut < 0:
+            self._tail = text
+            return []
+        self._tail = text[cut + 1:]
+        return self._parse_block(text[:cut + 1])
+
+    def close(self) -> List[Link]:
+        tail, self._tail = self._tail, ""
+        return self._parse_block(tail) if tail.strip() else []
+
+    def stats(self) -> dict:
+        return {"lines": self.lines, "links": self.links, "duplicates": self.duplicates}
+
+
+def parse_text(text: str, **kwargs) -> List[Link]:
+    """Parse a whole link list held in memory."""
+    parser = LinkParser(**kwargs)
+    return parser.feed(text) + parser.close()
+
+
+async def iter_links(chunks: AsyncIterator[bytes], parser: Optional[LinkParser] = None) -> AsyncIterator[Link]:
+    """Yield (title, url) pairs from an async stream of raw bytes as soon as each line is complete."""
+    parser = parser or LinkParser()
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="ignore")
+    async for chunk in chunks:
+        for link in parser.feed(decoder.decode(chunk)):
+            yield link
+    for link in parser.feed(decoder.decode(b"", final=True)) + parser.close():
+        yield link
+
+
+# -------------------------
+# Benchmark: python linkparser.py [lines]
+# -------------------------
+def _sample(lines: int) -> str:
+    shapes = (
+        "Lecture {i}: Intro to topic {i}:https://cdn.example.com/v/{i}.mp4",
+        "Chapter {i} | Notes https://files.example.org/pdf/{i}.pdf?token=abc",
+        "https://www.youtube.com/watch?v=vid{i}",
+        "Class {i} - Part 2 : https://media.example.net/hls/{i}/master.m3u8",
+        "   ",
+        "just some text without a link {i}",
+        "Lecture {j}: repeated:https://cdn.example.com/v/{j}.mp4",  # duplicate of line i - 6
+    )
+    return "\n".join(shapes[i % len(shapes)].format(i=i, j=i - 6) for i in range(lines)) + "\n"
+
+
+def _naive(text: str) -> List[Link]:
+    # the old approach: a regex search and string replace per line
+    url_re = re.compile(r"https?://[^\s]+")
+    out = []
+    for line in text.splitlines():
+        line = line.strip()
+        m = url_re.search(line) if line else None
+        if m:
+            out.append((line.replace(m.group(0), "").strip(), m.group(0)))
+    return out
+
+
+def benchmark(lines: int = 100_000, chunk: int = 1024 * 1024, repeat: int = 5) -> dict:
+    """Time the streaming parser against the old per-line loop on a synthetic list."""
+    text = _sample(lines)
+    data = text.encode()
+
+    def best(fn):
+        times = []
+        for _ in range(repeat):
+            gc.collect()  # don't bill one run for the garbage of the previous one
+            started = time.perf_counter()
+            result = fn()
+            times.append(time.perf_counter() - started)
+        return min(times), result
+
+    def streamed():
+        parser = LinkParser()
+        decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="ignore")
+        out, first = [], None
+        started = time.perf_counter()
+        for i in range(0, len(data), chunk):
+            out += parser.feed(decoder.decode(data[i:i + chunk]))
+            if out and first is None:
+                first = time.perf_counter() - started
+        out += parser.close()
+        return out, first, parser.stats()
+
+    naive_s, naive_links = best(lambda: _naive(text))
+    stream_s, (links, first, stats) = best(streamed)
+    return {
+        "lines": lines,
+        "bytes": len(data),
+        "naive_seconds": round(naive_s, 4),
+        "naive_links": len(naive_links),
+        "stream_seconds": round(stream_s, 4),
+        "stream_lines_per_second": int(lines / stream_s) if stream_s else None,
+        "first_link_seconds": round(first, 6) if first is not None else None,
+        **stats,
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000), indent=2))
@@ -0,0 +1,210 @@
+# Event-loop health: lag watchdog, handler timing and an on-demand profiler.
+#
+# A heartbeat task on the loop records how late each wake-up is (loop lag).
+# A separate thread watches that heartbeat: when it stops for longer than
+# LOOP_STALL_SECONDS the loop is blocked by synchronous code, so the thread
+# logs the loop thread's current stack - the blocking call itself - together
+# with the handlers that were running. handler() wraps Pyrogram handlers to
+# time them and keep that list. Profiler samples the loop thread's stack at
+# a fixed interval for a while and writes collapsed stacks plus a
+# top-functions summary, which /profile sends back as a document.
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import functools
+import threading
+import traceback
+from collections import Counter
+from typing import Dict, Optional
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5") or 0.5)
+# heartbeat silence that counts as a stall and triggers a stack dump
+LOOP_STALL_SECONDS = float(os.getenv("LOOP_STALL_SECONDS", "2") or 2)
+# handlers running longer than this are logged (conversation steps that wait on the user included)
+HANDLER_SLOW_SECONDS = float(os.getenv("HANDLER_SLOW_SECONDS", "30") or 30)
+PROFILE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 300
+_STACK_LIMIT = 40
+
+LOOP_LAG = metrics.Histogram("txtbot_loop_lag_seconds", "Event-loop wake-up delay", (),
+                             (0.005, 0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30))
+LOOP_STALLS = metrics.Counter("txtbot_loop_stalls_total", "Loop blocked longer than LOOP_STALL_SECONDS")
+HANDLER_SECONDS = metrics.Histogram("txtbot_handler_seconds", "Handler run time", ("handler",))
+
+# handler name -> start times of its running calls
+_active: Dict[str, list] = {}
+
+
+def handler(fn):
+    """Time a Pyrogram handler into txtbot_handler_seconds and list it while it runs."""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(client, update, *args, **kwargs):
+        started = time.monotonic()
+        _active.setdefault(name, []).append(started)
+        try:
+            return await fn(client, update, *args, **kwargs)
+        finally:
+            elapsed = time.monotonic() - started
+            running = _active.get(name)
+            if running:
+                running.remove(started)
+                if not running:
+                    _active.pop(name, None)
+            HANDLER_SECONDS.observe(elapsed, handler=name)
+            if elapsed > HANDLER_SLOW_SECONDS:
+                log.info(f"handler {name} took {elapsed:.1f}s")
+    return wrapper
+
+
+def running_handlers() -> str:
+    now = time.monotonic()
+    return ", ".join(f"{name} ({now - t:.1f}s)" for name, starts in _active.items() for t in starts) or "none"
+
+
+def _thread_stack(thread_id: int) -> str:
+    frame = sys._current_frames().get(thread_id)
+    if frame is None:
+        return "(no frame)"
+    return "".join(traceback.format_stack(frame, limit=_STACK_LIMIT))
+
+
+class LoopWatchdog:
+    """Heartbeat on the loop plus a thread that dumps the loop's stack when the heartbeat stalls."""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, stall: float = LOOP_STALL_SECONDS):
+        self.interval = interval
+        self.stall = stall
+        self.beat = time.monotonic()
+        self.max_lag = 0.0
+        self._loop_thread = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        log.info(f"loop watchdog started (stall threshold {self.stall}s)")
+        return self
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG.observe(lag)
+            self.beat = time.monotonic()
+
+    def _watch(self):
+        stalled_since = None
+        while not self._stop.wait(min(self.interval, self.stall) / 2):
+            silent = time.monotonic() - self.beat
+            if silent > self.stall + self.interval:
+                if stalled_since is None:
+                    stalled_since = self.beat
+                    LOOP_STALLS.inc()
+                    log.warning(f"event loop blocked for {silent:.1f}s; running handlers: {running_handlers()}\n"
+                                f"loop thread stack:\n{_thread_stack(self._loop_thread)}")
+            elif stalled_since is not None:
+                log.warning(f"event loop recovered after {self.beat - stalled_since:.1f}s")
+                stalled_since = None
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+
+class Profiler:
+    """Statistical profiler: samples one thread's stack every ``interval`` seconds."""
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _key(frame) -> tuple:
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        return tuple(reversed(parts))
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[self._key(frame)] += 1
+                self.samples += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def report(self, top: int = 40) -> str:
+        """Summary of the hottest functions, then collapsed stacks (flamegraph.pl / speedscope input)."""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for fn in set(stack):
+                total[fn] += count
+        n = max(1, self.samples)
+        lines = [f"# {self.samples} samples every {self.interval * 1000:.0f} ms", "",
+                 "# self%   total%  function (file:name:line)"]
+        for fn, count in own.most_common(top):
+            lines.append(f"{count * 100 / n:6.1f}  {total[fn] * 100 / n:6.1f}  {fn}")
+        lines += ["", "# collapsed stacks"]
+        lines += [f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()]
+        return "\n".join(lines) + "\n"
+
+
+_profiling = False
+
+
+async def profile(seconds: float, path: str) -> str:
+    """Sample the loop thread for ``seconds`` and write the report to ``path``; one profile at a time."""
+    global _profiling
+    if _profiling:
+        raise RuntimeError("a profile is already running")
+    _profiling = True
+    try:
+        profiler = Profiler(threading.get_ident()).start()
+        try:
+            await asyncio.sleep(min(max(1.0, seconds), PROFILE_MAX_SECONDS))
+        finally:
+            profiler.stop()
+        await asyncio.get_running_loop().run_in_executor(None, _write, path, profiler.report())
+    finally:
+        _profiling = False
+    return path
+
+
+def _write(path: str, text: str):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
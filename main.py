@@ -11,7 +11,7 @@
 #
 # Usage:
 #   - Place this file as main.py
-#   - Ensure requirements installed (pyrogram, aiohttp, requests, pyromod, yt-dlp, tgcrypto)
+#   - Ensure requirements installed (pyrogram, aiohttp, pyromod, yt-dlp, tgcrypto)
 #   - Run: python main.py
 #
 # Author: merged by assistant for user
@@ -25,19 +25,40 @@ import time
 import shutil
 import logging
 import asyncio
-import subprocess
+import functools
 from datetime import datetime
 from typing import Optional, Tuple, List
+from urllib.parse import urlsplit
 
-# Networking / HTTP
-import requests
-from aiohttp import ClientSession
+# Networking / HTTP (one shared pooled aiohttp session)
+import httpclient
 
 # Pyrogram
-from pyrogram import Client, filters
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from pyrogram import Client, filters, idle
+from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, ChatMemberUpdated
+from pyrogram.handlers import ChatMemberUpdatedHandler
 from pyrogram.errors import UserNotParticipant, FloodWait
-from pyrogram.enums import ChatMemberStatus
+
+from core import run_process, probe_media, make_thumbnail, direct_download_video, test_url_accessibility, get_video_download_strategy
+from tgupload import stream_url_to_chat, send_file_parallel, PARALLEL_UPLOAD_MIN
+from utils import progress_bar
+from progress import StatusProgress
+from pipeline import BatchPipeline
+import ytpool
+import formats
+import hls
+import linkparser
+import preflight
+import jobs
+import store
+import metrics
+from scheduler import FairScheduler
+from scratch import ScratchSpace
+import ratelimit
+import loopwatch
+import membership
+from ratelimit import RateLimitedClient
+from mediacache import MediaCache, MEDIA_CACHE_HASH, url_key, content_key, media_from_message
 
 # optional: pyromod.listen used for nicer conversation flow; fallback to manual listen if not present
 try:
@@ -50,7 +71,7 @@ except Exception:
 # -------------------------
 # You can create a vars.py with these variables or set environment variables.
 try:
-    from vars import API_ID, API_HASH, BOT_TOKEN, OWNER_ID, CREDIT, FORCE_SUB_CHANNEL, FORCE_SUB_CHANNEL_LINK
+    from vars import API_ID, API_HASH, BOT_TOKEN, OWNER_ID, CREDIT, FORCE_SUB_CHANNEL, FORCE_SUB_CHANNEL_LINK, DATABASE_URL
 except Exception:
     API_ID = int(os.getenv("API_ID", "0") or 0)
     API_HASH = os.getenv("API_HASH", "") or ""
@@ -59,6 +80,7 @@ except Exception:
     CREDIT = os.getenv("CREDIT", "UG")
     FORCE_SUB_CHANNEL = os.getenv("FORCE_SUB_CHANNEL", "") or ""
     FORCE_SUB_CHANNEL_LINK = os.getenv("FORCE_SUB_CHANNEL_LINK", FORCE_SUB_CHANNEL)
+    DATABASE_URL = os.getenv("DATABASE_URL", "") or ""
 
 # runtime paths
 DOWNLOADS_DIR = os.getenv("DOWNLOADS_DIR", "downloads")
@@ -67,6 +89,18 @@ COOKIES_FILE = os.getenv("COOKIES_FILE", "youtube_cookies.txt")
 WELCOME_IMAGE = os.getenv("WELCOME_IMAGE", "welcome.jpg")
 LOG_FILE = os.getenv("LOG_FILE", "bot.log")
 
+# batch pipeline: parallel downloads feeding ordered uploads
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "3") or 3)
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "1") or 1)
+PIPELINE_PREFETCH = int(os.getenv("PIPELINE_PREFETCH", "2") or 2)
+# opt-in: upload direct video links to Telegram while they are still downloading
+STREAM_UPLOAD = os.getenv("STREAM_UPLOAD", "0") == "1"
+# probe every link of an /upload batch before it starts; start big files first
+PREFLIGHT = os.getenv("PREFLIGHT", "1") == "1"
+PREFLIGHT_LARGE_FIRST = os.getenv("PREFLIGHT_LARGE_FIRST", "1") == "1"
+# times an upload is retried after FloodWait before the item counts as failed
+UPLOAD_FLOOD_RETRIES = int(os.getenv("UPLOAD_FLOOD_RETRIES", "5") or 5)
+
 # logging
 logging.basicConfig(
     level=logging.INFO,
@@ -76,32 +110,17 @@ logging.basicConfig(
 log = logging.getLogger(__name__)
 
 # pyrogram client
-bot = Client("merged_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN, workers=100)
+# every API call goes through the global/per-chat rate limiter
+bot = RateLimitedClient("merged_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN, workers=100)
 
 # -------------------------
-# Minimal DB shim (in-memory) - replace with real db module if available
+# Database: admins/users/log channels (Mongo or SQLite, mirrored in memory) + batch job store
 # -------------------------
-class SimpleDB:
-    def __init__(self):
-        self.admins = set()
-        self.users = set()
-        self.log_channel = {}
-        self.channels = set()
-    def is_admin(self, user_id):
-        return user_id in self.admins or user_id == OWNER_ID
-    def add_admin(self, user_id):
-        self.admins.add(user_id)
-    def is_user_authorized(self, user_id, bot_username=None):
-        # default allow; extend as needed
-        return True
-    def is_channel_authorized(self, channel_id, bot_username=None):
-        return True
-    def set_log_channel(self, bot_username, cid):
-        self.log_channel[bot_username] = cid
-        return True
-    def get_log_channel(self, bot_username):
-        return self.log_channel.get(bot_username)
-db = SimpleDB()
+db = store.open_database(DATABASE_URL, OWNER_ID)
+media_cache = MediaCache()
+# every batch item downloads into its own directory under DOWNLOADS_DIR/jobs
+workspace = ScratchSpace(DOWNLOADS_DIR)
+scheduler = FairScheduler(DOWNLOADS_DIR, room=workspace.has_room)
 
 # prefill owner as admin
 if OWNER_ID:
@@ -111,92 +130,205 @@ if OWNER_ID:
 # Utilities: URL parsing, extraction, safe shell run
 # -------------------------
 URL_RE = re.compile(r"https?://[^\s]+")
-def is_valid_url(url: str) -> bool:
-    return bool(URL_RE.search(url)) if url else False
-
-def extract_url_from_line(line: str) -> Tuple[Optional[str], Optional[str]]:
-    if not line:
-        return None, None
-    line = line.strip()
-    m = URL_RE.search(line)
-    if m:
-        url = m.group(0)
-        title = line.replace(url, "").strip() or f"File_{abs(hash(url))%10000}"
-        return title, url
-    # try domain only
-    if '.' in line and not line.startswith('/'):
-        url = 'https://' + line
-        if is_valid_url(url):
-            return f"File_{abs(hash(line))%10000}", url
-    return None, None
+async def read_link_file(client: Client, doc: Message, **kwargs) -> List[Tuple[str, str]]:
+    """Parse a .txt link list straight off Telegram's download stream (no temp file)."""
+    parser = linkparser.LinkParser(**kwargs)
+    links = [link async for link in linkparser.iter_links(client.stream_media(doc), parser)]
+    log.info(f"parsed {doc.document.file_name}: {parser.stats()}")
+    return links
+
+def clean_title(title: str) -> str:
+    return re.sub(r'[<>:"/\\|?*]', '', title)[:60]
 
-def safe_run(cmd: str, timeout: int = 300) -> Tuple[int, str, str]:
-    """Run shell command safely, return (rc, stdout, stderr)."""
+async def safe_run(cmd, timeout: int = 300) -> Tuple[int, str, str]:
+    """Run a command (argv list or string) without blocking the loop, return (rc, stdout, stderr)."""
     try:
-        p = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=timeout)
-        return p.returncode, p.stdout, p.stderr
-    except subprocess.TimeoutExpired as e:
-        return -1, "", f"Timeout: {e}"
+        return await run_process(cmd, timeout=timeout)
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
         return -1, "", str(e)
 
 # -------------------------
 # Helper functions (download/send video) with fallbacks
 # -------------------------
-async def helper_download_direct(url: str, output_name: str, format_filter: str = "best") -> Optional[str]:
+async def helper_download_direct(url: str, output_name: str, format_filter: str = "best", quality: Optional[str] = None,
+                                 progress=None) -> Optional[str]:
     """
-    Uses yt-dlp to download the URL into output_name (without extension).
+    Uses yt-dlp to download the URL into output_name (a path without extension,
+    normally inside the item's scratch directory). With ``quality`` the format is chosen from the URL's cached format list
+    (formats.select) instead of ``format_filter``. ``progress`` is awaited as progress(downloaded, total).
+    HLS playlists go through the native segment downloader first (hls.py); yt-dlp
+    takes over whatever it does not support.
     Returns path to downloaded file or None on failure.
     """
+    if hls.HLS_NATIVE and is_m3u8_content(url):
+        path = await hls.download(url, output_name, quality, progress=progress)
+        if path:
+            metrics.DOWNLOAD_PATH.inc(path="hls_native")
+            return path
+    info = None
+    if quality:
+        format_filter, info = await formats.select(url, quality)
     # construct yt-dlp command
     # prefer mp4 if video, else keep ext
     out_pattern = f"{output_name}.%(ext)s"
-    cmd = f'yt-dlp -f "{format_filter}" "{url}" -o "{out_pattern}" --no-warnings'
-    log.info(f"Executing: {cmd}")
-    rc, out, err = safe_run(cmd, timeout=1800)
+    args = ["-f", format_filter, url, "-o", out_pattern, "--no-warnings"]
+    log.info(f"Executing: yt-dlp {' '.join(args)}")
+    rc, path, err = await ytpool.download(args, progress, timeout=1800, info=info)
+    metrics.YTDLP_EXIT.inc(code=rc)
+    metrics.DOWNLOAD_PATH.inc(path="ytdlp")
     if rc != 0:
         log.warning(f"yt-dlp failed for {url}: rc={rc} err={err[:200]}")
-    # find created file
+    if path and os.path.exists(path):
+        return path
+    # yt-dlp reports the final path; this only covers the odd build that does not
     for ext in ['mp4', 'mkv', 'webm', 'mp3', 'pdf', 'jpg', 'png', 'mpeg']:
         candidate = f"{output_name}.{ext}"
         if os.path.exists(candidate):
             return candidate
-    # try to grab any matching file (glob)
-    for f in os.listdir('.'):
-        if f.startswith(output_name) and f != __file__:
-            return f
     return None
 
-async def helper_send_vid(client: Client, chat_id, caption: str, filename: str, thumb: Optional[str], display_name: str, channel_id: Optional[int] = None, watermark: Optional[str] = None):
-    """Sends a video or file to chat. If video, uses send_video; otherwise send_document."""
+async def helper_send_vid(client: Client, chat_id, caption: str, filename, thumb: Optional[str], display_name: str, channel_id: Optional[int] = None, watermark: Optional[str] = None, cache_key: Optional[str] = None,
+                         progress=None):
+    """
+    Sends a video or file to chat. If video, uses send_video; otherwise send_document.
+    filename may also be a media_cache entry (dict with file_id), which is re-sent
+    without uploading. Successful uploads are recorded under cache_key.
+    ``progress`` (a progress.StatusProgress) reports the transfer on the chat's status line.
+    """
+    target = chat_id if channel_id is None else channel_id
+    made_thumb = None
     try:
+        if isinstance(filename, dict) and filename.get("stream_url"):
+            filename = await _send_streamed(client, target, caption, filename, cache_key, progress)
+            if filename is True:
+                return True
+            if not filename:
+                return False
+        if isinstance(filename, dict):
+            try:
+                await client.send_cached_media(target, filename["file_id"], caption=caption)
+            except FloodWait:
+                raise
+            except Exception as e:
+                # stale file_id: drop it so the next attempt downloads again
+                log.warning(f"cached send failed, invalidating: {e}")
+                if cache_key:
+                    media_cache.invalidate(cache_key)
+                return False
+            return True
         if not os.path.exists(filename):
             log.warning("File not found for send_vid: " + filename)
             return False
+        hash_key = None
+        if MEDIA_CACHE_HASH:
+            # same bytes under a different URL: reuse the earlier upload
+            hash_key = await content_key(filename)
+            hit = media_cache.get(hash_key)
+            if hit:
+                await client.send_cached_media(target, hit["file_id"], caption=caption)
+                _remove_quietly(filename)
+                if cache_key:
+                    media_cache.put(cache_key, hit)
+                return True
         # choose send method by extension
         lower = filename.lower()
-        if lower.endswith(('.mp4', '.mkv', '.webm', '.mov', '.avi', '.mpeg')):
-            await client.send_video(chat_id if channel_id is None else channel_id, filename, caption=caption, supports_streaming=True, thumb=thumb if thumb and os.path.exists(thumb) else None)
-        elif lower.endswith(('.pdf', '.zip', '.epub', '.txt')):
-            await client.send_document(chat_id if channel_id is None else channel_id, filename, caption=caption)
-        elif lower.endswith(('.jpg', '.jpeg', '.png', '.gif')):
-            await client.send_photo(chat_id if channel_id is None else channel_id, filename, caption=caption)
-        else:
-            await client.send_document(chat_id if channel_id is None else channel_id, filename, caption=caption)
+        is_video = lower.endswith(('.mp4', '.mkv', '.webm', '.mov', '.avi', '.mpeg'))
+        info = {}
+        if is_video:
+            # real duration/dimensions and a thumbnail from one probe
+            info = await probe_media(filename)
+            if not (thumb and os.path.exists(thumb)):
+                thumb = made_thumb = await make_thumbnail(filename, info)
+        sent = None
+        if os.path.getsize(filename) >= PARALLEL_UPLOAD_MIN and not lower.endswith(('.jpg', '.jpeg', '.png', '.gif')):
+            sent = await _send_parallel(client, target, caption, filename, thumb, display_name, info, progress)
+        if sent is None:
+            if is_video:
+                sent = await client.send_video(target, filename, caption=caption, supports_streaming=True,
+                                               duration=int(info.get('duration') or 0), width=info.get('width') or 0,
+                                               height=info.get('height') or 0,
+                                               thumb=thumb if thumb and os.path.exists(thumb) else None)
+            elif lower.endswith(('.pdf', '.zip', '.epub', '.txt')):
+                sent = await client.send_document(target, filename, caption=caption)
+            elif lower.endswith(('.jpg', '.jpeg', '.png', '.gif')):
+                sent = await client.send_photo(target, filename, caption=caption)
+            else:
+                sent = await client.send_document(target, filename, caption=caption)
+        media = media_from_message(sent)
+        if media:
+            for key in (cache_key, hash_key):
+                if key:
+                    media_cache.put(key, media)
         # clean up local file after sending
-        try:
-            os.remove(filename)
-        except Exception:
-            pass
+        _remove_quietly(filename)
+        if made_thumb:
+            _remove_quietly(made_thumb)
         return True
-    except FloodWait as e:
-        log.warning(f"FloodWait: sleeping {e.x}")
-        await asyncio.sleep(e.x)
-        return False
+    except FloodWait:
+        # the file is still on disk; run_batch waits out the flood and sends it again
+        raise
     except Exception as e:
         log.exception("send_vid error: " + str(e))
         return False
 
+async def _send_streamed(client: Client, target, caption: str, source: dict, cache_key: Optional[str], progress=None):
+    """
+    Forward a direct HTTP file to Telegram while it downloads. Returns True when
+    sent, otherwise the path of a conventional download to upload instead (or None).
+    """
+    url, file_name = source["stream_url"], source["file_name"]
+    try:
+        sent = await stream_url_to_chat(client, target, url, file_name, caption, progress=progress)
+        media = media_from_message(sent)
+        if media and cache_key:
+            media_cache.put(cache_key, media)
+        return True
+    except FloodWait:
+        raise
+    except Exception as e:
+        log.warning(f"streamed upload failed for {url}, downloading instead: {e}")
+    return await direct_download_video(url, source.get("fallback") or os.path.splitext(file_name)[0], progress)
+
+async def _send_parallel(client: Client, target, caption: str, filename: str, thumb: Optional[str], display_name: str,
+                         info: Optional[dict] = None, progress=None):
+    """Upload a large file over parallel part workers; None means use the regular send methods."""
+    # batch items report on the chat's status message; others get their own progress message
+    reply = None if progress else await client.send_message(target, f"**Uploading ...** - `{display_name}`")
+    try:
+        info = info or {}
+        return await send_file_parallel(client, target, filename, caption, thumb=thumb,
+                                        duration=int(info.get('duration') or 0), width=info.get('width') or 0,
+                                        height=info.get('height') or 0,
+                                        progress=progress or progress_bar,
+                                        progress_args=() if progress else (reply, time.time()))
+    except FloodWait:
+        raise
+    except Exception as e:
+        log.warning(f"parallel upload failed for {filename}, retrying with send_video/document: {e}")
+        return None
+    finally:
+        if reply:
+            try:
+                await reply.delete(True)
+            except Exception:
+                pass
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except Exception:
+        pass
+
+def new_pipeline(download, upload, on_failure=None, priority=None) -> BatchPipeline:
+    """Batch engine shared by /upload, /drm and single links, sized from the env config."""
+    return BatchPipeline(download, upload, on_failure,
+                         download_workers=DOWNLOAD_WORKERS,
+                         upload_workers=UPLOAD_WORKERS,
+                         prefetch=PIPELINE_PREFETCH,
+                         priority=priority)
+
 # -------------------------
 # DRM Hooks - placeholders and simplified implementations.
 # These attempt to cover common patterns seen in uploaded files (classplus, encrypted.m, appx, etc.)
@@ -218,7 +350,7 @@ def is_classplus_url(url: str) -> bool:
 def is_m3u8_content(url: str) -> bool:
     return 'm3u8' in url or url.endswith('.m3u8')
 
-def placeholder_get_mpd_and_keys(api_url: str) -> Tuple[Optional[str], Optional[List[str]]]:
+async def placeholder_get_mpd_and_keys(api_url: str) -> Tuple[Optional[str], Optional[List[str]]]:
     """
     Placeholder: call an API (like apixug) to exchange DRM URL for mpd and keys.
     Return (mpd_url, [key1:keyid:hex, ...]) or (None, None) on failure.
@@ -226,9 +358,8 @@ def placeholder_get_mpd_and_keys(api_url: str) -> Tuple[Optional[str], Optional[
     log.info(f"placeholder_get_mpd_and_keys: {api_url}")
     try:
         # Example: a simple GET returning JSON {data:{mpd:..., keys: [...]}}
-        r = requests.get(api_url, timeout=15)
-        if r.status_code == 200:
-            data = r.json()
+        status, data = await httpclient.get_json(api_url, timeout=15)
+        if status == 200 and isinstance(data, dict):
             mpd = data.get('data', {}).get('url') or data.get('data', {}).get('mpd')
             keys = data.get('data', {}).get('keys') or data.get('keys')
             if mpd and keys:
@@ -240,19 +371,34 @@ def placeholder_get_mpd_and_keys(api_url: str) -> Tuple[Optional[str], Optional[
 # -------------------------
 # Force-subscribe decorator
 # -------------------------
-async def _is_subscribed(client: Client, user_id: int) -> bool:
-    if not FORCE_SUB_CHANNEL:
-        return True
+sub_cache = membership.MembershipCache()
+
+async def _fetch_subscribed(client: Client, user_id: int) -> Optional[bool]:
+    """One get_chat_member call; None when it failed (not cached)."""
     try:
-        member = await client.get_chat_member(FORCE_SUB_CHANNEL, user_id)
-        return member.status in (ChatMemberStatus.OWNER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.MEMBER)
+        return membership.is_member(await client.get_chat_member(FORCE_SUB_CHANNEL, user_id))
     except UserNotParticipant:
         return False
     except Exception as e:
         log.warning("is_subscribed error: " + str(e))
-        return False
+        return None
+
+async def _is_subscribed(client: Client, user_id: int) -> bool:
+    if not FORCE_SUB_CHANNEL:
+        return True
+    return await sub_cache.check(user_id, lambda: _fetch_subscribed(client, user_id))
+
+async def _on_channel_member(client: Client, update: ChatMemberUpdated):
+    # joins/leaves in the force-sub channel keep the cache current with no lookups
+    sub_cache.observe(update)
+
+if FORCE_SUB_CHANNEL:
+    # delivered only while the bot is an admin of the channel; otherwise entries just expire
+    _sub_chat = int(FORCE_SUB_CHANNEL) if str(FORCE_SUB_CHANNEL).lstrip("-").isdigit() else FORCE_SUB_CHANNEL
+    bot.add_handler(ChatMemberUpdatedHandler(_on_channel_member, filters.chat(_sub_chat)))
 
 def force_subscribe(handler):
+    @functools.wraps(handler)
     async def wrapper(client: Client, message: Message):
         if FORCE_SUB_CHANNEL:
             ok = await _is_subscribed(client, message.from_user.id)
@@ -267,8 +413,11 @@ def force_subscribe(handler):
     return wrapper
 
 @bot.on_callback_query()
+@loopwatch.handler
 async def _cb_handler(client: Client, query: CallbackQuery):
     if query.data == "refresh_sub":
+        # the user says they joined: ask Telegram again instead of trusting the cached "no"
+        sub_cache.invalidate(query.from_user.id)
         ok = await _is_subscribed(client, query.from_user.id)
         if ok:
             await query.answer("✅ Verified — you may use the bot now.", show_alert=True)
@@ -283,13 +432,16 @@ async def _cb_handler(client: Client, query: CallbackQuery):
 # Commands: start, setlog, getlog
 # -------------------------
 @bot.on_message(filters.command("start") & (filters.private | filters.channel))
+@loopwatch.handler
 @force_subscribe
 async def cmd_start(client: Client, m: Message):
     try:
         if m.chat.type == "channel":
+            db.add_channel(m.chat.id)
             # channel welcome
             await m.reply_text("✨ Bot is active in this channel. Use /upload or /drm in the channel.")
             return
+        db.record_command(m.from_user)
         is_admin = db.is_admin(m.from_user.id)
         is_auth = db.is_user_authorized(m.from_user.id, client.me.username) if db else True
         if not is_auth:
@@ -304,7 +456,7 @@ async def cmd_start(client: Client, m: Message):
             "• /getcookies - Get current cookies file\n"
         )
         if is_admin:
-            text += "\nAdmin: /setlog <channel_id> | /getlog"
+            text += "\nAdmin: /setlog <channel_id> | /getlog | /profile [seconds]"
         kb = InlineKeyboardMarkup([[InlineKeyboardButton("📚 Help", url="https://t.me/ItsUGBot")]])
         if os.path.exists(WELCOME_IMAGE):
             await m.reply_photo(WELCOME_IMAGE, caption=text, reply_markup=kb)
@@ -315,6 +467,7 @@ async def cmd_start(client: Client, m: Message):
         await m.reply_text("Error in start: " + str(e))
 
 @bot.on_message(filters.command("setlog") & filters.private)
+@loopwatch.handler
 async def cmd_setlog(client: Client, m: Message):
     if not db.is_admin(m.from_user.id):
         return await m.reply_text("❌ You are not authorized.")
@@ -329,6 +482,7 @@ async def cmd_setlog(client: Client, m: Message):
         await m.reply_text("Invalid channel id.")
 
 @bot.on_message(filters.command("getlog") & filters.private)
+@loopwatch.handler
 async def cmd_getlog(client: Client, m: Message):
     if not db.is_admin(m.from_user.id):
         return await m.reply_text("❌ You are not authorized.")
@@ -338,10 +492,30 @@ async def cmd_getlog(client: Client, m: Message):
     else:
         await m.reply_text("No log channel set. Use /setlog <channel_id>.")
 
+@bot.on_message(filters.command("profile") & filters.private)
+@loopwatch.handler
+async def cmd_profile(client: Client, m: Message):
+    if not db.is_admin(m.from_user.id):
+        return await m.reply_text("❌ You are not authorized.")
+    parts = m.text.split()
+    seconds = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 30
+    seconds = min(seconds, loopwatch.PROFILE_MAX_SECONDS)
+    status = await m.reply_text(f"⏱ Profiling the event loop for {seconds}s ...")
+    path = os.path.join(DOWNLOADS_DIR, f"profile_{int(time.time())}.txt")
+    try:
+        await loopwatch.profile(seconds, path)
+        await client.send_document(m.chat.id, path, caption=f"Loop profile ({seconds}s)\nRunning handlers: {loopwatch.running_handlers()}")
+        await status.delete()
+    except RuntimeError as e:
+        await status.edit(f"❌ {e}")
+    finally:
+        _remove_quietly(path)
+
 # -------------------------
 # Cookies handlers
 # -------------------------
 @bot.on_message(filters.command("cookies") & filters.private)
+@loopwatch.handler
 async def cmd_cookies(client: Client, m: Message):
     await m.reply_text("📥 Send cookies file (.txt)")
     try:
@@ -358,6 +532,7 @@ async def cmd_cookies(client: Client, m: Message):
         await m.reply_text("Error saving cookies: " + str(e))
 
 @bot.on_message(filters.command("getcookies") & filters.private)
+@loopwatch.handler
 async def cmd_getcookies(client: Client, m: Message):
     if os.path.exists(COOKIES_FILE):
         await client.send_document(m.chat.id, COOKIES_FILE, caption="Here is the cookies file.")
@@ -368,6 +543,7 @@ async def cmd_getcookies(client: Client, m: Message):
 # Text to txt converter
 # -------------------------
 @bot.on_message(filters.command("t2t") & filters.private)
+@loopwatch.handler
 async def cmd_t2t(client: Client, m: Message):
     ask = await m.reply_text("✍️ Send the text to convert into a .txt file (you have 2 minutes).")
     try:
@@ -398,12 +574,283 @@ async def cmd_t2t(client: Client, m: Message):
     except Exception:
         pass
 
+# -------------------------
+# Batch queue: handlers only enqueue; batches run as background tasks from the job store
+# -------------------------
+def _job_key(batch_id: int, idx: int) -> str:
+    return f"{batch_id}_{idx}"
+
+def _out(item, name: str) -> str:
+    """Output path (without extension) for an item's download, inside its scratch directory."""
+    return os.path.join(item.get("workdir") or DOWNLOADS_DIR, name)
+
+def _untrack(item):
+    progress = item.pop("progress", None)
+    if progress:
+        progress.finish()
+
+def _track(client: Client, batch, item, label: str, icon: str) -> StatusProgress:
+    """Give the item a line on the chat's status message (one line per running item)."""
+    item["progress"] = StatusProgress(client, batch["chat_id"], _job_key(batch["id"], item["idx"]), label, icon).start()
+    return item["progress"]
+
+async def _upload_download(client: Client, batch, item):
+    idx, title, url = item["idx"], item["title"], item["url"]
+    quality = batch["options"].get("quality", "480")
+    display_title = clean_title(title)
+    safe_name = _out(item, f"{str(idx+1).zfill(3)}_{display_title}")
+    progress = _track(client, batch, item, f"Downloading {display_title} ({idx+1}/{batch['total']})", "⬇️")
+    # preprocess url
+    url = try_fix_drive_link(url)
+    # DRM detection
+    if is_classplus_url(url):
+        # try to get signed mpd using placeholder_get_mpd_and_keys
+        mpd, keys = await placeholder_get_mpd_and_keys(url)
+        if mpd:
+            # use mpd as URL for yt-dlp
+            return await helper_download_direct(mpd, safe_name, quality=quality, progress=progress)
+        # fallback to direct yt-dlp
+        return await helper_download_direct(url, safe_name, quality=quality, progress=progress)
+    # m3u8 links go to hls.download inside helper_download_direct
+    return await helper_download_direct(url, safe_name, quality=quality, progress=progress)
+
+async def _upload_send(client: Client, batch, item, outpath):
+    display_title = clean_title(item["title"])
+    safe_name = f"{str(item['idx']+1).zfill(3)}_{display_title}"
+    opts = batch["options"]
+    cap = opts.get("caption") or f"📁 {display_title}\n📦 Batch: {opts.get('batch_name')}\nExtracted by: {CREDIT}"
+    return await helper_send_vid(client, batch["chat_id"], cap, outpath, None, safe_name, cache_key=item.get("cache_key"),
+                                 progress=item.get("progress"))
+
+async def _upload_failed(client: Client, batch, item, exc):
+    if exc:
+        await client.send_message(batch["chat_id"], f"❌ Error for {item['title']}: {str(exc)[:200]}")
+    else:
+        await client.send_message(batch["chat_id"], f"❌ Failed to download {clean_title(item['title'])}")
+
+async def _drm_download(client: Client, batch, item):
+    i, url = item["idx"], item["url"]
+    quality = batch["options"].get("quality", "480")
+    token = batch["options"].get("token")
+    display_title = clean_title(item["title"])
+    progress = _track(client, batch, item, f"Processing DRM: {display_title} ({i+1}/{batch['total']})", "🔐")
+    # If classplus, use placeholder API flow
+    if is_classplus_url(url):
+        api_call = url
+        if token:
+            api_call = f"{url}?token={token}"
+        mpd, keys = await placeholder_get_mpd_and_keys(api_call)
+        if mpd:
+            return await helper_download_direct(mpd, _out(item, f"drm_{i+1}_{display_title}"), quality=quality, progress=progress)
+    return await helper_download_direct(url, _out(item, f"drm_{i+1}_{display_title}"), quality=quality, progress=progress)
+
+async def _drm_send(client: Client, batch, item, out):
+    display_title = clean_title(item["title"])
+    caption = f"🔐 {display_title}\nExtracted by {CREDIT}"
+    return await helper_send_vid(client, batch["chat_id"], caption, out, None, display_title, cache_key=item.get("cache_key"),
+                                 progress=item.get("progress"))
+
+async def _drm_failed(client: Client, batch, item, exc):
+    if exc:
+        await client.send_message(batch["chat_id"], f"❌ Error: {str(exc)[:200]}")
+    else:
+        await client.send_message(batch["chat_id"], f"❌ Failed: {clean_title(item['title'])}")
+
+async def _quick_download(client: Client, batch, item):
+    quality = batch["options"].get("quality", "480")
+    progress = _track(client, batch, item, f"Downloading {item['title']}", "⬇️")
+    return await helper_download_direct(item["url"], _out(item, f"quick_{item['title']}"), quality=quality, progress=progress)
+
+async def _quick_send(client: Client, batch, item, out):
+    name = item["title"]
+    return await helper_send_vid(client, batch["chat_id"], f"Downloaded: {name}", out, None, name, cache_key=item.get("cache_key"),
+                                 progress=item.get("progress"))
+
+async def _quick_failed(client: Client, batch, item, exc):
+    await client.send_message(batch["chat_id"], "❌ Failed to download link.")
+
+# kind -> (download, upload, on_failure)
+BATCH_KINDS = {
+    "upload": (_upload_download, _upload_send, _upload_failed),
+    "drm": (_drm_download, _drm_send, _drm_failed),
+    "quick": (_quick_download, _quick_send, _quick_failed),
+}
+_batch_tasks = set()
+
+async def run_batch(client: Client, batch_id: int):
+    """Process the unfinished items of a stored batch, recording each item's status."""
+    batch = db.get_batch(batch_id)
+    if not batch:
+        return
+    download, upload, on_failure = BATCH_KINDS[batch["kind"]]
+    bid = batch["id"]
+
+    async def _download(item):
+        # a link already uploaded at this quality is re-sent by file_id, no download
+        item["cache_key"] = url_key(item["url"], batch["options"].get("quality", ""))
+        hit = media_cache.get(item["cache_key"])
+        if hit:
+            log.info(f"media cache hit for {item['url']}")
+            return hit
+        # fair share of the global download slots, gated on free disk; only the
+        # part of the size hint not yet written to the job directory is reserved
+        key = _job_key(bid, item["idx"])
+        async with scheduler.slot(batch["user_id"], item.get("size_hint", 0),
+                                  functools.partial(workspace.written, key)):
+            db.set_item_status(bid, item["idx"], jobs.DOWNLOADING)
+            item["workdir"] = workspace.create(key)
+            if STREAM_UPLOAD:
+                source = await _stream_source(item)
+                if source:
+                    _track(client, batch, item, f"Streaming {clean_title(item['title'])}", "⬆️")
+                    metrics.DOWNLOAD_PATH.inc(path="stream_upload")
+                    return source
+            started = time.monotonic()
+            async with metrics.stage("download"):
+                out = await download(client, batch, item)
+            if isinstance(out, str) and os.path.exists(out):
+                metrics.transfer("download", os.path.getsize(out), time.monotonic() - started)
+            return out
+
+    async def _upload(item, out):
+        try:
+            db.set_item_status(bid, item["idx"], jobs.UPLOADING)
+            size = 0
+            if isinstance(out, str):
+                size = os.path.getsize(out) if os.path.exists(out) else 0
+                _track(client, batch, item, f"Uploading {clean_title(item['title'])}", "⬆️")
+            attempt = 0
+            while True:
+                try:
+                    async with metrics.stage("upload"):
+                        ok = await upload(client, batch, item, out)
+                    break
+                except FloodWait as e:
+                    # keep the file and put the item back once the chat may send again
+                    attempt += 1
+                    if attempt > UPLOAD_FLOOD_RETRIES:
+                        ok = False
+                        break
+                    wait = ratelimit.retry_after(e)
+                    log.warning(f"upload of item {item['idx']} hit FloodWait, retrying in {wait}s")
+                    db.set_item_status(bid, item["idx"], jobs.PENDING, f"floodwait {wait}s")
+                    await asyncio.sleep(wait)
+                    db.set_item_status(bid, item["idx"], jobs.UPLOADING)
+            db.set_item_status(bid, item["idx"], jobs.DONE if ok else jobs.FAILED, None if ok else "upload failed")
+            metrics.ITEMS.inc(kind=batch["kind"], result="done" if ok else "upload_failed")
+            if ok:
+                db.record_item(batch["user_id"], size)
+            return ok
+        finally:
+            # the item is finished either way: drop its file, thumbnail, partials and status line
+            workspace.release(_job_key(bid, item["idx"]))
+            _untrack(item)
+
+    async def _failed(item, exc):
+        try:
+            db.set_item_status(bid, item["idx"], jobs.FAILED, str(exc)[:500] if exc else "download failed")
+            metrics.ITEMS.inc(kind=batch["kind"], result="download_failed")
+            await on_failure(client, batch, item, exc)
+        finally:
+            workspace.release(_job_key(bid, item["idx"]))
+            _untrack(item)
+
+    # sizes come from the pre-flight probe; unknown ones (0) keep batch order
+    priority = (lambda item: item.get("size_hint") or 0) if PREFLIGHT_LARGE_FIRST else None
+    try:
+        await new_pipeline(_download, _upload, _failed, priority).run(db.pending_items(bid))
+    finally:
+        # remove the status message unless another batch in the chat still shows a line
+        if not ratelimit.status.lines.get(batch["chat_id"]):
+            await ratelimit.status.close(batch["chat_id"])
+    db.finish_batch(bid)
+    if batch["kind"] == "quick":
+        return
+    counts = db.batch_counts(bid)
+    success, failed = counts.get(jobs.DONE, 0), counts.get(jobs.FAILED, 0)
+    if batch["kind"] == "drm":
+        await client.send_message(batch["chat_id"], f"✅ DRM task completed. Success: {success}, Failed: {failed}")
+    else:
+        await client.send_message(batch["chat_id"], f"✅ Done. Success: {success}, Failed: {failed}")
+
+async def _stream_source(item):
+    """Describe a direct file of known size for streamed upload, or None to download normally."""
+    url = try_fix_drive_link(item["url"])
+    if get_video_download_strategy(url) != 'direct_primary':
+        return None
+    info = await test_url_accessibility(url)
+    if not info.get("accessible") or int(info.get("content_length") or 0) <= 0:
+        return None
+    ext = os.path.splitext(urlsplit(url).path)[1] or ".mp4"
+    stem = f"{str(item['idx']+1).zfill(3)}_{clean_title(item['title'])}"
+    return {"stream_url": url, "file_name": f"{stem}{ext}", "fallback": _out(item, stem)}
+
+def _collect_metrics():
+    metrics.QUEUE.set(scheduler.running(), state="downloading")
+    metrics.QUEUE.set(scheduler.queued(), state="waiting")
+    metrics.QUEUE.set(len(_batch_tasks), state="batches")
+    for stat, value in media_cache.stats().items():
+        metrics.CACHE.set(value, stat=stat)
+    for stat, value in sub_cache.stats().items():
+        metrics.SUB_CACHE.set(value, stat=stat)
+
+metrics.add_collector(_collect_metrics)
+
+async def preflight_batch(batch_id: int, msg: Message):
+    """Probe a stored batch's links, keep the results on its items and skip the dead ones."""
+    items = db.pending_items(batch_id)
+    # ClassPlus links are API calls that need the signing flow, not a plain request
+    targets = [(it["idx"], try_fix_drive_link(it["url"])) for it in items if not is_classplus_url(it["url"])]
+    if not targets:
+        return
+    try:
+        await msg.edit(f"🔍 Checking {len(targets)} links ...")
+    except Exception:
+        pass
+    results = await preflight.probe_links(targets)
+    db.record_probes(batch_id, [(r["idx"], r["size"], r["content_type"], r["strategy"]) for r in results])
+    for r in results:
+        if r["verdict"] == preflight.DEAD:
+            reason = f"HTTP {r['status']}" if r["status"] else (r.get("error") or "unreachable")
+            db.set_item_status(batch_id, r["idx"], jobs.FAILED, f"preflight: {reason}"[:500])
+            metrics.ITEMS.inc(kind="upload", result="preflight_dead")
+    summary = preflight.summarize(results, DOWNLOAD_WORKERS)
+    log.info(f"batch {batch_id} pre-flight: {summary['counts']}, ~{summary['estimated_bytes']:.0f} bytes")
+    try:
+        await msg.edit(preflight.format_summary(summary))
+    except Exception:
+        pass
+
+def start_batch(client: Client, batch_id: int):
+    """Run a stored batch in the background so the chat handler returns immediately."""
+    async def _runner():
+        try:
+            await run_batch(client, batch_id)
+        except Exception:
+            log.exception(f"batch {batch_id} crashed")
+    task = asyncio.create_task(_runner())
+    _batch_tasks.add(task)
+    task.add_done_callback(_batch_tasks.discard)
+    return task
+
+async def resume_batches(client: Client):
+    """Restart every batch that was still running when the bot went down."""
+    for batch in db.unfinished_batches():
+        log.info(f"Resuming batch {batch['id']} ({batch['kind']}) for chat {batch['chat_id']}")
+        try:
+            await client.send_message(batch["chat_id"], f"♻️ Bot restarted — resuming your batch ({batch['kind']}).")
+        except Exception:
+            pass
+        start_batch(client, batch["id"])
+
 # -------------------------
 # Upload (.txt) handler (generic downloader with batch flow)
 # -------------------------
 @bot.on_message(filters.command("upload") & filters.private)
+@loopwatch.handler
 @force_subscribe
 async def cmd_upload(client: Client, m: Message):
+    db.record_command(m.from_user)
     msg = await m.reply_text("📤 Send your .txt file with links (Name and URL per line).")
     try:
         doc = await client.listen(m.chat.id, timeout=180)
@@ -411,20 +858,11 @@ async def cmd_upload(client: Client, m: Message):
         return await msg.edit("⏳ Timeout: send file within 3 minutes.")
     if not doc or not doc.document or not doc.document.file_name.endswith(".txt"):
         return await msg.edit("❌ Please send a .txt file.")
-    path = await doc.download()
-    await doc.delete()
-    # read links
     try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            lines = [ln.strip() for ln in f if ln.strip()]
+        links = await read_link_file(client, doc)
     except Exception as e:
         return await msg.edit("Error reading file: " + str(e))
-    os.remove(path)
-    links: List[Tuple[str, str]] = []
-    for line in lines:
-        title, url = extract_url_from_line(line)
-        if title and url:
-            links.append((title, url))
+    await doc.delete()
     if not links:
         return await msg.edit("❌ No valid links found in the file.")
     await msg.edit(f"✅ Found {len(links)} links.\nSend starting index (1..{len(links)}) or /d for 1.")
@@ -464,59 +902,25 @@ async def cmd_upload(client: Client, m: Message):
             pass
     except Exception:
         caption = ""
-    await msg.edit(f"🔄 Starting downloads from index {start_idx} ...")
-    success = 0
-    failed = 0
-    for idx in range(start_idx - 1, len(links)):
-        title, url = links[idx]
-        try:
-            display_title = re.sub(r'[<>:"/\\|?*]', '', title)[:60]
-            safe_name = f"{str(idx+1).zfill(3)}_{display_title}"
-            await client.send_message(m.chat.id, f"⬇️ Downloading {display_title} ({idx+1}/{len(links)})")
-            # preprocess url
-            url = try_fix_drive_link(url)
-            # DRM detection
-            if is_classplus_url(url):
-                # try to get signed mpd using placeholder_get_mpd_and_keys
-                mpd, keys = placeholder_get_mpd_and_keys(url)
-                if mpd:
-                    # use mpd as URL for yt-dlp
-                    target = mpd
-                    format_filter = f"best[height<={quality}]"
-                    outpath = await helper_download_direct(target, safe_name, format_filter)
-                else:
-                    # fallback to direct yt-dlp
-                    outpath = await helper_download_direct(url, safe_name, f"best[height<={quality}]")
-            elif is_m3u8_content(url):
-                outpath = await helper_download_direct(url, safe_name, format_filter="best")
-            else:
-                outpath = await helper_download_direct(url, safe_name, format_filter=f"best[height<={quality}]")
-            if outpath:
-                cap = caption or f"📁 {display_title}\n📦 Batch: {batch_name}\nExtracted by: {CREDIT}"
-                await helper_send_vid(client, m.chat.id, cap, outpath, None, safe_name)
-                success += 1
-            else:
-                failed += 1
-                await client.send_message(m.chat.id, f"❌ Failed to download {display_title}")
-        except FloodWait as e:
-            await client.send_message(m.chat.id, f"⚠️ Rate limited. Sleeping {e.x} seconds.")
-            await asyncio.sleep(e.x)
-        except Exception as e:
-            failed += 1
-            log.exception("download loop error")
-            await client.send_message(m.chat.id, f"❌ Error for {title}: {str(e)[:200]}")
-    await client.send_message(m.chat.id, f"✅ Done. Success: {success}, Failed: {failed}")
+    options = {"quality": quality, "caption": caption, "batch_name": batch_name}
+    batch_id = db.create_batch(m.chat.id, m.from_user.id, "upload", options, links, start_idx - 1)
+    if PREFLIGHT:
+        await preflight_batch(batch_id, msg)
+    await m.reply_text(f"🔄 Starting downloads from index {start_idx} ...")
+    start_batch(client, batch_id)
 
 # -------------------------
 # DRM-specific command (more interactive flow)
 # -------------------------
 @bot.on_message(filters.command("drm") & filters.private)
+@loopwatch.handler
 @force_subscribe
 async def cmd_drm(client: Client, m: Message):
     """
     DRM flow expects .txt with lines "Name: URL" or similar.
     This will attempt to handle classplus/testbook/pw patterns via placeholder calls.
     """
+    db.record_command(m.from_user)
     prompt = await m.reply_text("📤 Send your .txt file for DRM downloads (20s to send).")
     try:
         doc = await client.listen(m.chat.id, timeout=20)
@@ -524,25 +928,12 @@ async def cmd_drm(client: Client, m: Message):
         return await prompt.edit("⏳ Timeout: send file quickly.")
     if not doc or not doc.document or not doc.document.file_name.endswith(".txt"):
         return await prompt.edit("❌ Please send a .txt file.")
-    path = await doc.download()
-    await doc.delete()
-    # read lines
+    # "Title : url" or "Title url" lines; scheme-less hosts are not DRM links
     try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            lines = [ln.strip() for ln in f if ln.strip()]
+        links = await read_link_file(client, doc, bare_domains=False)
     except Exception as e:
         return await prompt.edit("Error reading file: " + str(e))
-    os.remove(path)
-    links = []
-    for ln in lines:
-        # support "Title : url" or "Title url"
-        if "://" in ln:
-            # pick last url occurrence
-            m = URL_RE.search(ln)
-            if m:
-                url = m.group(0)
-                title = ln.replace(url, "").replace(":", "").strip() or f"File_{abs(hash(url))%10000}"
-                links.append((title, url))
+    await doc.delete()
     if not links:
         return await prompt.edit("❌ No valid DRM links found.")
     await prompt.edit(f"✅ Found {len(links)} entries. Enter start index (1..{len(links)}) or /d:")
@@ -564,42 +955,15 @@ async def cmd_drm(client: Client, m: Message):
     except Exception:
         token = None
     await prompt.edit("🔄 Processing DRM downloads ...")
-    succ = 0
-    fail = 0
-    for i in range(start-1, len(links)):
-        title, url = links[i]
-        display_title = re.sub(r'[<>:"/\\|?*]', '', title)[:60]
-        try:
-            await client.send_message(m.chat.id, f"🔐 Processing DRM: {display_title} ({i+1}/{len(links)})")
-            # If classplus, use placeholder API flow
-            if is_classplus_url(url):
-                api_call = url
-                if token:
-                    api_call = f"{url}?token={token}"
-                mpd, keys = placeholder_get_mpd_and_keys(api_call)
-                if mpd:
-                    out = await helper_download_direct(mpd, f"drm_{i+1}_{display_title}", format_filter=f"best[height<={quality}]")
-                else:
-                    out = await helper_download_direct(url, f"drm_{i+1}_{display_title}", format_filter=f"best[height<={quality}]")
-            else:
-                out = await helper_download_direct(url, f"drm_{i+1}_{display_title}", format_filter=f"best[height<={quality}]")
-            if out:
-                caption = f"🔐 {display_title}\nExtracted by {CREDIT}"
-                await helper_send_vid(client, m.chat.id, caption, out, None, display_title)
-                succ += 1
-            else:
-                fail += 1
-                await client.send_message(m.chat.id, f"❌ Failed: {display_title}")
-        except Exception as e:
-            fail += 1
-            log.exception("drm loop error")
-            await client.send_message(m.chat.id, f"❌ Error: {str(e)[:200]}")
-    await client.send_message(m.chat.id, f"✅ DRM task completed. Success: {succ}, Failed: {fail}")
+    options = {"quality": quality, "token": token}
+    batch_id = db.create_batch(m.chat.id, m.from_user.id, "drm", options, links, start - 1)
+    start_batch(client, batch_id)
 
 # -------------------------
 # Simple text message handler to accept single links and download quickly
 # -------------------------
 @bot.on_message(filters.text & filters.private)
+@loopwatch.handler
 async def quick_link_handler(client: Client, m: Message):
     if m.from_user.is_bot:
         return
@@ -607,6 +971,7 @@ async def quick_link_handler(client: Client, m: Message):
     murl = URL_RE.search(text)
     if not murl:
         return
+    db.record_command(m.from_user)
     url = murl.group(0)
     await m.reply_text("🔎 Processing link. Send quality (144/240/360/480/720/1080) or /d for 480.")
     try:
@@ -616,16 +981,14 @@ async def quick_link_handler(client: Client, m: Message):
         quality = "480"
     name = re.sub(r'[^a-zA-Z0-9]', '_', m.text)[:40] or "quick"
     await m.reply_text("⬇️ Downloading ...")
-    out = await helper_download_direct(url, f"quick_{name}", format_filter=f"best[height<={quality}]")
-    if out:
-        await helper_send_vid(client, m.chat.id, f"Downloaded: {name}", out, None, name)
-    else:
-        await m.reply_text("❌ Failed to download link.")
+    batch_id = db.create_batch(m.chat.id, m.from_user.id, "quick", {"quality": quality}, [(name, url)])
+    start_batch(client, batch_id)
 
 # -------------------------
 # Stop/restart handler
 # -------------------------
 @bot.on_message(filters.command("stop") & filters.private)
+@loopwatch.handler
 async def cmd_stop(client: Client, m: Message):
     if not db.is_admin(m.from_user.id):
         return await m.reply_text("❌ You are not authorized.")
@@ -642,8 +1005,25 @@ if __name__ == "__main__":
         log.warning("API_ID/API_HASH/BOT_TOKEN not set. Please set them in vars.py or environment.")
     # create downloads dir
     os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+    async def _main():
+        await db.connect()
+        # partial downloads of unfinished batches are kept for resuming, the rest goes
+        keep = [_job_key(b["id"], it["idx"]) for b in db.unfinished_batches() for it in db.pending_items(b["id"])]
+        workspace.sweep(keep, extra_dirs=(".",))
+        await bot.start()
+        watchdog = loopwatch.LoopWatchdog().start()
+        exporter = asyncio.create_task(metrics.exporter())
+        await resume_batches(bot)
+        await idle()
+        exporter.cancel()
+        watchdog.stop()
+        await httpclient.close()
+        ytpool.shutdown()
+        await bot.stop()
+        # last write-behind flush
+        await db.close()
     try:
-        bot.run()
+        bot.run(_main())
     except Exception as e:
         log.exception("Bot crashed: " + str(e))
         raise
@@ -0,0 +1,142 @@
+# Dedup cache of media already uploaded to Telegram.
+#
+# Maps a normalized source URL plus format/quality (and optionally the sha256
+# of the downloaded file) to the Telegram file_id of the upload, so a link
+# that was sent before is re-sent by file_id with no download or upload.
+# Entries live in SQLite with TTL and least-recently-used eviction.
+
+import os
+import time
+import hashlib
+import sqlite3
+import asyncio
+import threading
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+MEDIA_CACHE_DB = os.getenv("MEDIA_CACHE_DB", os.getenv("JOBS_DB", "jobs.sqlite3"))
+MEDIA_CACHE_MAX = int(os.getenv("MEDIA_CACHE_MAX", "20000") or 20000)
+MEDIA_CACHE_TTL = int(os.getenv("MEDIA_CACHE_TTL", str(30 * 24 * 3600)))
+# hashing multi-GB files costs CPU, so content keys are opt-in
+MEDIA_CACHE_HASH = os.getenv("MEDIA_CACHE_HASH", "0") == "1"
+
+# query parameters that never change the content (exact names, plus the utm_ family)
+_TRACKING_PARAMS = frozenset(("fbclid", "gclid", "si", "feature"))
+_TRACKING_PREFIX = "utm_"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media_cache (
+    key TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    media TEXT NOT NULL,
+    file_size INTEGER,
+    duration INTEGER,
+    thumb_id TEXT,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS media_cache_used ON media_cache (last_used);
+"""
+
+
+def _is_tracking(param: str) -> bool:
+    param = param.lower()
+    return param in _TRACKING_PARAMS or param.startswith(_TRACKING_PREFIX)
+
+
+def normalize_url(url: str) -> str:
+    """Lower-case scheme/host, drop fragments and tracking params, sort the query."""
+    parts = urlsplit(url.strip())
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if not _is_tracking(k))
+    path = parts.path or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, urlencode(query), ""))
+
+
+def url_key(url: str, fmt: str = "") -> str:
+    return f"url:{normalize_url(url)}|{fmt or ''}"
+
+
+def _sha256(path, block=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(block), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+async def content_key(path: str) -> str:
+    loop = asyncio.get_running_loop()
+    return "sha256:" + await loop.run_in_executor(None, _sha256, path)
+
+
+def media_from_message(msg) -> Optional[dict]:
+    """Pull file_id, size, duration and thumbnail out of a sent Message."""
+    for kind in ("video", "document", "audio", "photo", "animation"):
+        media = getattr(msg, kind, None) if msg else None
+        if media:
+            thumbs = getattr(media, "thumbs", None) or []
+            return {
+                "file_id": media.file_id,
+                "media": kind,
+                "file_size": getattr(media, "file_size", 0) or 0,
+                "duration": getattr(media, "duration", 0) or 0,
+                "thumb_id": thumbs[0].file_id if thumbs else None,
+            }
+    return None
+
+
+class MediaCache:
+    """file_id cache with TTL + LRU eviction and hit/miss counters."""
+
+    def __init__(self, path: str = MEDIA_CACHE_DB, max_entries: int = MEDIA_CACHE_MAX, ttl: int = MEDIA_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM media_cache WHERE key = ?", (key,)).fetchone()
+            if row and now - row["created_at"] > self.ttl:
+                self._conn.execute("DELETE FROM media_cache WHERE key = ?", (key,))
+                self.evictions += 1
+                row = None
+            if not row:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE media_cache SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return dict(row)
+
+    def put(self, key: str, media: dict):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media_cache (key, file_id, media, file_size, duration, thumb_id, created_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, media["file_id"], media.get("media", "document"), media.get("file_size", 0),
+                 media.get("duration", 0), media.get("thumb_id"), now, now))
+            count = self._conn.execute("SELECT COUNT(*) FROM media_cache").fetchone()[0]
+            if count > self.max_entries:
+                extra = count - self.max_entries
+                self._conn.execute(
+                    "DELETE FROM media_cache WHERE key IN (SELECT key FROM media_cache ORDER BY last_used LIMIT ?)",
+                    (extra,))
+                self.evictions += extra
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM media_cache WHERE key = ?", (key,))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0}
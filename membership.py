@@ -0,0 +1,114 @@
+# Cache of force-subscribe membership checks.
+#
+# force_subscribe used to call get_chat_member on every command, so each
+# /start, /upload and /drm paid an MTProto round trip and counted against
+# the flood limits. Results are now kept per user: members for
+# SUB_CACHE_TTL, non-members for the (much shorter) SUB_CACHE_NEGATIVE_TTL
+# so someone who just joined is let in soon. Concurrent checks for the same
+# user share one lookup, failed lookups are not cached, the "refresh_sub"
+# button drops the user's entry, and chat-member updates from the channel
+# keep entries current without any call.
+
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+from pyrogram.enums import ChatMemberStatus
+
+log = logging.getLogger(__name__)
+
+SUB_CACHE_TTL = int(os.getenv("SUB_CACHE_TTL", "3600") or 3600)
+SUB_CACHE_NEGATIVE_TTL = int(os.getenv("SUB_CACHE_NEGATIVE_TTL", "60") or 60)
+SUB_CACHE_MAX = int(os.getenv("SUB_CACHE_MAX", "50000") or 50000)
+
+_MEMBER_STATUSES = (ChatMemberStatus.OWNER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.MEMBER)
+
+
+def is_member(member) -> bool:
+    """Whether a ChatMember counts as subscribed (restricted users who are still in the chat do)."""
+    if member is None:
+        return False
+    if member.status in _MEMBER_STATUSES:
+        return True
+    return member.status == ChatMemberStatus.RESTRICTED and bool(getattr(member, "is_member", False))
+
+
+class MembershipCache:
+    """user_id -> subscribed, with separate TTLs for yes and no and single-flight lookups."""
+
+    def __init__(self, ttl: int = SUB_CACHE_TTL, negative_ttl: int = SUB_CACHE_NEGATIVE_TTL,
+                 max_size: int = SUB_CACHE_MAX):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[bool]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        member, expires = entry
+        if time.monotonic() >= expires:
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return member
+
+    def set(self, user_id: int, member: bool):
+        self._entries[user_id] = (member, time.monotonic() + (self.ttl if member else self.negative_ttl))
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        self._entries.pop(user_id, None)
+
+    async def check(self, user_id: int, lookup: Callable[[], Awaitable[Optional[bool]]]) -> bool:
+        """
+        Cached answer for ``user_id``, else ``await lookup()``; concurrent
+        callers for the same user share that one call. A lookup returning
+        None (an error) counts as not subscribed and is not cached.
+        """
+        cached = self.get(user_id)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        if user_id in self._inflight:
+            return bool(await asyncio.shield(self._inflight[user_id]))
+        self.misses += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[user_id] = fut
+        try:
+            member = await lookup()
+            if member is not None:
+                self.set(user_id, member)
+            fut.set_result(member)
+            return bool(member)
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()  # mark retrieved even if nobody else was waiting
+            raise
+        finally:
+            self._inflight.pop(user_id, None)
+
+    def observe(self, update):
+        """Update from a ChatMemberUpdated event of the channel (join, leave, ban, promote)."""
+        member = update.new_chat_member or update.old_chat_member
+        user = getattr(member, "user", None)
+        if user is None:
+            return
+        self.set(user.id, is_member(update.new_chat_member))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0}
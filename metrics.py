@@ -0,0 +1,192 @@
+# Minimal in-process metrics with Prometheus text exposition.
+#
+# The bot records counters, gauges and histograms here and periodically writes
+# the rendered text to METRICS_FILE. app.py (the Flask/gunicorn process) serves
+# that file on /metrics, so scraping needs no extra service or port in the bot.
+
+import os
+import time
+import asyncio
+import logging
+import functools
+import threading
+from contextlib import asynccontextmanager
+
+log = logging.getLogger(__name__)
+
+METRICS_FILE = os.getenv("METRICS_FILE", "metrics.prom")
+METRICS_INTERVAL = int(os.getenv("METRICS_INTERVAL", "15") or 15)
+
+LATENCY_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+THROUGHPUT_BUCKETS = (64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6)
+
+_lock = threading.Lock()
+_registry = {}
+_collectors = []
+
+
+def _escape(value) -> str:
+    """Label value escaped for the text exposition format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        with _lock:
+            _registry[name] = self
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with _lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            counts, total, n = self.values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, n + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for key, (counts, total, n) in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, counts):
+                le = dict(zip(self.labelnames, key), le=bound)
+                lines.append(f"{self.name}_bucket{_labels(le.keys(), le.values())} {count}")
+            inf = dict(zip(self.labelnames, key), le="+Inf")
+            lines.append(f"{self.name}_bucket{_labels(inf.keys(), inf.values())} {n}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("txtbot_stage_seconds", "Time spent per pipeline stage", ("stage",))
+STAGE_ERRORS = Counter("txtbot_stage_errors_total", "Failed stage runs", ("stage",))
+BYTES = Counter("txtbot_bytes_total", "Bytes moved", ("direction",))
+THROUGHPUT = Histogram("txtbot_throughput_bytes_per_second", "Per-transfer throughput",
+                       ("direction",), THROUGHPUT_BUCKETS)
+YTDLP_EXIT = Counter("txtbot_ytdlp_exit_total", "yt-dlp exit codes", ("code",))
+DOWNLOAD_PATH = Counter("txtbot_download_path_total", "Download path / fallback taken", ("path",))
+FLOODWAIT = Counter("txtbot_floodwait_total", "FloodWait errors received", ("where",))
+FLOODWAIT_SECONDS = Counter("txtbot_floodwait_seconds_total", "Seconds slept on FloodWait", ("where",))
+ITEMS = Counter("txtbot_items_total", "Batch items finished", ("kind", "result"))
+QUEUE = Gauge("txtbot_queue", "Scheduler / pipeline depth", ("state",))
+CACHE = Gauge("txtbot_media_cache", "Media cache counters", ("stat",))
+SUB_CACHE = Gauge("txtbot_sub_cache", "Membership cache counters", ("stat",))
+
+
+@asynccontextmanager
+async def stage(name):
+    """Time an async block into txtbot_stage_seconds{stage=name}; errors are counted too."""
+    started = time.monotonic()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.monotonic() - started, stage=name)
+
+
+def timed(name):
+    """Decorator form of stage() for coroutines."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        async def inner(*args, **kwargs):
+            async with stage(name):
+                return await fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def transfer(direction, nbytes, seconds):
+    """Record a finished download/upload of nbytes."""
+    if nbytes <= 0:
+        return
+    BYTES.inc(nbytes, direction=direction)
+    if seconds > 0:
+        THROUGHPUT.observe(nbytes / seconds, direction=direction)
+
+
+def floodwait(where, seconds):
+    FLOODWAIT.inc(where=where)
+    FLOODWAIT_SECONDS.inc(seconds, where=where)
+
+
+def add_collector(fn):
+    """Register a callable run before each render, used to refresh gauges."""
+    _collectors.append(fn)
+
+
+def render():
+    for fn in list(_collectors):
+        try:
+            fn()
+        except Exception as e:
+            log.warning(f"metrics collector failed: {e}")
+    with _lock:
+        lines = []
+        for metric in _registry.values():
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def dump(path=METRICS_FILE):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+
+async def exporter(path=METRICS_FILE, interval=METRICS_INTERVAL):
+    """Write the metrics file every interval seconds for app.py to serve."""
+    while True:
+        try:
+            dump(path)
+        except Exception as e:
+            log.warning(f"metrics dump failed: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,153 @@
+# Bounded download -> upload pipeline used by the batch handlers in main.py.
+#
+# N download workers pull items from the batch, finished items are released to
+# the upload stage strictly in index order, and M upload workers drain that
+# ordered queue. A sliding window caps how many items can be downloaded but
+# not yet uploaded, so a slow upload never lets the downloaders fill the disk.
+# Inside that window an optional priority picks which item starts next.
+
+import bisect
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+Downloader = Callable[[Any], Awaitable[Any]]
+Uploader = Callable[[Any, Any], Awaitable[bool]]
+FailureHandler = Callable[[Any, Optional[BaseException]], Awaitable[None]]
+
+
+class BatchPipeline:
+    """
+    Run ``download(item)`` concurrently and ``upload(item, result)`` in order.
+
+    ``download`` returns a truthy result (usually a file path) or None on failure.
+    ``upload`` returns True on success. ``on_failure(item, exc)`` is awaited, in
+    index order, for items whose download returned None or raised.
+    With ``upload_workers=1`` (the default) uploads reach the chat in exactly
+    the batch order; more upload workers only guarantee the order they start in.
+
+    ``priority(item)`` (optional) returns a number; among the items that fit in
+    the window the highest one is downloaded first (e.g. the biggest file, so
+    it is not left to run alone at the end). Upload order is unaffected.
+    """
+
+    def __init__(self, download: Downloader, upload: Uploader, on_failure: Optional[FailureHandler] = None,
+                 download_workers: int = 2, upload_workers: int = 1, prefetch: int = 2,
+                 priority: Optional[Callable[[Any], float]] = None):
+        self.download = download
+        self.upload = upload
+        self.on_failure = on_failure
+        self.download_workers = max(1, int(download_workers))
+        self.upload_workers = max(1, int(upload_workers))
+        self.prefetch = max(0, int(prefetch))
+        self.priority = priority
+        self.success = 0
+        self.failed = 0
+
+    def _take(self, futures, pending: List[int], head: int) -> Optional[int]:
+        # only items inside [head, head + window) may start: the head item always
+        # fits, so the window can never fill with items waiting behind it
+        limit = head + self.download_workers + self.prefetch
+        end = bisect.bisect_left(pending, limit)
+        if not end:
+            return None
+        pick = 0
+        if self.priority:
+            best = None
+            for i in range(end):
+                try:
+                    score = float(self.priority(futures[pending[i]][0]) or 0)
+                except Exception:
+                    score = 0.0
+                if best is None or score > best:
+                    best, pick = score, i
+        return pending.pop(pick)
+
+    async def _download_worker(self, futures, pending: List[int], state: dict, cond: asyncio.Condition):
+        while True:
+            async with cond:
+                while True:
+                    if not pending:
+                        return
+                    pos = self._take(futures, pending, state["head"])
+                    if pos is not None:
+                        break
+                    await cond.wait()
+            item, fut = futures[pos]
+            try:
+                result = await self.download(item)
+                fut.set_result((result, None))
+            except asyncio.CancelledError:
+                fut.set_result((None, None))
+                raise
+            except Exception as e:
+                log.exception("pipeline download error")
+                fut.set_result((None, e))
+
+    async def _sequencer(self, futures, ready: asyncio.Queue):
+        # release results in batch order, whatever order the downloads finish in
+        for pos, (item, fut) in enumerate(futures):
+            result, exc = await fut
+            await ready.put((pos, item, result, exc))
+        for _ in range(self.upload_workers):
+            await ready.put(None)
+
+    async def _upload_worker(self, ready: asyncio.Queue, state: dict, cond: asyncio.Condition):
+        while True:
+            entry = await ready.get()
+            if entry is None:
+                return
+            pos, item, result, exc = entry
+            try:
+                if result:
+                    ok = await self.upload(item, result)
+                else:
+                    ok = False
+                    if self.on_failure:
+                        await self.on_failure(item, exc)
+                if ok:
+                    self.success += 1
+                else:
+                    self.failed += 1
+            except Exception as e:
+                self.failed += 1
+                log.exception("pipeline upload error")
+                if self.on_failure:
+                    try:
+                        await self.on_failure(item, e)
+                    except Exception:
+                        pass
+            finally:
+                # slide the window past every finished item at its front
+                async with cond:
+                    state["done"].add(pos)
+                    while state["head"] in state["done"]:
+                        state["done"].discard(state["head"])
+                        state["head"] += 1
+                    cond.notify_all()
+
+    async def run(self, items: Iterable[Any]) -> Tuple[int, int]:
+        """Process every item and return ``(success, failed)``."""
+        loop = asyncio.get_running_loop()
+        futures = [(item, loop.create_future()) for item in items]
+        if not futures:
+            return 0, 0
+        pending = list(range(len(futures)))
+        state = {"head": 0, "done": set()}
+        cond = asyncio.Condition()
+        ready: asyncio.Queue = asyncio.Queue(maxsize=max(1, self.prefetch))
+        tasks = [asyncio.create_task(self._download_worker(futures, pending, state, cond))
+                 for _ in range(min(self.download_workers, len(futures)))]
+        tasks.append(asyncio.create_task(self._sequencer(futures, ready)))
+        uploaders = [asyncio.create_task(self._upload_worker(ready, state, cond))
+                     for _ in range(self.upload_workers)]
+        try:
+            await asyncio.gather(*uploaders)
+        finally:
+            for t in tasks + uploaders:
+                if not t.done():
+                    t.cancel()
+            await asyncio.gather(*tasks, *uploaders, return_exceptions=True)
+        return self.success, self.failed
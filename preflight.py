@@ -0,0 +1,134 @@
+# Pre-flight check of a batch's links before any download starts.
+#
+# Every link is probed concurrently (bounded) with test_url_accessibility and
+# classified with get_video_download_strategy, so dead links are known up
+# front instead of hours into a run. The results give the user a summary
+# (reachable / unverified / dead, total size, ETA) and give the batch runner
+# a size hint per item for the scheduler and for large-first ordering.
+
+import os
+import asyncio
+import logging
+from typing import Iterable, List, Tuple
+
+import metrics
+from core import test_url_accessibility, get_video_download_strategy, human_readable_size
+from utils import hrt
+
+log = logging.getLogger(__name__)
+
+PREFLIGHT_CONCURRENCY = int(os.getenv("PREFLIGHT_CONCURRENCY", "16") or 16)
+# aggregate download speed assumed for the ETA until real transfers were measured
+PREFLIGHT_ASSUMED_RATE = int(os.getenv("PREFLIGHT_ASSUMED_MBPS", "5") or 5) * 1024 * 1024
+
+OK = "ok"
+UNVERIFIED = "unverified"
+DEAD = "dead"
+
+# statuses that mean the link is gone whatever tool fetches it
+_GONE = (404, 410)
+
+
+def _verdict(info: dict) -> str:
+    status = int(info.get("status") or 0)
+    if info.get("accessible"):
+        return OK
+    if status in _GONE:
+        return DEAD
+    # anything else (timeouts, DNS errors, a CDN refusing HEAD with 403) may
+    # still download, so the item is tried rather than failed up front
+    return UNVERIFIED
+
+
+async def probe(url: str) -> dict:
+    """Probe one link; returns strategy, verdict, size (0 if unknown) and content type."""
+    strategy = get_video_download_strategy(url)
+    info = await test_url_accessibility(url, probe_range=True)
+    ctype = (info.get("content_type") or "").split(";")[0].strip().lower()
+    size = 0
+    # the Content-Length of an HTML page says nothing about the video behind it
+    if ctype and not ctype.startswith("text/"):
+        try:
+            size = int(info.get("content_length") or 0)
+        except ValueError:
+            size = 0
+    return {
+        "strategy": strategy,
+        "verdict": _verdict(info),
+        "status": int(info.get("status") or 0),
+        "size": size,
+        "content_type": ctype,
+        "error": info.get("error"),
+    }
+
+
+async def probe_links(links: Iterable[Tuple[int, str]], concurrency: int = PREFLIGHT_CONCURRENCY) -> List[dict]:
+    """
+    Probe ``(idx, url)`` pairs with at most ``concurrency`` requests in flight.
+    Returns one result dict per link (with ``idx`` and ``url``) in input order.
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(idx, url):
+        async with sem:
+            try:
+                result = await probe(url)
+            except Exception as e:
+                log.warning(f"pre-flight probe failed for {url}: {e}")
+                result = {"strategy": get_video_download_strategy(url), "verdict": UNVERIFIED,
+                          "status": 0, "size": 0, "content_type": "", "error": str(e)}
+        return dict(result, idx=idx, url=url)
+
+    return await asyncio.gather(*(one(idx, url) for idx, url in links))
+
+
+def download_rate(workers: int = 1) -> float:
+    """Bytes/s to plan with: mean measured download throughput times workers, else the assumed rate."""
+    observed = metrics.THROUGHPUT.values.get(("download",))
+    if observed and observed[2]:
+        _, total, n = observed
+        return total / n * max(1, workers)
+    return float(PREFLIGHT_ASSUMED_RATE)
+
+
+def summarize(results: List[dict], workers: int = 1) -> dict:
+    counts = {OK: 0, UNVERIFIED: 0, DEAD: 0}
+    known = [r["size"] for r in results if r["verdict"] != DEAD and r["size"] > 0]
+    alive = sum(1 for r in results if r["verdict"] != DEAD)
+    for r in results:
+        counts[r["verdict"]] += 1
+    total = sum(known)
+    # links without a size are assumed to be as big as the average known one
+    estimate = total + (total / len(known)) * (alive - len(known)) if known else 0
+    return {
+        "counts": counts,
+        "known_sizes": len(known),
+        "alive": alive,
+        "total_bytes": total,
+        "estimated_bytes": estimate,
+        "eta": estimate / download_rate(workers) if estimate else 0,
+        "dead": [r for r in results if r["verdict"] == DEAD],
+    }
+
+
+def format_summary(summary: dict, max_dead: int = 10) -> str:
+    c = summary["counts"]
+    lines = [
+        "🔍 Pre-flight check",
+        f"✅ Reachable: {c[OK]}",
+        f"❔ Unverified: {c[UNVERIFIED]}",
+        f"❌ Dead (skipped): {c[DEAD]}",
+    ]
+    if summary["known_sizes"]:
+        lines.append(f"📦 Size: {human_readable_size(summary['total_bytes'])} known "
+                     f"({summary['known_sizes']}/{summary['alive']} links), "
+                     f"~{human_readable_size(summary['estimated_bytes'])} estimated")
+        lines.append(f"⏱ ETA (download): ~{hrt(summary['eta']) or '0s'}")
+    else:
+        lines.append("📦 Size: unknown")
+    for r in summary["dead"][:max_dead]:
+        reason = f"HTTP {r['status']}" if r["status"] else (r.get("error") or "unreachable")[:60]
+        lines.append(f"  • #{r['idx'] + 1}: {reason}")
+    if len(summary["dead"]) > max_dead:
+        lines.append(f"  • … and {len(summary['dead']) - max_dead} more")
+    return "\n".join(lines)
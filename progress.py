@@ -0,0 +1,142 @@
+# Progress reporting for downloads and uploads.
+#
+# Each transfer gets its own Progress with an EWMA-smoothed speed and ETA
+# (no shared timer, so concurrent jobs never suppress each other's updates).
+# A transfer shown in its own reply message edits that message only when the
+# rendered text changed and the message's own interval has passed; batch
+# items instead report a line on the chat's StatusBoard, so all jobs of a
+# chat share one message.
+
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from pyrogram import Client
+from pyrogram.errors import FloodWait, MessageNotModified
+
+from ratelimit import low_priority, Throttled, status
+from utils import hrb, hrt
+
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "5") or 5)
+# weight of the newest sample in the speed average
+EWMA_ALPHA = 0.3
+# shortest window a speed sample is taken over
+SAMPLE_SECONDS = 0.5
+BAR_LENGTH = 11
+_STALE_SECONDS = 3600
+
+
+class Progress:
+    """Byte counter with smoothed speed/ETA for one transfer."""
+
+    def __init__(self, label: str = "", icon: str = "⬆️", alpha: float = EWMA_ALPHA):
+        self.label = label
+        self.icon = icon
+        self.alpha = alpha
+        self.current = 0
+        self.total = 0
+        self.speed: Optional[float] = None
+        self.started = self._sample_t = time.monotonic()
+        self._sample_b = 0
+
+    def update(self, current: int, total: int):
+        now = time.monotonic()
+        if current < self._sample_b:  # a retry restarted the count
+            self._sample_t, self._sample_b = now, current
+        dt = now - self._sample_t
+        if dt >= SAMPLE_SECONDS:
+            rate = (current - self._sample_b) / dt
+            self.speed = rate if self.speed is None else self.alpha * rate + (1 - self.alpha) * self.speed
+            self._sample_t, self._sample_b = now, current
+        self.current, self.total = current, total or 0
+
+    @property
+    def eta(self) -> Optional[float]:
+        if not self.speed or not self.total or self.current >= self.total:
+            return None
+        return (self.total - self.current) / self.speed
+
+    def line(self) -> str:
+        """Compact status line; only changes when a displayed number changes."""
+        head = f"{self.icon} {self.label}".rstrip()
+        if not self.total:
+            return f"{head}\n{hrb(self.current)} • {hrb(self.speed or 0)}/s"
+        frac = min(1.0, self.current / self.total)
+        done = int(frac * BAR_LENGTH)
+        bar = "▰" * done + "▱" * (BAR_LENGTH - done)
+        eta = hrt(self.eta, precision=2) if self.eta is not None else "-"
+        return (f"{head}\n{bar} {frac * 100:.0f}%\n"
+                f"{hrb(self.current)} / {hrb(self.total)} • {hrb(self.speed or 0)}/s • ETA {eta}")
+
+
+class MessageProgress(Progress):
+    """Progress shown by editing one reply message."""
+
+    def __init__(self, reply, label: str = "", icon: str = "⬆️", render=None,
+                 interval: float = PROGRESS_EDIT_INTERVAL):
+        super().__init__(label, icon)
+        self.reply = reply
+        self.render = render or (lambda p: p.line())
+        self.interval = interval
+        self.shown = None
+        self.edited = 0.0
+
+    async def __call__(self, current: int, total: int):
+        self.update(current, total)
+        now = time.monotonic()
+        if now - self.edited < self.interval:
+            return
+        text = self.render(self)
+        if text == self.shown:
+            return
+        self.edited = now
+        try:
+            with low_priority():
+                await self.reply.edit(text)
+            self.shown = text
+        except MessageNotModified:
+            self.shown = text
+        except (FloodWait, Throttled):
+            # cosmetic: skip this update, the limiter holds the chat back
+            pass
+
+
+_trackers: Dict[Tuple[int, int], MessageProgress] = {}
+
+
+def for_message(reply, render=None) -> MessageProgress:
+    """The tracker of a reply message, created on first use (for progress(current, total, reply) APIs)."""
+    key = (reply.chat.id, reply.id)
+    tracker = _trackers.get(key)
+    if tracker is None:
+        now = time.monotonic()
+        for k in [k for k, t in _trackers.items() if now - t._sample_t > _STALE_SECONDS]:
+            del _trackers[k]
+        tracker = _trackers[key] = MessageProgress(reply, render=render)
+    return tracker
+
+
+def done_message(reply):
+    _trackers.pop((reply.chat.id, reply.id), None)
+
+
+class StatusProgress(Progress):
+    """Progress shown as one line of the chat's shared status message."""
+
+    def __init__(self, client: Client, chat_id: int, key, label: str = "", icon: str = "⬇️"):
+        super().__init__(label, icon)
+        self.client = client
+        self.chat_id = chat_id
+        self.key = key
+
+    async def __call__(self, current: int, total: int):
+        self.update(current, total)
+        # the board coalesces: posting every callback only replaces the pending line
+        status.post(self.client, self.chat_id, self.line(), self.key)
+
+    def start(self):
+        status.post(self.client, self.chat_id, f"{self.icon} {self.label}", self.key)
+        return self
+
+    def finish(self):
+        status.clear(self.client, self.chat_id, self.key)
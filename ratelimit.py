@@ -0,0 +1,249 @@
+# Pacing for every Bot API call the bot makes.
+#
+# RateLimitedClient routes Client.invoke through token buckets: one global
+# and one per chat (tighter for groups/channels than for private chats). A
+# FloodWait blocks the chat (or everything, for calls without a chat) for
+# the retry-after period so nothing else hits the same wall. Calls made
+# under low_priority() - progress edits, status lines - never wait: when no
+# token is free, or the chat is blocked, they are skipped with Throttled and
+# the next update carries newer text anyway. Status lines go through a
+# per-chat StatusBoard that keeps one message, with a line per running job,
+# and coalesces edits.
+
+import os
+import time
+import asyncio
+import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from pyrogram import Client, raw
+from pyrogram.errors import FloodWait, MessageNotModified
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# Telegram's guidance: ~30 messages/s overall, ~1/s per private chat, 20/min per group
+API_GLOBAL_RATE = float(os.getenv("API_GLOBAL_RATE", "25") or 25)
+API_CHAT_RATE = float(os.getenv("API_CHAT_RATE", "1") or 1)
+API_GROUP_RATE = float(os.getenv("API_GROUP_RATE", str(20 / 60)) or 20 / 60)
+API_BURST = int(os.getenv("API_BURST", "3") or 3)
+# share of the global bucket low-priority calls may not use
+LOW_PRIORITY_RESERVE = 0.3
+STATUS_MIN_INTERVAL = float(os.getenv("STATUS_MIN_INTERVAL", "3") or 3)
+_IDLE_BUCKET_SECONDS = 600
+
+_low_priority = contextvars.ContextVar("low_priority", default=False)
+
+
+class Throttled(Exception):
+    """A low-priority call was skipped to keep capacity for real work."""
+
+
+def retry_after(e: FloodWait) -> int:
+    return int(getattr(e, "value", None) or getattr(e, "x", 1) or 1)
+
+
+@contextmanager
+def low_priority():
+    """Calls made inside are skipped instead of queued when the chat is busy."""
+    token = _low_priority.set(True)
+    try:
+        yield
+    finally:
+        _low_priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    def delay(self) -> float:
+        """Seconds until one token is free (0 if one is free now)."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class Limiter:
+    """Global + per-chat token buckets with FloodWait blocks."""
+
+    def __init__(self, global_rate: float = API_GLOBAL_RATE, chat_rate: float = API_CHAT_RATE,
+                 group_rate: float = API_GROUP_RATE, burst: int = API_BURST):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.chats: Dict[object, TokenBucket] = {}
+        self.blocked: Dict[object, float] = {}
+
+    def _bucket(self, key, group: bool) -> TokenBucket:
+        bucket = self.chats.get(key)
+        if bucket is None:
+            if len(self.chats) > 1000:
+                self._prune()
+            bucket = self.chats[key] = TokenBucket(self.group_rate if group else self.chat_rate, self.burst)
+        return bucket
+
+    def _prune(self):
+        cutoff = time.monotonic() - _IDLE_BUCKET_SECONDS
+        for key in [k for k, b in self.chats.items() if b.updated < cutoff]:
+            del self.chats[key]
+
+    def _blocked_for(self, key) -> float:
+        now = time.monotonic()
+        until = max(self.blocked.get(key, 0), self.blocked.get(None, 0))
+        return max(0.0, until - now)
+
+    async def acquire(self, key=None, group: bool = False, low: bool = False):
+        """Wait for a token for ``key`` (None: global only); low priority raises Throttled instead."""
+        bucket = self._bucket(key, group) if key is not None else None
+        while True:
+            wait = self._blocked_for(key)
+            if not wait:
+                wait = max(bucket.delay() if bucket else 0.0, self.global_bucket.delay())
+                if low and not wait and self.global_bucket.available() < self.global_bucket.burst * LOW_PRIORITY_RESERVE:
+                    wait = 1.0
+            if not wait:
+                if bucket:
+                    bucket.take()
+                self.global_bucket.take()
+                return
+            if low:
+                raise Throttled()
+            await asyncio.sleep(wait)
+
+    def penalize(self, key, seconds: float):
+        """Block ``key`` (None: every chat) for a FloodWait's retry-after."""
+        self.blocked[key] = max(self.blocked.get(key, 0), time.monotonic() + seconds)
+
+
+limiter = Limiter()
+
+
+def _peer_key(query):
+    peer = getattr(query, "peer", None)
+    if isinstance(peer, raw.types.InputPeerUser):
+        return ("user", peer.user_id), False
+    if isinstance(peer, raw.types.InputPeerChat):
+        return ("chat", peer.chat_id), True
+    if isinstance(peer, raw.types.InputPeerChannel):
+        return ("channel", peer.channel_id), True
+    if isinstance(peer, raw.types.InputPeerSelf):
+        return ("self", 0), False
+    return None, False
+
+
+class RateLimitedClient(Client):
+    """Client whose every API call is paced by ``limiter``."""
+
+    async def invoke(self, query, *args, **kwargs):
+        key, group = _peer_key(query)
+        await limiter.acquire(key, group, low=_low_priority.get())
+        try:
+            return await super().invoke(query, *args, **kwargs)
+        except FloodWait as e:
+            seconds = retry_after(e)
+            limiter.penalize(key, seconds)
+            metrics.floodwait(type(query).__name__, seconds)
+            log.warning(f"FloodWait {seconds}s on {type(query).__name__} for {key}")
+            raise
+
+
+class StatusBoard:
+    """
+    One status message per chat holding a line per running job; updates are
+    coalesced so the message is edited at most every ``min_interval`` seconds
+    and only when its text changed.
+    """
+
+    def __init__(self, min_interval: float = STATUS_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self.messages = {}
+        self.lines: Dict[int, Dict[object, str]] = {}
+        self.shown: Dict[int, str] = {}
+        self.tasks: Dict[int, asyncio.Task] = {}
+
+    def render(self, chat_id: int) -> str:
+        return "\n\n".join(self.lines.get(chat_id, {}).values())
+
+    def post(self, client: Client, chat_id: int, text: str, key=None):
+        """Set the chat's status line ``key`` to ``text``; never blocks the caller."""
+        self.lines.setdefault(chat_id, {})[key] = text
+        self._kick(client, chat_id)
+
+    def clear(self, client: Client, chat_id: int, key=None):
+        """Drop one job's line from the chat's status message."""
+        if self.lines.get(chat_id, {}).pop(key, None) is not None:
+            self._kick(client, chat_id)
+
+    def _kick(self, client: Client, chat_id: int):
+        task = self.tasks.get(chat_id)
+        if task is None or task.done():
+            self.tasks[chat_id] = asyncio.get_running_loop().create_task(self._flush(client, chat_id))
+
+    async def _flush(self, client: Client, chat_id: int):
+        while True:
+            text = self.render(chat_id)
+            if text == self.shown.get(chat_id, ""):
+                return
+            try:
+                with low_priority():
+                    msg = self.messages.get(chat_id)
+                    if not text:
+                        if msg is not None:
+                            await msg.delete()
+                            self.messages.pop(chat_id, None)
+                    elif msg is None:
+                        self.messages[chat_id] = await client.send_message(chat_id, text)
+                    else:
+                        await msg.edit(text)
+                self.shown[chat_id] = text
+            except (Throttled, FloodWait):
+                pass
+            except MessageNotModified:
+                self.shown[chat_id] = text
+            except Exception as e:
+                # message deleted or not editable any more: start a fresh one
+                log.debug(f"status edit failed in {chat_id}: {e}")
+                self.messages.pop(chat_id, None)
+                self.shown.pop(chat_id, None)
+            await asyncio.sleep(self.min_interval)
+
+    async def close(self, chat_id: int, text: Optional[str] = None):
+        """Stop updating the chat's status message: leave ``text`` in it, or delete it."""
+        self.lines.pop(chat_id, None)
+        task = self.tasks.pop(chat_id, None)
+        if task and not task.done():
+            task.cancel()
+        msg = self.messages.pop(chat_id, None)
+        self.shown.pop(chat_id, None)
+        if msg is None:
+            return
+        try:
+            if text:
+                await msg.edit(text)
+            else:
+                await msg.delete()
+        except Exception:
+            pass
+
+
+status = StatusBoard()
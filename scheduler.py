@@ -0,0 +1,144 @@
+# Admission control for downloads shared by every user of the bot.
+#
+# Each download asks the scheduler for a slot first. Slots are limited
+# globally and per user, waiting users are served round-robin so one huge
+# batch cannot starve everyone else, and nothing is admitted while the
+# downloads directory is short of free space (or over its scratch cap) -
+# except when nothing is running, so one oversized item cannot stall the
+# queue. An item that does not fit is skipped, not blocking other users.
+
+import os
+import shutil
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+log = logging.getLogger(__name__)
+
+GLOBAL_DOWNLOAD_SLOTS = int(os.getenv("GLOBAL_DOWNLOAD_SLOTS", "6") or 6)
+USER_DOWNLOAD_SLOTS = int(os.getenv("USER_DOWNLOAD_SLOTS", "2") or 2)
+# keep at least this much free in DOWNLOADS_DIR after admitting a download
+MIN_FREE_DISK = int(os.getenv("MIN_FREE_DISK_MB", "1024") or 1024) * 1024 * 1024
+DISK_RECHECK_SECONDS = 5
+
+
+class FairScheduler:
+    """Round-robin slot scheduler with global/per-user limits and a disk-space gate."""
+
+    def __init__(self, path: str, slots: int = GLOBAL_DOWNLOAD_SLOTS, per_user: int = USER_DOWNLOAD_SLOTS,
+                 min_free: int = MIN_FREE_DISK, room: Optional[Callable[[int], bool]] = None):
+        self.path = path
+        self.slots = max(1, slots)
+        self.per_user = max(1, per_user)
+        self.min_free = min_free
+        # extra admission check, e.g. ScratchSpace.has_room
+        self.room = room
+        self.active = {}
+        # (size_hint, written) of every admitted download; written() reports the
+        # bytes it has put on disk so far, which free space already accounts for
+        self.reservations = []
+        # user -> deque of (future, size_hint, written); insertion order is the rotation
+        self.waiting = OrderedDict()
+        self._recheck = None
+
+    def running(self) -> int:
+        return sum(self.active.values())
+
+    def queued(self) -> int:
+        return sum(len(q) for q in self.waiting.values())
+
+    def outstanding(self) -> int:
+        """Bytes the running downloads are still expected to write."""
+        total = 0
+        for size_hint, written in self.reservations:
+            done = 0
+            if written:
+                try:
+                    done = written()
+                except OSError:
+                    pass
+            total += max(0, size_hint - done)
+        return total
+
+    def _disk_ok(self, size_hint: int) -> bool:
+        need = self.outstanding() + size_hint
+        if self.room and not self.room(need):
+            return False
+        try:
+            free = shutil.disk_usage(self.path).free
+        except OSError:
+            return True
+        return free - need >= self.min_free
+
+    def _dispatch(self):
+        while self.waiting and self.running() < self.slots:
+            granted = False
+            for user in list(self.waiting):
+                queue = self.waiting[user]
+                while queue and queue[0][0].done():
+                    queue.popleft()  # cancelled waiter
+                if not queue:
+                    del self.waiting[user]
+                    continue
+                if self.active.get(user, 0) >= self.per_user:
+                    continue
+                fut, size_hint, written = queue[0]
+                # with nothing running an oversized item could never fit, so let it through
+                if self.running() and not self._disk_ok(size_hint):
+                    # try the other users' items, one that is smaller may fit
+                    self._schedule_recheck()
+                    continue
+                queue.popleft()
+                self.active[user] = self.active.get(user, 0) + 1
+                self.reservations.append((size_hint, written))
+                fut.set_result(None)
+                # served users go to the back of the rotation
+                self.waiting.move_to_end(user)
+                if not queue:
+                    del self.waiting[user]
+                granted = True
+                break
+            if not granted:
+                return
+
+    def _schedule_recheck(self):
+        if self._recheck is None:
+            self._recheck = asyncio.get_running_loop().call_later(DISK_RECHECK_SECONDS, self._run_recheck)
+
+    def _run_recheck(self):
+        self._recheck = None
+        self._dispatch()
+
+    async def acquire(self, user_id, size_hint: int = 0, written: Optional[Callable[[], int]] = None):
+        fut = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(user_id, deque()).append((fut, size_hint, written))
+        self._dispatch()
+        if not fut.done():
+            log.info(f"download for user {user_id} queued (running {self.running()}/{self.slots}, "
+                     f"waiting {self.queued()})")
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(user_id, size_hint, written)
+            raise
+
+    def release(self, user_id, size_hint: int = 0, written: Optional[Callable[[], int]] = None):
+        self.active[user_id] = self.active.get(user_id, 1) - 1
+        if self.active[user_id] <= 0:
+            del self.active[user_id]
+        try:
+            self.reservations.remove((size_hint, written))
+        except ValueError:
+            pass
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_id, size_hint: int = 0, written: Optional[Callable[[], int]] = None):
+        await self.acquire(user_id, size_hint, written)
+        try:
+            yield
+        finally:
+            self.release(user_id, size_hint, written)
@@ -0,0 +1,137 @@
+# Scratch space for downloads, one directory per batch item.
+#
+# Every item downloads into DOWNLOADS_DIR/jobs/<batch>_<idx>/, so the file a
+# downloader produced is the only thing in its directory (no guessing by name
+# prefix), and removing the directory removes the video, its thumbnail and
+# any .part/.journal left by a failed attempt. Total usage is capped so the
+# scheduler holds back new downloads while the directory is full, and a
+# startup sweep removes whatever a crash left behind that no unfinished
+# batch still needs.
+
+import os
+import time
+import shutil
+import fnmatch
+import logging
+from typing import Iterable, Optional
+
+log = logging.getLogger(__name__)
+
+# 0 disables the cap
+SCRATCH_MAX_BYTES = int(os.getenv("SCRATCH_MAX_MB", "0") or 0) * 1024 * 1024
+# leftovers of interrupted downloads/thumbnails in the working directory from older versions
+_STRAY_PATTERNS = ("*.part", "*.part-Frag*", "*.ytdl", "*.journal", "*.temp.*",
+                   "*.mp4.jpg", "*.mkv.jpg", "*.webm.jpg")
+_USAGE_TTL = 2.0
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        total += _tree_size(entry.path)
+                    else:
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return total
+
+
+class ScratchSpace:
+    """Per-item working directories under ``root``/jobs with a byte cap and a startup sweep."""
+
+    def __init__(self, root: str, max_bytes: int = SCRATCH_MAX_BYTES):
+        self.root = root
+        self.jobs_dir = os.path.join(root, "jobs")
+        self.max_bytes = max_bytes
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self._usage = (0.0, 0)
+
+    def path(self, key) -> str:
+        return os.path.join(self.jobs_dir, str(key))
+
+    def create(self, key) -> str:
+        """Make (or reuse, after a restart) the directory for ``key`` and return it."""
+        path = self.path(key)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def release(self, key):
+        """Delete everything the job left behind."""
+        shutil.rmtree(self.path(key), ignore_errors=True)
+        self._usage = (0.0, 0)
+
+    def written(self, key) -> int:
+        """Bytes currently in the directory of ``key`` (not cached)."""
+        return _tree_size(self.path(key))
+
+    def usage(self) -> int:
+        stamp, size = self._usage
+        now = time.monotonic()
+        if now - stamp > _USAGE_TTL:
+            size = _tree_size(self.jobs_dir)
+            self._usage = (now, size)
+        return size
+
+    def has_room(self, size_hint: int = 0) -> bool:
+        """Scheduler gate: stay under the cap, but never block when the space is empty."""
+        if not self.max_bytes:
+            return True
+        used = self.usage()
+        return used == 0 or used + size_hint <= self.max_bytes
+
+    def sweep(self, keep: Iterable[str] = (), extra_dirs: Iterable[str] = ()) -> int:
+        """
+        Remove job directories not in ``keep`` (items of unfinished batches,
+        whose partial files make resuming cheaper) and stray partial files and
+        thumbnails from ``root`` and ``extra_dirs``. Returns bytes freed.
+        """
+        keep = {str(k) for k in keep}
+        freed = 0
+        try:
+            entries = list(os.scandir(self.jobs_dir))
+        except OSError:
+            entries = []
+        for entry in entries:
+            if entry.name in keep:
+                continue
+            size = _tree_size(entry.path) if entry.is_dir() else entry.stat().st_size
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                _unlink(entry.path)
+            freed += size
+        for folder in (self.root, *extra_dirs):
+            freed += _sweep_strays(folder)
+        self._usage = (0.0, 0)
+        if freed:
+            log.info(f"scratch sweep freed {freed} bytes")
+        return freed
+
+
+def _unlink(path: str) -> Optional[int]:
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except OSError:
+        return None
+
+
+def _sweep_strays(folder: str) -> int:
+    freed = 0
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return 0
+    for name in names:
+        if any(fnmatch.fnmatch(name, pattern) for pattern in _STRAY_PATTERNS):
+            path = os.path.join(folder, name)
+            if os.path.isfile(path):
+                freed += _unlink(path) or 0
+    return freed
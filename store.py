@@ -0,0 +1,404 @@
+# Persistent bot settings and users: admins, authorized users, log channels,
+# channels and per-user stats.
+#
+# The data lives in MongoDB when DATABASE_URL points at one (through motor)
+# and otherwise in a local SQLite file, so the bot runs without outside
+# services. Either way the small, hot tables are mirrored in memory: the
+# is_admin / is_user_authorized checks every command makes never wait on the
+# database, and the mirror is reloaded every DB_CACHE_TTL seconds so
+# replicas sharing one Mongo see each other's changes. Writes update the
+# mirror at once and reach the backend in the background (write-behind);
+# per-user stats are summed in memory and flushed in batches every
+# DB_FLUSH_INTERVAL seconds. Batches stay in the local JobStore, which
+# Database exposes alongside so main.py has a single db object.
+
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional, Set
+
+from jobs import JobStore, JOBS_DB
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:  # Mongo is optional; SQLite is always there
+    AsyncIOMotorClient = None
+
+log = logging.getLogger(__name__)
+
+# a file of its own: JobStore writes run on the event loop and must not wait
+# on this store's transactions for the lock of a shared file
+USER_DB = os.getenv("USER_DB", "users.sqlite3")
+DATABASE_NAME = os.getenv("DATABASE_NAME", "txtbot")
+# seconds before the in-memory mirror is reloaded from the backend
+DB_CACHE_TTL = int(os.getenv("DB_CACHE_TTL", "60") or 60)
+# seconds between write-behind flushes
+DB_FLUSH_INTERVAL = float(os.getenv("DB_FLUSH_INTERVAL", "5") or 5)
+# failed flushes after which a queued change is dropped
+DB_MAX_ATTEMPTS = int(os.getenv("DB_MAX_ATTEMPTS", "10") or 10)
+# 1: only admins and users marked authorized may use the bot (default: everyone)
+AUTH_USERS_ONLY = os.getenv("AUTH_USERS_ONLY", "0") == "1"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS admins (
+    user_id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    authorized INTEGER NOT NULL DEFAULT 0,
+    first_seen REAL,
+    last_seen REAL,
+    commands INTEGER NOT NULL DEFAULT 0,
+    items INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS log_channels (
+    bot TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channels (
+    chat_id INTEGER PRIMARY KEY
+);
+"""
+
+
+class SqliteBackend:
+    """Tables in a local SQLite file; calls run in the default executor."""
+
+    def __init__(self, path: str = USER_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    def _load(self) -> dict:
+        with self._lock:
+            c = self._conn
+            return {
+                "admins": {r["user_id"] for r in c.execute("SELECT user_id FROM admins")},
+                "authorized": {r["user_id"] for r in c.execute("SELECT user_id FROM users WHERE authorized = 1")},
+                "log_channels": {r["bot"]: r["chat_id"] for r in c.execute("SELECT bot, chat_id FROM log_channels")},
+                "channels": {r["chat_id"] for r in c.execute("SELECT chat_id FROM channels")},
+            }
+
+    async def load(self) -> dict:
+        return await self._run(self._load)
+
+    def _apply(self, ops: List[tuple], stats: Dict[int, dict]):
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN")
+            try:
+                for op, *args in ops:
+                    if op == "admin":
+                        user_id, on = args
+                        cur.execute("INSERT OR IGNORE INTO admins (user_id) VALUES (?)" if on
+                                    else "DELETE FROM admins WHERE user_id = ?", (user_id,))
+                    elif op == "authorized":
+                        user_id, on = args
+                        cur.execute("INSERT INTO users (user_id, authorized, first_seen) VALUES (?, ?, ?) "
+                                    "ON CONFLICT(user_id) DO UPDATE SET authorized = excluded.authorized",
+                                    (user_id, int(on), time.time()))
+                    elif op == "log_channel":
+                        cur.execute("INSERT OR REPLACE INTO log_channels (bot, chat_id) VALUES (?, ?)", args)
+                    elif op == "channel":
+                        cur.execute("INSERT OR IGNORE INTO channels (chat_id) VALUES (?)", args)
+                cur.executemany(
+                    "INSERT INTO users (user_id, username, first_seen, last_seen, commands, items, bytes) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(user_id) DO UPDATE SET "
+                    "username = COALESCE(excluded.username, users.username), last_seen = excluded.last_seen, "
+                    "commands = users.commands + excluded.commands, items = users.items + excluded.items, "
+                    "bytes = users.bytes + excluded.bytes",
+                    [(uid, s["username"], s["last_seen"], s["last_seen"], s["commands"], s["items"], s["bytes"])
+                     for uid, s in stats.items()])
+                cur.execute("COMMIT")
+            except BaseException:
+                # never leave the transaction (and the write lock, shared with the JobStore) open
+                cur.execute("ROLLBACK")
+                raise
+
+    async def apply(self, ops: List[tuple], stats: Dict[int, dict]):
+        await self._run(self._apply, ops, stats)
+
+    async def user(self, user_id: int) -> Optional[dict]:
+        def _get():
+            with self._lock:
+                row = self._conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            return dict(row) if row else None
+        return await self._run(_get)
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class MongoBackend:
+    """The same tables as Mongo collections, through motor."""
+
+    def __init__(self, url: str, name: str = DATABASE_NAME):
+        self.client = AsyncIOMotorClient(url)
+        try:
+            self.db = self.client.get_default_database()
+        except Exception:  # no database in the URL
+            self.db = self.client[name]
+
+    async def load(self) -> dict:
+        db = self.db
+        return {
+            "admins": {d["_id"] async for d in db.admins.find({}, {"_id": 1})},
+            "authorized": {d["_id"] async for d in db.users.find({"authorized": True}, {"_id": 1})},
+            "log_channels": {d["_id"]: d["chat_id"] async for d in db.log_channels.find({})},
+            "channels": {d["_id"] async for d in db.channels.find({}, {"_id": 1})},
+        }
+
+    async def apply(self, ops: List[tuple], stats: Dict[int, dict]):
+        from pymongo import UpdateOne
+        db = self.db
+        for op, *args in ops:
+            if op == "admin":
+                user_id, on = args
+                if on:
+                    await db.admins.update_one({"_id": user_id}, {"$setOnInsert": {"since": time.time()}}, upsert=True)
+                else:
+                    await db.admins.delete_one({"_id": user_id})
+            elif op == "authorized":
+                user_id, on = args
+                await db.users.update_one({"_id": user_id}, {"$set": {"authorized": bool(on)},
+                                                             "$setOnInsert": {"first_seen": time.time()}}, upsert=True)
+            elif op == "log_channel":
+                bot, chat_id = args
+                await db.log_channels.update_one({"_id": bot}, {"$set": {"chat_id": chat_id}}, upsert=True)
+            elif op == "channel":
+                await db.channels.update_one({"_id": args[0]}, {"$setOnInsert": {"since": time.time()}}, upsert=True)
+        if stats:
+            await db.users.bulk_write([
+                UpdateOne({"_id": uid},
+                          {"$inc": {"commands": s["commands"], "items": s["items"], "bytes": s["bytes"]},
+                           "$set": {"last_seen": s["last_seen"],
+                                    **({"username": s["username"]} if s["username"] else {})},
+                           "$setOnInsert": {"first_seen": s["last_seen"], "authorized": False}},
+                          upsert=True)
+                for uid, s in stats.items()], ordered=False)
+
+    async def user(self, user_id: int) -> Optional[dict]:
+        return await self.db.users.find_one({"_id": user_id})
+
+    async def close(self):
+        self.client.close()
+
+
+def backend_from_url(url: Optional[str]):
+    """Mongo for mongodb:// URLs (when motor is installed), else SQLite (sqlite:///path or USER_DB)."""
+    url = (url or "").strip()
+    if url.startswith(("mongodb://", "mongodb+srv://")):
+        if AsyncIOMotorClient is not None:
+            return MongoBackend(url)
+        log.warning("DATABASE_URL is a Mongo URL but motor is not installed; using SQLite")
+    elif url.startswith("sqlite:///"):
+        return SqliteBackend(url[len("sqlite:///"):])
+    return SqliteBackend(USER_DB)
+
+
+class Database:
+    """
+    Bot settings/users over a backend with an in-memory mirror, plus the
+    batch job store. Reads are synchronous and never touch the backend;
+    writes are queued and flushed by the task started in connect().
+    """
+
+    def __init__(self, backend, jobs: JobStore, owner_id: int = 0):
+        self.backend = backend
+        self.jobs = jobs
+        self.owner_id = owner_id
+        self.admins: Set[int] = set()
+        self.authorized: Set[int] = set()
+        self.log_channel: Dict[str, int] = {}
+        self.channels: Set[int] = set()
+        self._ops: List[tuple] = []
+        self._stats: Dict[int, dict] = {}
+        self._attempts: Dict[tuple, int] = {}
+        self._loaded = 0.0
+        self._task = None
+        self._wake = None
+        self._closing = False
+
+    # -- lifecycle
+    async def connect(self):
+        """Load the mirror and start the write-behind/refresh task (needs the running loop)."""
+        await self._refresh()
+        self._wake = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        log.info(f"database ready ({type(self.backend).__name__}): {len(self.admins)} admins, "
+                 f"{len(self.authorized)} authorized users")
+
+    async def close(self):
+        if self._task:
+            # let a flush that is under way land instead of cancelling it halfway
+            # (its write would go on in the executor and be re-queued as well)
+            self._closing = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        await self.backend.close()
+
+    async def _refresh(self):
+        data = await self.backend.load()
+        # writes not flushed yet win over what the backend still has
+        for op, *args in self._ops:
+            if op == "admin":
+                (data["admins"].add if args[1] else data["admins"].discard)(args[0])
+            elif op == "authorized":
+                (data["authorized"].add if args[1] else data["authorized"].discard)(args[0])
+            elif op == "log_channel":
+                data["log_channels"][args[0]] = args[1]
+            elif op == "channel":
+                data["channels"].add(args[0])
+        self.admins, self.authorized = data["admins"], data["authorized"]
+        self.log_channel, self.channels = data["log_channels"], data["channels"]
+        self._loaded = time.monotonic()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), DB_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+                if time.monotonic() - self._loaded > DB_CACHE_TTL:
+                    await self._refresh()
+            except Exception as e:
+                log.warning(f"database sync failed, retrying: {e}")
+
+    async def flush(self):
+        """Write queued changes and accumulated stats to the backend."""
+        ops, stats = self._ops, self._stats
+        if not ops and not stats:
+            return
+        self._ops, self._stats = [], {}
+        try:
+            await self.backend.apply(ops, stats)
+        except BaseException as e:
+            # keep them for the next attempt, ahead of anything queued meanwhile,
+            # unless one has failed too often (it may be what breaks the batch)
+            kept = []
+            for op in ops:
+                self._attempts[op] = self._attempts.get(op, 0) + 1
+                if self._attempts[op] < DB_MAX_ATTEMPTS or isinstance(e, asyncio.CancelledError):
+                    kept.append(op)
+                else:
+                    log.error(f"dropping database change {op} after {self._attempts.pop(op)} failed flushes")
+            self._ops = kept + self._ops
+            for uid, s in stats.items():
+                self._merge_stats(uid, s)
+            raise
+        for op in ops:
+            self._attempts.pop(op, None)
+
+    def _queue(self, *op, urgent: bool = True):
+        self._ops.append(op)
+        if urgent and self._wake is not None:
+            self._wake.set()
+
+    def _merge_stats(self, user_id: int, delta: dict):
+        s = self._stats.setdefault(user_id, {"username": None, "last_seen": 0.0, "commands": 0, "items": 0, "bytes": 0})
+        s["username"] = delta.get("username") or s["username"]
+        s["last_seen"] = max(s["last_seen"], delta.get("last_seen", 0.0))
+        for k in ("commands", "items", "bytes"):
+            s[k] += delta.get(k, 0)
+
+    # -- admins and authorization (hot path: memory only)
+    def is_admin(self, user_id):
+        return user_id in self.admins or user_id == self.owner_id
+
+    def add_admin(self, user_id):
+        if user_id not in self.admins:
+            self.admins.add(user_id)
+            self._queue("admin", user_id, True)
+
+    def remove_admin(self, user_id):
+        if user_id in self.admins:
+            self.admins.discard(user_id)
+            self._queue("admin", user_id, False)
+
+    def is_user_authorized(self, user_id, bot_username=None):
+        if not AUTH_USERS_ONLY:
+            return True
+        return user_id in self.authorized or self.is_admin(user_id)
+
+    def set_user_authorized(self, user_id, authorized: bool = True):
+        (self.authorized.add if authorized else self.authorized.discard)(user_id)
+        self._queue("authorized", user_id, bool(authorized))
+
+    def is_channel_authorized(self, channel_id, bot_username=None):
+        return True
+
+    def add_channel(self, channel_id):
+        if channel_id not in self.channels:
+            self.channels.add(channel_id)
+            self._queue("channel", channel_id)
+
+    def set_log_channel(self, bot_username, cid):
+        self.log_channel[bot_username] = cid
+        self._queue("log_channel", bot_username, cid)
+        return True
+
+    def get_log_channel(self, bot_username):
+        return self.log_channel.get(bot_username)
+
+    # -- user stats (write-behind)
+    def record_command(self, user):
+        """Count a command from a pyrogram User; flushed with the next batch."""
+        if user is None:
+            return
+        self._merge_stats(user.id, {"username": getattr(user, "username", None), "last_seen": time.time(),
+                                    "commands": 1})
+
+    def record_item(self, user_id, nbytes: int = 0):
+        """Count an item delivered for ``user_id``."""
+        if user_id:
+            self._merge_stats(user_id, {"last_seen": time.time(), "items": 1, "bytes": int(nbytes or 0)})
+
+    async def user_stats(self, user_id) -> Optional[dict]:
+        await self.flush()
+        return await self.backend.user(user_id)
+
+    # -- batch job queue (local SQLite)
+    def create_batch(self, chat_id, user_id, kind, options, links, start=0):
+        return self.jobs.create_batch(chat_id, user_id, kind, options, links, start)
+
+    def get_batch(self, batch_id):
+        return self.jobs.get_batch(batch_id)
+
+    def unfinished_batches(self):
+        return self.jobs.unfinished_batches()
+
+    def pending_items(self, batch_id):
+        return self.jobs.pending_items(batch_id)
+
+    def set_item_status(self, batch_id, idx, status, error=None):
+        self.jobs.set_item_status(batch_id, idx, status, error)
+
+    def record_probes(self, batch_id, probes):
+        self.jobs.record_probes(batch_id, probes)
+
+    def batch_counts(self, batch_id):
+        return self.jobs.counts(batch_id)
+
+    def finish_batch(self, batch_id):
+        self.jobs.finish_batch(batch_id)
+
+
+def open_database(url: Optional[str] = None, owner_id: int = 0, jobs_path: str = JOBS_DB) -> Database:
+    return Database(backend_from_url(url), JobStore(jobs_path), owner_id)
@@ -0,0 +1,42 @@
+from formats import choose
+
+INFO = {"formats": [
+    {"format_id": "140", "vcodec": "none", "acodec": "mp4a.40.2", "ext": "m4a", "abr": 128},
+    {"format_id": "251", "vcodec": "none", "acodec": "opus", "ext": "webm", "abr": 160},
+    {"format_id": "sb0", "vcodec": "none", "acodec": "none", "ext": "mhtml", "format_note": "storyboard"},
+    {"format_id": "18", "vcodec": "avc1.42001E", "acodec": "mp4a.40.2", "ext": "mp4", "height": 360, "tbr": 500},
+    {"format_id": "134", "vcodec": "avc1.4d401e", "acodec": "none", "ext": "mp4", "height": 360, "tbr": 600},
+    {"format_id": "244", "vcodec": "vp9", "acodec": "none", "ext": "webm", "height": 480, "tbr": 700},
+    {"format_id": "135", "vcodec": "avc1.4d401f", "acodec": "none", "ext": "mp4", "height": 480, "tbr": 1100},
+    {"format_id": "136", "vcodec": "avc1.4d401f", "acodec": "none", "ext": "mp4", "height": 720, "tbr": 2500},
+]}
+
+
+def test_tallest_fitting_height_prefers_codec_and_merges_audio():
+    # 480p: avc1/mp4 beats vp9, and the m4a track merges into mp4
+    assert choose(INFO, 480) == "135+140"
+    assert choose(INFO, 480, vcodec="vp9") == "244+251"
+
+
+def test_height_below_every_format_takes_the_smallest():
+    # 360p ties: avc1 mp4 with audio wins, no merge needed
+    assert choose(INFO, 240) == "18"
+
+
+def test_without_height_takes_the_last_listed():
+    assert choose(INFO) == "136+140"
+
+
+def test_bitrate_stands_in_for_missing_height():
+    info = {"formats": [
+        {"format_id": "hls-400", "vcodec": "avc1", "acodec": "mp4a", "ext": "mp4", "tbr": 400},
+        {"format_id": "hls-1500", "vcodec": "avc1", "acodec": "mp4a", "ext": "mp4", "tbr": 1500},
+        {"format_id": "hls-5000", "vcodec": "avc1", "acodec": "mp4a", "ext": "mp4", "tbr": 5000},
+    ]}
+    assert choose(info, 480) == "hls-1500"
+    assert choose(info, 144) == "hls-400"
+
+
+def test_no_formats_leaves_choice_to_ytdlp():
+    assert choose({"formats": []}, 720) is None
+    assert choose({}) is None
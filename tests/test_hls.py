@@ -0,0 +1,90 @@
+import pytest
+
+pytest.importorskip("aiohttp")
+
+import hls  # noqa: E402
+
+BASE = "https://cdn.example.com/video/master.m3u8"
+
+MASTER = """#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360,CODECS="avc1.4d401e,mp4a.40.2"
+360/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=1400000,AVERAGE-BANDWIDTH=1200000,RESOLUTION=854x480
+480/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=1600000,RESOLUTION=854x480
+https://other.example.com/480b.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=3000000,RESOLUTION=1280x720
+720/index.m3u8
+"""
+
+
+def test_parse_master_resolves_variants():
+    variants = hls.parse_master(MASTER, BASE)
+    assert [v["height"] for v in variants] == [360, 480, 480, 720]
+    assert variants[0]["url"] == "https://cdn.example.com/video/360/index.m3u8"
+    assert variants[0]["codecs"] == "avc1.4d401e,mp4a.40.2"
+    assert variants[1]["bandwidth"] == 1200000          # AVERAGE-BANDWIDTH wins
+    assert variants[2]["url"] == "https://other.example.com/480b.m3u8"
+    assert not any(v["separate_audio"] for v in variants)
+
+
+def test_pick_variant():
+    variants = hls.parse_master(MASTER, BASE)
+    assert hls.pick_variant(variants, 480)["url"].endswith("480b.m3u8")
+    assert hls.pick_variant(variants, 240)["height"] == 360
+    assert hls.pick_variant(variants)["height"] == 720
+
+
+def test_separate_audio_rendition_is_flagged():
+    text = """#EXTM3U
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",NAME="en",URI="audio/en.m3u8"
+#EXT-X-STREAM-INF:BANDWIDTH=900000,RESOLUTION=640x360,AUDIO="aud"
+360.m3u8
+"""
+    assert hls.parse_master(text, BASE)[0]["separate_audio"]
+
+
+def test_parse_media_with_aes128():
+    text = """#EXTM3U
+#EXT-X-MEDIA-SEQUENCE:7
+#EXT-X-KEY:METHOD=AES-128,URI="key.bin"
+#EXTINF:6.0,
+seg7.ts
+#EXT-X-KEY:METHOD=AES-128,URI="https://keys.example.com/k2",IV=0x000102030405060708090A0B0C0D0E0F
+#EXTINF:6.0,
+seg8.ts
+#EXT-X-KEY:METHOD=NONE
+#EXTINF:6.0,
+seg9.ts
+#EXT-X-ENDLIST
+"""
+    playlist = hls.parse_media(text, "https://cdn.example.com/video/480/index.m3u8")
+    first, second, third = playlist["segments"]
+    assert playlist["endlist"] and playlist["init"] is None
+    assert first.url == "https://cdn.example.com/video/480/seg7.ts"
+    assert first.key == "https://cdn.example.com/video/480/key.bin"
+    assert first.iv == (7).to_bytes(16, "big")          # IV defaults to the sequence number
+    assert second.key == "https://keys.example.com/k2"
+    assert second.iv == bytes(range(16))
+    assert third.key is None and third.iv is None
+
+
+def test_parse_media_byteranges_and_init():
+    text = """#EXTM3U
+#EXT-X-MAP:URI="main.mp4",BYTERANGE="720@0"
+#EXTINF:4.0,
+#EXT-X-BYTERANGE:1000@720
+main.mp4
+#EXTINF:4.0,
+#EXT-X-BYTERANGE:500
+main.mp4
+"""
+    playlist = hls.parse_media(text, BASE)
+    assert playlist["init"] == {"url": "https://cdn.example.com/video/main.mp4", "byterange": (0, 720)}
+    assert [s.byterange for s in playlist["segments"]] == [(720, 1000), (1720, 500)]
+    assert not playlist["endlist"]
+
+
+def test_sample_aes_is_unsupported():
+    with pytest.raises(hls.Unsupported):
+        hls.parse_media('#EXTM3U\n#EXT-X-KEY:METHOD=SAMPLE-AES,URI="k"\nseg.ts\n', BASE)
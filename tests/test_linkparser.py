@@ -0,0 +1,47 @@
+from linkparser import LinkParser, parse_text, stable_name
+
+
+def test_title_formats():
+    text = ("Lecture 1: Intro:https://a.com/1.mp4\n"
+            "Notes | https://a.com/2.pdf\n"
+            "Class 3 - Part 2 : https://a.com/3.m3u8\n"
+            "Plain https://a.com/4.mp4 trailing words\n")
+    assert parse_text(text) == [
+        ("Lecture 1: Intro", "https://a.com/1.mp4"),
+        ("Notes", "https://a.com/2.pdf"),
+        ("Class 3 - Part 2", "https://a.com/3.m3u8"),
+        ("Plain trailing words", "https://a.com/4.mp4"),
+    ]
+
+
+def test_untitled_links_get_stable_names():
+    assert parse_text("https://a.com/v.mp4") == [(stable_name("https://a.com/v.mp4"), "https://a.com/v.mp4")]
+    assert stable_name("https://a.com/v.mp4") == stable_name("https://a.com/v.mp4")
+
+
+def test_duplicates_and_bare_domains():
+    parser = LinkParser()
+    links = parser.feed("A https://a.com/v.mp4\nB https://a.com/v.mp4#t=10\nexample.com/x.mp4\nno link here\n")
+    assert links == [("A", "https://a.com/v.mp4"), (stable_name("https://example.com/x.mp4"), "https://example.com/x.mp4")]
+    assert parser.stats() == {"lines": 4, "links": 2, "duplicates": 1}
+
+
+def test_chunked_feed_matches_whole_text():
+    text = "".join(f"Item {i}: https://a.com/{i}.mp4\r\n" for i in range(50))
+    parser = LinkParser()
+    out = []
+    for i in range(0, len(text), 7):
+        out += parser.feed(text[i:i + 7])
+    assert out + parser.close() == parse_text(text)
+
+
+def test_closing_characters_that_belong_to_the_url_are_kept():
+    assert parse_text("https://x.com/a_(b)")[0][1] == "https://x.com/a_(b)"
+    assert parse_text("Wiki https://x.com/A_(b)_c.")[0] == ("Wiki", "https://x.com/A_(b)_c")
+
+
+def test_wrapping_brackets_and_quotes_are_dropped():
+    assert parse_text("foo (https://x.com/d.pdf)") == [("foo", "https://x.com/d.pdf")]
+    assert parse_text('quote "https://x.com/b" end') == [("quote end", "https://x.com/b")]
+    assert parse_text("see https://x.com/d.pdf.") == [("see", "https://x.com/d.pdf")]
+    assert parse_text("https://.") == []
@@ -0,0 +1,14 @@
+from mediacache import normalize_url, url_key
+
+
+def test_tracking_params_dropped():
+    assert normalize_url("HTTPS://Example.com/v.mp4?utm_source=x&si=abc&b=2&a=1#t") == \
+        "https://example.com/v.mp4?a=1&b=2"
+
+
+def test_params_sharing_a_tracking_prefix_are_kept():
+    a = url_key("https://cdn.example.com/v.mp4?size=720&token=1")
+    b = url_key("https://cdn.example.com/v.mp4?size=1080&token=1")
+    assert a != b
+    for param in ("sig", "signature", "sid", "features"):
+        assert param in normalize_url(f"https://cdn.example.com/v.mp4?{param}=1")
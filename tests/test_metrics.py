@@ -0,0 +1,9 @@
+from metrics import _labels
+
+
+def test_label_values_are_escaped():
+    assert _labels(("title",), ('a\\b "c"\nd',)) == '{title="a\\\\b \\"c\\"\\nd"}'
+
+
+def test_no_labels():
+    assert _labels((), ()) == ""
@@ -0,0 +1,80 @@
+import asyncio
+
+from pipeline import BatchPipeline
+
+
+def test_uploads_follow_batch_order():
+    async def run():
+        uploaded, failed = [], []
+
+        async def download(item):
+            # later items finish first
+            await asyncio.sleep(0.01 * (5 - item))
+            return None if item == 2 else f"file{item}"
+
+        async def upload(item, result):
+            uploaded.append(item)
+            return True
+
+        async def on_failure(item, exc):
+            failed.append(item)
+
+        pipe = BatchPipeline(download, upload, on_failure, download_workers=3, prefetch=2)
+        assert await pipe.run(range(5)) == (4, 1)
+        assert uploaded == [0, 1, 3, 4]
+        assert failed == [2]
+
+    asyncio.run(run())
+
+
+def test_download_window_is_bounded():
+    async def run():
+        started = []
+        release = asyncio.Event()
+
+        async def download(item):
+            started.append(item)
+            return item + 1
+
+        async def upload(item, result):
+            await release.wait()
+            return True
+
+        pipe = BatchPipeline(download, upload, download_workers=2, prefetch=1)
+        task = asyncio.ensure_future(pipe.run(range(10)))
+        await asyncio.sleep(0.05)
+        # the first upload is stuck, so only head + workers + prefetch items start
+        assert started == [0, 1, 2]
+        release.set()
+        assert await task == (10, 0)
+
+    asyncio.run(run())
+
+
+def test_cancel_stops_workers():
+    async def run():
+        cancelled = []
+
+        async def download(item):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(item)
+                raise
+            return "never"
+
+        async def upload(item, result):
+            return True
+
+        pipe = BatchPipeline(download, upload, download_workers=2)
+        task = asyncio.ensure_future(pipe.run(range(5)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        assert sorted(cancelled) == [0, 1]
+        assert [t for t in asyncio.all_tasks() if t is not asyncio.current_task()] == []
+
+    asyncio.run(run())
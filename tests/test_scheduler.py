@@ -0,0 +1,48 @@
+import asyncio
+
+from scheduler import FairScheduler
+
+
+def _scheduler(capacity):
+    """Scheduler whose only disk check is ``outstanding + size <= capacity``."""
+    return FairScheduler("/", slots=4, per_user=2, min_free=0, room=lambda need: need <= capacity)
+
+
+def test_oversized_item_does_not_block_other_users():
+    async def run():
+        sched = _scheduler(100)
+        await sched.acquire("a", 60)           # a holds 60 of 100
+        big = asyncio.ensure_future(sched.acquire("a", 80))
+        small = asyncio.ensure_future(sched.acquire("b", 10))
+        await asyncio.sleep(0)
+        assert not big.done()
+        assert small.done()
+        assert sched.running() == 2
+        big.cancel()
+        sched._recheck and sched._recheck.cancel()
+
+    asyncio.run(run())
+
+
+def test_oversized_item_admitted_when_idle():
+    async def run():
+        sched = _scheduler(100)
+        await asyncio.wait_for(sched.acquire("a", 500), 1)
+        assert sched.running() == 1
+
+    asyncio.run(run())
+
+
+def test_written_bytes_are_not_counted_twice():
+    async def run():
+        disk = {"used": 0}
+        # the gate sees what is on disk plus what the scheduler still expects
+        sched = FairScheduler("/", slots=4, per_user=2, min_free=0,
+                              room=lambda need: disk["used"] + need <= 100)
+        await sched.acquire("a", 60, written=lambda: disk["used"])
+        disk["used"] = 30                      # a is halfway: 30 on disk + 30 to go
+        assert sched.outstanding() == 30
+        await asyncio.wait_for(sched.acquire("b", 40), 1)
+        assert sched.running() == 2
+
+    asyncio.run(run())
@@ -0,0 +1,247 @@
+# Low-level Telegram uploads built on the raw file-part API.
+#
+# Pyrogram's send_video/send_document need a complete file on disk and use a
+# fixed, small number of part workers. This module uploads from any byte
+# source instead: bytes are cut into fixed-size parts, pushed through a
+# bounded buffer and sent with upload.saveFilePart / upload.saveBigFilePart
+# by several workers spread over several media sessions, then the uploaded
+# file is attached to a message with messages.sendMedia. That lets a direct
+# HTTP download be forwarded to Telegram while it is still arriving, and
+# large files on disk upload over parallel connections.
+
+import os
+import math
+import time
+import asyncio
+import logging
+import mimetypes
+
+from pyrogram import Client, raw, types
+from pyrogram import utils as pyro_utils
+from pyrogram.errors import FloodWait
+from pyrogram.session import Session
+
+import metrics
+import httpclient
+
+log = logging.getLogger(__name__)
+
+MAX_PART_SIZE = 512 * 1024
+BIG_FILE_SIZE = 10 * 1024 * 1024
+
+
+def _part_size(kib):
+    # Telegram requires parts to divide 512 KiB evenly and be a multiple of 1 KiB
+    size = int(kib) * 1024
+    if size <= 0 or MAX_PART_SIZE % size:
+        log.warning(f"UPLOAD_PART_KB={kib} is not a divisor of 512, using 512")
+        return MAX_PART_SIZE
+    return size
+
+
+PART_SIZE = _part_size(os.getenv("UPLOAD_PART_KB", "512") or 512)
+# concurrent saveFilePart calls per upload, spread over UPLOAD_SESSIONS connections
+UPLOAD_PART_WORKERS = int(os.getenv("UPLOAD_PART_WORKERS", "4") or 4)
+UPLOAD_SESSIONS = int(os.getenv("UPLOAD_SESSIONS", "2") or 2)
+UPLOAD_PART_RETRIES = int(os.getenv("UPLOAD_PART_RETRIES", "5") or 5)
+# files below this go through Pyrogram's own uploader
+PARALLEL_UPLOAD_MIN = int(os.getenv("PARALLEL_UPLOAD_MIN", str(20 * 1024 * 1024)))
+# parts held in memory between the reader and the part workers (~16 MiB by default)
+STREAM_BUFFER_PARTS = int(os.getenv("STREAM_BUFFER_PARTS", "32") or 32)
+
+
+async def rechunk(source, part_size=PART_SIZE):
+    """Turn an async iterator of arbitrary byte chunks into exact part_size parts."""
+    buf = bytearray()
+    async for chunk in source:
+        buf += chunk
+        while len(buf) >= part_size:
+            yield bytes(buf[:part_size])
+            del buf[:part_size]
+    if buf:
+        yield bytes(buf)
+
+
+async def _media_session(client: Client) -> Session:
+    session = Session(client, await client.storage.dc_id(), await client.storage.auth_key(),
+                      await client.storage.test_mode(), is_media=True)
+    await session.start()
+    return session
+
+
+async def _save_part(session: Session, rpc, index: int):
+    """Send one part, retrying only this part on failure."""
+    attempt = 0
+    while True:
+        try:
+            return await session.invoke(rpc)
+        except FloodWait as e:
+            wait = getattr(e, "value", None) or getattr(e, "x", 1)
+            metrics.floodwait("upload_part", wait)
+            await asyncio.sleep(wait)
+        except (OSError, asyncio.TimeoutError, ConnectionError) as e:
+            attempt += 1
+            if attempt > UPLOAD_PART_RETRIES:
+                raise
+            log.warning(f"upload part {index} retry {attempt}/{UPLOAD_PART_RETRIES}: {e}")
+            await asyncio.sleep(min(2 ** attempt, 30))
+
+
+async def upload_parts(client: Client, parts, total_size: int, file_name: str, part_size: int = PART_SIZE,
+                       workers: int = None, sessions: int = None, progress=None, progress_args=()):
+    """
+    Upload ``total_size`` bytes from ``parts``, an async iterator of byte strings
+    exactly ``part_size`` long (only the last may be shorter).
+
+    A reader fills a queue of at most STREAM_BUFFER_PARTS parts, so memory
+    stays bounded however far the source gets ahead of the upload. ``workers``
+    part uploaders drain it over ``sessions`` media connections; ``progress``
+    is awaited as progress(current, total, *progress_args) like Pyrogram's.
+    Returns the raw InputFile/InputFileBig to attach to a message.
+    """
+    if total_size <= 0:
+        raise ValueError("part upload needs the size up front")
+    workers = max(1, workers or UPLOAD_PART_WORKERS)
+    total_parts = math.ceil(total_size / part_size)
+    is_big = total_size > BIG_FILE_SIZE
+    if not is_big:
+        # small files must be uploaded with saveFilePart; keep it simple
+        workers = 1
+    sessions = max(1, min(sessions or UPLOAD_SESSIONS, workers))
+    file_id = client.rnd_id()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_BUFFER_PARTS)
+    uploaded = 0
+
+    async def produce():
+        # errors travel through the queue so the workers see them
+        try:
+            sent = 0
+            index = 0
+            async for part in parts:
+                await queue.put((index, part))
+                sent += len(part)
+                index += 1
+            if sent != total_size:
+                raise IOError(f"source ended at {sent}/{total_size} bytes")
+        except Exception as e:
+            await queue.put((-1, e))
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def work(session):
+        nonlocal uploaded
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                return
+            index, part = entry
+            if isinstance(part, Exception):
+                raise part
+            if is_big:
+                rpc = raw.functions.upload.SaveBigFilePart(file_id=file_id, file_part=index,
+                                                          file_total_parts=total_parts, bytes=part)
+            else:
+                rpc = raw.functions.upload.SaveFilePart(file_id=file_id, file_part=index, bytes=part)
+            await _save_part(session, rpc, index)
+            uploaded += len(part)
+            if progress:
+                try:
+                    await progress(uploaded, total_size, *progress_args)
+                except Exception:
+                    pass
+
+    pool = [await _media_session(client) for _ in range(sessions)]
+    started = time.time()
+    producer = asyncio.create_task(produce())
+    tasks = [asyncio.create_task(work(pool[i % sessions])) for i in range(workers)]
+    try:
+        await asyncio.gather(*tasks)
+        await producer
+    finally:
+        for t in tasks + [producer]:
+            if not t.done():
+                t.cancel()
+        await asyncio.gather(*tasks, producer, return_exceptions=True)
+        for session in pool:
+            await session.stop()
+    elapsed = max(time.time() - started, 1e-6)
+    metrics.transfer("upload", total_size, elapsed)
+    log.info(f"uploaded {file_name}: {total_size} bytes in {elapsed:.1f}s "
+             f"({total_size / elapsed / 1048576:.2f} MiB/s, {workers} workers, {sessions} sessions)")
+    if is_big:
+        return raw.types.InputFileBig(id=file_id, parts=total_parts, name=file_name)
+    return raw.types.InputFile(id=file_id, parts=total_parts, name=file_name, md5_checksum="")
+
+
+async def upload_stream(client: Client, source, total_size: int, file_name: str, part_size: int = PART_SIZE, **kwargs):
+    """Upload from an async iterator of arbitrary-sized chunks (e.g. an HTTP body)."""
+    return await upload_parts(client, rechunk(source, part_size), total_size, file_name, part_size, **kwargs)
+
+
+async def _file_parts(path: str, part_size: int):
+    loop = asyncio.get_running_loop()
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        offset = 0
+        while True:
+            part = await loop.run_in_executor(None, os.pread, fd, part_size, offset)
+            if not part:
+                return
+            offset += len(part)
+            yield part
+    finally:
+        os.close(fd)
+
+
+async def upload_file(client: Client, path: str, part_size: int = PART_SIZE, **kwargs):
+    """Upload a file from disk with parallel part workers; returns the raw InputFile."""
+    size = os.path.getsize(path)
+    return await upload_parts(client, _file_parts(path, part_size), size, os.path.basename(path), part_size, **kwargs)
+
+
+async def send_file_parallel(client: Client, chat_id, path: str, caption: str = "", thumb: str = None,
+                             duration: int = 0, width: int = 0, height: int = 0, progress=None, progress_args=()):
+    """Upload ``path`` with upload_file and post it; returns the sent Message."""
+    input_file = await upload_file(client, path, progress=progress, progress_args=progress_args)
+    thumb_file = await client.save_file(thumb) if thumb and os.path.exists(thumb) else None
+    return await send_uploaded(client, chat_id, input_file, os.path.basename(path), caption,
+                               duration, width, height, thumb_file)
+
+
+async def send_uploaded(client: Client, chat_id, input_file, file_name: str, caption: str = "",
+                        duration: int = 0, width: int = 0, height: int = 0, thumb=None):
+    """Attach an uploaded file to a new message; videos get streaming attributes."""
+    mime = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+    attributes = [raw.types.DocumentAttributeFilename(file_name=file_name)]
+    if mime.startswith("video/"):
+        attributes.append(raw.types.DocumentAttributeVideo(supports_streaming=True, duration=int(duration or 0),
+                                                           w=int(width or 0), h=int(height or 0)))
+    media = raw.types.InputMediaUploadedDocument(mime_type=mime, file=input_file, thumb=thumb, attributes=attributes)
+    r = await client.invoke(raw.functions.messages.SendMedia(
+        peer=await client.resolve_peer(chat_id),
+        media=media,
+        random_id=client.rnd_id(),
+        **await pyro_utils.parse_text_entities(client, caption, None, None)))
+    for update in r.updates:
+        if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await types.Message._parse(client, update.message,
+                                              {u.id: u for u in r.users}, {c.id: c for c in r.chats})
+    return None
+
+
+async def stream_url_to_chat(client: Client, chat_id, url: str, file_name: str, caption: str = "", headers=None,
+                             progress=None, progress_args=()):
+    """
+    Download ``url`` and upload it to ``chat_id`` at the same time, never
+    touching the disk. Needs a server that reports Content-Length.
+    Returns the sent Message.
+    """
+    session = await httpclient.get_session()
+    async with session.get(url, allow_redirects=True, headers={**(headers or {}), "Accept-Encoding": "identity"}) as resp:
+        if resp.status != 200:
+            raise IOError(f"HTTP {resp.status} for {url}")
+        size = int(resp.headers.get("content-length") or 0)
+        log.info(f"streaming {url} -> chat {chat_id} ({size} bytes)")
+        input_file = await upload_stream(client, resp.content.iter_chunked(PART_SIZE), size, file_name,
+                                         progress=progress, progress_args=progress_args)
+    return await send_uploaded(client, chat_id, input_file, file_name, caption)
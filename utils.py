@@ -2,22 +2,8 @@
 # Subscribe YouTube Channel For Amazing Bot https://youtube.com/@roxybasicneedbot
 # Ask Doubt on telegram https://t.me/roxybasicneedbot1
 
-import time
 import math
 import os
-from pyrogram.errors import FloodWait
-
-class Timer:
-    def __init__(self, time_between=3):
-        self.start_time = time.time()
-        self.time_between = time_between
-
-    def can_send(self):
-        if time.time() > (self.start_time + self.time_between):
-            self.start_time = time.time()
-            return True
-        return False
-
 
 from datetime import datetime,timedelta
 
@@ -67,35 +53,22 @@ def hrt(seconds, precision = 0):
 
 
 
-timer = Timer()
-
-async def progress_bar(current, total, reply, start):
-    if timer.can_send():
-        now = time.time()
-        diff = now - start
-        if diff < 1:
-            return
-        else:
-            perc = f"{current * 100 / total:.1f}%"
-            elapsed_time = round(diff)
-            speed = current / elapsed_time
-            remaining_bytes = total - current
-            if speed > 0:
-                eta_seconds = remaining_bytes / speed
-                eta = hrt(eta_seconds, precision=1)
-            else:
-                eta = "-"
-            sp = str(hrb(speed)) + "/s"
-            tot = hrb(total)
-            cur = hrb(current)
-            bar_length = 11
-            completed_length = int(current * bar_length / total)
-            remaining_length = bar_length - completed_length
-            progress_bar = "▰" * completed_length + "▱" * remaining_length
-            
-            try:
-                await reply.edit(f'<b>\n ╭──⌯════🆄︎ᴘʟᴏᴀᴅɪɴɢ⬆️⬆️═════⌯──╮ \n├⚡ {progress_bar}|﹝{perc}﹞ \n├🚀 Speed » {sp} \n├📟 Processed » {cur}\n├🧲 Size - ETA » {tot} - {eta} \n├🤖 𝔹ʏ » @roxybasicneedbot1\n╰─═══ ✪ @roxybasicneedbot1 ✪ ═══─╯\n</b>') 
-            except FloodWait as e:
-                time.sleep(e.x)
+def _upload_box(p):
+    """The upload progress box, drawn from a progress.Progress."""
+    perc = f"{p.current * 100 / p.total:.1f}%" if p.total else "-"
+    eta = hrt(p.eta, precision=1) if p.eta is not None else "-"
+    sp = str(hrb(p.speed or 0)) + "/s"
+    bar_length = 11
+    completed_length = int(p.current * bar_length / p.total) if p.total else 0
+    remaining_length = bar_length - completed_length
+    progress_bar = "▰" * completed_length + "▱" * remaining_length
+    return f'<b>\n ╭──⌯════🆄︎ᴘʟᴏᴀᴅɪɴɢ⬆️⬆️═════⌯──╮ \n├⚡ {progress_bar}|﹝{perc}﹞ \n├🚀 Speed » {sp} \n├📟 Processed » {hrb(p.current)}\n├🧲 Size - ETA » {hrb(p.total)} - {eta} \n├🤖 𝔹ʏ » @roxybasicneedbot1\n╰─═══ ✪ @roxybasicneedbot1 ✪ ═══─╯\n</b>'
 
 
+async def progress_bar(current, total, reply, start):
+    # each reply message has its own tracker, so parallel uploads no longer share one timer;
+    # imported here because progress itself uses hrb/hrt from this module
+    from progress import for_message, done_message
+    await for_message(reply, render=_upload_box)(current, total)
+    if total and current >= total:
+        done_message(reply)
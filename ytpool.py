@@ -0,0 +1,410 @@
+# Warm yt-dlp workers shared by every download in the bot.
+#
+# Running the yt-dlp CLI per link pays interpreter start-up and the import of
+# every extractor each time. Instead a small process pool imports yt_dlp once
+# per worker and keeps YoutubeDL instances around, keyed by their options, so
+# a batch of links with the same flags reuses one warm instance (and its HTTP
+# connections). Jobs take the same argv as the CLI, parsed with
+# yt_dlp.parse_options, so format filters like best[height<=480] behave
+# exactly as before. Each worker is this file run as a script (so the bot's
+# main module is never imported in it): requests are JSON lines on its
+# stdin, progress and the result come back as JSON lines on its stdout. A job
+# that times out or is cancelled gets its worker killed, together with any
+# ffmpeg it started, and a fresh worker takes the slot on the next job.
+# Metadata-only extraction (the -J JSON) runs in the same workers, and a
+# download can be handed that JSON back so the page is not extracted twice.
+# When yt_dlp cannot be imported or YTDLP_POOL_WORKERS=0 the CLI is used.
+
+import os
+import sys
+import json
+import time
+import shlex
+import signal
+import asyncio
+import logging
+import itertools
+import threading
+import importlib.util
+from collections import OrderedDict
+from typing import List, Optional, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+# one warm worker per global download slot unless told otherwise
+YTDLP_POOL_WORKERS = int(os.getenv("YTDLP_POOL_WORKERS", os.getenv("GLOBAL_DOWNLOAD_SLOTS", "6")) or 0)
+# warm YoutubeDL instances kept per worker (one per distinct option set)
+YTDLP_POOL_INSTANCES = int(os.getenv("YTDLP_POOL_INSTANCES", "8") or 8)
+# seconds between progress messages per job
+PROGRESS_INTERVAL = 1.0
+# longest reply line read from a worker (extract() returns the whole -J JSON)
+_LINE_LIMIT = 64 * 1024 * 1024
+
+# only the workers import yt_dlp; the bot process just checks it is there
+HAVE_YTDLP = importlib.util.find_spec("yt_dlp") is not None
+
+# -------------------------
+# worker side
+# -------------------------
+_out = None
+_out_lock = threading.Lock()
+_instances = OrderedDict()
+_job = None
+_last_report = 0.0
+
+
+def _send(msg: dict):
+    # concurrent fragment downloads call the progress hook from several threads
+    with _out_lock:
+        _out.write(json.dumps(msg, default=str) + "\n")
+        _out.flush()
+
+
+def _hook(d):
+    global _last_report
+    if _job is None or _out is None:
+        return
+    now = time.monotonic()
+    finished = d.get("status") == "finished"
+    if not finished and now - _last_report < PROGRESS_INTERVAL:
+        return
+    _last_report = now
+    total = d.get("total_bytes") or d.get("total_bytes_estimate") or 0
+    try:
+        _send({"id": _job, "progress": [int(d.get("downloaded_bytes") or 0), int(total),
+                                        d.get("speed") or 0, d.get("eta") or 0]})
+    except Exception:
+        pass
+
+
+def _instance(opts: dict):
+    import yt_dlp
+    key = repr(sorted((k, repr(v)) for k, v in opts.items()))
+    ydl = _instances.get(key)
+    if ydl is not None:
+        _instances.move_to_end(key)
+        return ydl
+    ydl = yt_dlp.YoutubeDL(dict(opts, quiet=True, noprogress=True))
+    ydl.add_progress_hook(_hook)
+    _instances[key] = ydl
+    while len(_instances) > YTDLP_POOL_INSTANCES:
+        _, old = _instances.popitem(last=False)
+        close = getattr(old, "close", None)
+        if close:
+            close()
+    return ydl
+
+
+def _set_outtmpl(ydl, outtmpl):
+    from yt_dlp.utils import DEFAULT_OUTTMPL
+    tmpl = dict(outtmpl) if isinstance(outtmpl, dict) else ({"default": outtmpl} if outtmpl else {})
+    for k, v in DEFAULT_OUTTMPL.items():
+        tmpl.setdefault(k, v)
+    ydl.params["outtmpl"] = tmpl
+    if hasattr(ydl, "outtmpl_dict"):  # older yt-dlp keeps a parsed copy
+        ydl.outtmpl_dict = tmpl
+
+
+def _prepare(argv: List[str]):
+    import yt_dlp
+    try:
+        parsed = yt_dlp.parse_options(argv)
+    except SystemExit as e:
+        raise ValueError(f"bad yt-dlp arguments: {e}")
+    if not parsed.urls:
+        raise ValueError("no URL given")
+    opts = dict(parsed.ydl_opts)
+    outtmpl = opts.pop("outtmpl", None)
+    ydl = _instance(opts)
+    _set_outtmpl(ydl, outtmpl)
+    ydl._download_retcode = 0
+    return ydl, parsed.urls[0]
+
+
+def _run_extract(argv: List[str]) -> Tuple[int, Optional[dict], str]:
+    """Metadata only, like ``yt-dlp -J``; returns (rc, sanitized info dict, error text)."""
+    import yt_dlp
+    try:
+        ydl, url = _prepare(argv)
+        info = ydl.extract_info(url, download=False)
+        return 0, ydl.sanitize_info(info), ""
+    except ValueError as e:
+        return 2, None, str(e)
+    except yt_dlp.utils.DownloadError as e:
+        return 1, None, str(e)
+    except Exception as e:
+        return 1, None, f"{type(e).__name__}: {e}"
+
+
+def _run_job(job_id: int, argv: List[str], info: Optional[dict] = None) -> Tuple[int, Optional[str], str]:
+    """
+    Run one CLI-style yt-dlp download in this worker; returns (rc, file path,
+    error text). With ``info`` (from _run_extract) the page is not extracted
+    again, only the formats are selected and fetched.
+    """
+    global _job, _last_report
+    import yt_dlp
+    try:
+        ydl, url = _prepare(argv)
+    except ValueError as e:
+        return 2, None, str(e)
+    _job, _last_report = job_id, 0.0
+    try:
+        if info:
+            info = ydl.process_ie_result(info, download=True)
+        else:
+            info = ydl.extract_info(url, download=True)
+    except yt_dlp.utils.DownloadError as e:
+        return 1, None, str(e)
+    except Exception as e:
+        return 1, None, f"{type(e).__name__}: {e}"
+    finally:
+        _job = None
+    path = None
+    if info:
+        downloads = info.get("requested_downloads") or []
+        path = (downloads[-1].get("filepath") if downloads else None) or ydl.prepare_filename(info)
+        if path and not os.path.exists(path):
+            path = None
+    return ydl._download_retcode or 0, path, ""
+
+
+def _serve():
+    """Worker main loop: one request per stdin line, answered on stdout, until EOF."""
+    global _out
+    # replies go to the original stdout; anything yt-dlp (or ffmpeg) prints lands on stderr
+    _out = os.fdopen(os.dup(1), "w")
+    os.dup2(2, 1)
+    import yt_dlp
+    # pay for the extractor import once, not per link
+    yt_dlp.extractor.gen_extractor_classes()
+    for line in sys.stdin:
+        req = json.loads(line)
+        if req["op"] == "extract":
+            result = _run_extract(req["argv"])
+        else:
+            result = _run_job(req["id"], req["argv"], req.get("info"))
+        _send({"id": req["id"], "result": list(result)})
+
+
+# -------------------------
+# bot side
+# -------------------------
+class WorkerDied(Exception):
+    pass
+
+
+class _Worker:
+    """One warm worker process."""
+
+    def __init__(self, proc):
+        self.proc = proc
+
+    @classmethod
+    async def spawn(cls) -> "_Worker":
+        # own session, so kill() also takes down the ffmpeg/aria2c it started
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=_LINE_LIMIT,
+            start_new_session=True)
+        return cls(proc)
+
+    def alive(self) -> bool:
+        return self.proc.returncode is None
+
+    async def call(self, request: dict, on_progress=None) -> tuple:
+        try:
+            self.proc.stdin.write((json.dumps(request) + "\n").encode())
+            await self.proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise WorkerDied(e)
+        while True:
+            line = await self.proc.stdout.readline()
+            if not line:
+                raise WorkerDied(f"exit code {await self.proc.wait()}")
+            msg = json.loads(line)
+            if msg.get("id") != request["id"]:
+                continue
+            if "progress" in msg:
+                if on_progress:
+                    on_progress(*msg["progress"])
+                continue
+            return tuple(msg["result"])
+
+    def kill(self):
+        if self.alive():
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+class YtdlpPool:
+    """Warm yt-dlp worker processes; ``run()`` is awaited like a subprocess call."""
+
+    def __init__(self, workers: int = YTDLP_POOL_WORKERS):
+        self.workers = max(1, workers)
+        self._idle: List[_Worker] = []
+        self._all: Set[_Worker] = set()
+        self._slots = None
+        self._ids = itertools.count(1)
+
+    async def run(self, argv: List[str], progress=None, timeout: Optional[float] = None,
+                  info: Optional[dict] = None) -> Tuple[int, Optional[str], str]:
+        """
+        Run yt-dlp with CLI arguments (without the program name) in a warm
+        worker. ``progress`` is awaited as progress(downloaded, total).
+        Returns (returncode, downloaded file path or None, error text).
+        On a timeout or cancellation the worker is killed, like run_process does.
+        """
+        request = {"id": next(self._ids), "op": "download", "argv": list(argv), "info": info}
+        if not progress:
+            return await self._submit(timeout, request)
+        # one reporter per job awaits the newest numbers only, so a slow
+        # callback never stalls reading the worker and none runs after we return
+        latest = None
+        pending = asyncio.Event()
+
+        def on_progress(done, total, speed, eta):
+            nonlocal latest
+            latest = (done, total)
+            pending.set()
+
+        async def report():
+            while True:
+                await pending.wait()
+                pending.clear()
+                await _safe_progress(progress, *latest)
+
+        reporter = asyncio.get_running_loop().create_task(report())
+        try:
+            return await self._submit(timeout, request, on_progress)
+        finally:
+            reporter.cancel()
+            await asyncio.gather(reporter, return_exceptions=True)
+
+    async def extract(self, argv: List[str], timeout: Optional[float] = None) -> Tuple[int, Optional[dict], str]:
+        """Metadata-only extraction in a warm worker; returns (returncode, info dict or None, error text)."""
+        return await self._submit(timeout, {"id": next(self._ids), "op": "extract", "argv": list(argv)})
+
+    async def _worker(self) -> _Worker:
+        while self._idle:
+            worker = self._idle.pop()
+            if worker.alive():
+                return worker
+            self._all.discard(worker)
+        worker = await _Worker.spawn()
+        self._all.add(worker)
+        if len(self._all) == 1:
+            log.info(f"yt-dlp pool started (up to {self.workers} workers)")
+        return worker
+
+    def _discard(self, worker: Optional[_Worker]):
+        if worker is not None:
+            worker.kill()
+            self._all.discard(worker)
+
+    async def _submit(self, timeout, request, on_progress=None):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        async with self._slots:
+            worker = None
+            try:
+                worker = await self._worker()
+                result = await asyncio.wait_for(worker.call(request, on_progress), timeout)
+            except asyncio.TimeoutError:
+                self._discard(worker)
+                return -1, None, f"yt-dlp timed out after {timeout}s"
+            except asyncio.CancelledError:
+                # stop the download now, not when it would have finished
+                self._discard(worker)
+                raise
+            except (OSError, ValueError, WorkerDied) as e:
+                # died (OOM, segfault in a native lib) or sent garbage; the next job gets a fresh one
+                log.error(f"yt-dlp worker failed: {e}")
+                self._discard(worker)
+                return 1, None, f"yt-dlp worker died: {e}"
+            self._idle.append(worker)
+            return result
+
+    def shutdown(self):
+        for worker in list(self._all):
+            self._discard(worker)
+        self._idle.clear()
+
+
+async def _safe_progress(progress, done, total):
+    try:
+        await progress(done, total)
+    except Exception:
+        pass
+
+
+_pool = None
+
+
+def enabled() -> bool:
+    return HAVE_YTDLP and YTDLP_POOL_WORKERS > 0
+
+
+def _argv(argv) -> List[str]:
+    if isinstance(argv, str):
+        argv = shlex.split(argv)
+    argv = list(argv)
+    if argv and os.path.basename(argv[0]) == "yt-dlp":
+        argv = argv[1:]
+    return argv
+
+
+def _get_pool() -> YtdlpPool:
+    global _pool
+    if _pool is None:
+        _pool = YtdlpPool()
+    return _pool
+
+
+async def download(argv, progress=None, timeout: Optional[float] = None,
+                   info: Optional[dict] = None) -> Tuple[int, Optional[str], str]:
+    """
+    yt-dlp entry point used by core and main: ``argv`` is the CLI argument list
+    or a command string (a leading "yt-dlp" is dropped). Runs in the warm pool
+    when available, else through the CLI with core.run_process. Returns
+    (returncode, path of the finished file or None, error text).
+    ``info`` is a previous extract() result for the same URL to skip re-extraction.
+    """
+    argv = _argv(argv)
+    if enabled():
+        return await _get_pool().run(argv, progress, timeout, info)
+    from core import run_process
+    # have the CLI report where the finished file ended up
+    rc, out, err = await run_process(["yt-dlp", "--print", "after_move:filepath", *argv], timeout=timeout)
+    lines = [ln.strip() for ln in (out or "").splitlines() if ln.strip()]
+    path = lines[-1] if lines and os.path.exists(lines[-1]) else None
+    return rc, path, err
+
+
+async def extract(argv, timeout: Optional[float] = 120) -> Tuple[int, Optional[dict], str]:
+    """Equivalent of ``yt-dlp -J``: returns (returncode, info dict or None, error text)."""
+    argv = _argv(argv)
+    if enabled():
+        return await _get_pool().extract(argv, timeout)
+    from core import run_process
+    rc, out, err = await run_process(["yt-dlp", "-J", *argv], timeout=timeout)
+    if rc != 0:
+        return rc, None, err
+    try:
+        return 0, json.loads(out), ""
+    except ValueError as e:
+        return 1, None, f"bad -J output: {e}"
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+if __name__ == "__main__":
+    _serve()